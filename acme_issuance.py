@@ -0,0 +1,112 @@
+"""Native ACME client issuing BlockVoke certificates from pebble
+
+The ACME account is registered once and shared by every order, and
+orders can be submitted concurrently from many threads, each thread with
+its own ACME client.  The certificates are written directly to their
+`working_dir/certificates/<DNS>-*.pem` paths.
+
+The challenges are answered but not served, so pebble must run with
+`PEBBLE_VA_ALWAYS_VALID=1`.
+
+"""
+
+import datetime
+import threading
+
+import josepy as jose
+from acme import client, challenges, messages
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+PEBBLE_DIRECTORY = "https://localhost:14000/dir"
+ACME_ACCOUNT_KEY_SIZE = 2048
+# Seconds to wait for an order to be valid and its certificate issued
+ACME_ORDER_TIMEOUT = 90
+ACME_USER_AGENT = "blockvoke-acme-issuance"
+
+def split_pem_chain(fullchain_pem):
+    """Returns the PEM certificates of a chain, leaf first
+
+    """
+    end_marker = "-----END CERTIFICATE-----"
+    return [certificate + end_marker + "\n"
+            for certificate in (block.lstrip() for block in fullchain_pem.split(end_marker))
+            if certificate]
+
+class ACMEIssuer(object):
+    def __init__(self,
+                 email,
+                 directory_url=PEBBLE_DIRECTORY,
+                 verify_ssl=False,
+                 order_timeout=ACME_ORDER_TIMEOUT):
+        """Registers a new ACME account with `email`
+
+        pebble serves its directory with its own test CA, hence
+        `verify_ssl` is off by default.
+
+        """
+        self.directory_url = directory_url
+        self.verify_ssl = verify_ssl
+        self.order_timeout = order_timeout
+        self.account_key = jose.JWKRSA(key=rsa.generate_private_key(public_exponent=65537,
+                                                                    key_size=ACME_ACCOUNT_KEY_SIZE))
+        self.__local__ = threading.local()
+        self.directory = None
+        self.account = None
+
+        acme_client = self.get_client()
+        self.account = acme_client.new_account(messages.NewRegistration.from_data(email=email,
+                                                                                 terms_of_service_agreed=True))
+
+    def get_client(self) -> client.ClientV2:
+        """Returns the ACME client of the calling thread
+
+        """
+        if getattr(self.__local__, "client", None) is None:
+            net = client.ClientNetwork(self.account_key,
+                                       account=self.account,
+                                       verify_ssl=self.verify_ssl,
+                                       user_agent=ACME_USER_AGENT)
+            if self.directory is None:
+                self.directory = client.ClientV2.get_directory(self.directory_url, net)
+            self.__local__.client = client.ClientV2(self.directory, net)
+        return self.__local__.client
+
+    def issue(self, csr_pem) -> str:
+        """Orders a certificate for `csr_pem` and returns its full chain,
+        leaf first
+
+        """
+        acme_client = self.get_client()
+        order = acme_client.new_order(csr_pem)
+
+        for authorization in order.authorizations:
+            if authorization.body.status == messages.STATUS_VALID:
+                continue
+            for challenge_body in authorization.body.challenges:
+                if isinstance(challenge_body.chall, challenges.HTTP01):
+                    acme_client.answer_challenge(challenge_body, challenge_body.chall.response(self.account_key))
+                    break
+            else:
+                raise Exception("No http-01 challenge offered for `{}`".format(authorization.body.identifier.value))
+
+        order = acme_client.poll_and_finalize(order,
+                                              datetime.datetime.now() + datetime.timedelta(seconds=self.order_timeout))
+        return order.fullchain_pem
+
+    def issue_certificate(self, DNS, working_dir="./working_dir"):
+        """Issues the certificate of the CSR written by `create_CSR` for
+        `DNS` and writes the certificate, its intermediate chain and its full
+        chain to `working_dir/certificates`
+
+        """
+        with open("{0}/csrs/CSR-{1}.csr".format(working_dir, DNS), "rb") as csr_file:
+            fullchain_pem = self.issue(csr_file.read())
+
+        certificates = split_pem_chain(fullchain_pem)
+
+        with open("{0}/certificates/{1}-cert.pem".format(working_dir, DNS), "w") as certificate_file:
+            certificate_file.write(certificates[0])
+        with open("{0}/certificates/{1}-inter-chain.pem".format(working_dir, DNS), "w") as chain_file:
+            chain_file.write("".join(certificates[1:]))
+        with open("{0}/certificates/{1}-full-chain.pem".format(working_dir, DNS), "w") as fullchain_file:
+            fullchain_file.write(fullchain_pem)
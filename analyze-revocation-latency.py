@@ -0,0 +1,43 @@
+# This file reports the latency distributions of the revocation stages of a test log
+
+import revocation_logger as RL
+import revocation_latency as RLAT
+import json, time, argparse
+
+TEST_LOGGER_CSV_FILE = "./working_dir/test_logs/TEST_{}.csv"
+TEST_LOGGER_JOURNAL_FILE = "./working_dir/test_logs/TEST_{}.journal"
+TEST_LOGGER_COLUMNS_FILE = "./working_dir/test_logs/TEST_{}" + RL.COLUMNS_LOG_SUFFIX
+
+def print_report(rows):
+    percentile_keys = [key for key in rows[0] if key.endswith("_ms")] if rows else []
+    print("{:<18}{:>22}{:>9}".format("stage", "window", "count") + "".join("{:>12}".format(key[:-3] + " ms") for key in percentile_keys))
+    for row in rows:
+        window = "all" if row["window_start"] is None else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["window_start"]))
+        print("{:<18}{:>22}{:>9}".format(row["stage"], window, row["count"])
+              + "".join("{:>12.1f}".format(row[key]) for key in percentile_keys))
+
+def main(testid, columns, window, json_file_path):
+    test_log_path = TEST_LOGGER_COLUMNS_FILE.format(testid) if columns else TEST_LOGGER_CSV_FILE.format(testid)
+
+    rev_logger = RL.RevocationLogger()
+    rev_logger.read(test_log_path, TEST_LOGGER_JOURNAL_FILE.format(testid))
+
+    rows = RLAT.get_latency_report(RLAT.get_log_columns(rev_logger), window)
+    if not rows:
+        print("No revocation of test `{}` has been witnessed yet".format(testid))
+        return
+
+    print_report(rows)
+
+    if json_file_path:
+        with open(json_file_path, "w") as json_file:
+            json.dump(rows, json_file, indent=1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the p50/p90/p99/max latencies of the revocation stages of a test")
+    parser.add_argument("-i", "--testid", type=str, help="Test identifier", required=True)
+    parser.add_argument("-c", "--columns", action="store_true", help="Read the test log in the binary columnar format (TEST_<id>{}) instead of CSV".format(RL.COLUMNS_LOG_SUFFIX))
+    parser.add_argument("-w", "--window", type=float, help="Also report the latencies per window of WINDOW seconds of the time the revocations were sent")
+    parser.add_argument("-j", "--json", type=str, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    main(args.testid, args.columns, args.window, args.json)
@@ -0,0 +1,265 @@
+# This file benchmarks the parser, the revocation logger and the building of revocation transactions on synthetic fixtures, without bitcoind or pebble
+
+import blockvoke_parser as BP
+import blockvoke_codec as BC
+import revocation_logger as RL
+import revoke_certificate as RC
+import bitcoin_transactions as BT
+from bitcoin_serialization import Transaction, TransactionInput, TransactionOutput, serialize_transaction, serialize_varint
+import sys, os, argparse
+import json
+import time
+import random
+import logging
+import datetime
+import tempfile
+import tracemalloc
+from decimal import Decimal
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+SUITES = ["parser", "logger", "transactions"]
+
+results = []
+trace_memory = True
+
+def measure(name, function, num_items, setup=None):
+    """Times `function()` processing `num_items` items and records its
+    throughput
+
+    With `trace_memory` set, `function` is run a second time under
+    tracemalloc for its peak memory, so tracing does not skew the timing.
+    A stateful benchmark passes a `setup` building the arguments of
+    `function` afresh for each run, outside of the measurements.
+
+    """
+    arguments = setup() if setup is not None else ()
+    start_time = time.perf_counter()
+    result = function(*arguments)
+    elapsed_time = time.perf_counter() - start_time
+
+    peak_memory = None
+    if trace_memory:
+        arguments = setup() if setup is not None else ()
+        tracemalloc.start()
+        function(*arguments)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results.append({"benchmark": name,
+                    "items": num_items,
+                    "seconds": elapsed_time,
+                    "items_per_second": num_items / elapsed_time if elapsed_time else None,
+                    "peak_memory_bytes": peak_memory})
+    print("{0:<72} {1:>9} items {2:>9.3f} s {3:>13,.0f} items/s {4:>11}".format(
+        name,
+        num_items,
+        elapsed_time,
+        num_items / elapsed_time if elapsed_time else float("inf"),
+        "{:.1f} MiB".format(peak_memory / 2**20) if peak_memory is not None else "-"))
+
+    return result
+
+def random_bytes(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, "big")
+
+def make_payload(rng):
+    return BC.encode_payload(random_bytes(rng, 16), rng.randrange(1500), rng.randrange(4))
+
+def make_blocks(rng, num_blocks, txs_per_block, density):
+    """Returns the same synthetic blocks serialized (`getblock <hash> 0`)
+    and decoded (`getblock <hash> 2`)
+
+    Every transaction pays to a P2PKH address, and a share `density` of
+    them also carries a BlockVoke OP_RETURN.
+
+    """
+    raw_blocks, blocks = [], []
+    for height in range(num_blocks):
+        raw_txs, txs = [], []
+        for i in range(txs_per_block):
+            p2pkh_scriptPubKey = BT.get_p2pkh_scriptPubKey(random_bytes(rng, 20))
+            vout = [TransactionOutput(rng.randrange(546, 10**8), p2pkh_scriptPubKey)]
+            decoded_vout = [{"scriptPubKey": {"type": "pubkeyhash",
+                                              "asm": "OP_DUP OP_HASH160 {} OP_EQUALVERIFY OP_CHECKSIG".format(p2pkh_scriptPubKey[3:23].hex())}}]
+            if rng.random() < density:
+                payload = make_payload(rng)
+                vout.append(TransactionOutput(0, BT.get_nulldata_scriptPubKey(payload)))
+                decoded_vout.append({"scriptPubKey": {"type": "nulldata", "asm": "OP_RETURN " + payload.hex()}})
+
+            raw_txs.append(serialize_transaction(Transaction(None,
+                                                             BT.TX_VERSION,
+                                                             [TransactionInput(random_bytes(rng, 32).hex(), 0, random_bytes(rng, 107), BT.SEQUENCE_RBF, [])],
+                                                             vout,
+                                                             0)))
+            txs.append({"vout": decoded_vout})
+
+        raw_blocks.append(bytes(80) + serialize_varint(len(raw_txs)) + b"".join(raw_txs))
+        blocks.append(txs)
+    return raw_blocks, blocks
+
+def benchmark_parser(rng, num_blocks, txs_per_block, density):
+    raw_blocks, blocks = make_blocks(rng, num_blocks, txs_per_block, density)
+    num_txs = num_blocks * txs_per_block
+    label = "{0} blocks x {1} txs, {2:g} BlockVoke".format(num_blocks, txs_per_block, density)
+
+    measure("parser: get_revocations ({})".format(label),
+            lambda: [BP.get_revocations(txs) for txs in blocks],
+            num_txs)
+    revocations = measure("parser: get_revocations_from_raw_block ({})".format(label),
+                          lambda: [BP.get_revocations_from_raw_block(raw_block) for raw_block in raw_blocks],
+                          num_txs)
+
+    print("  {} revocations found".format(sum(map(len, revocations))))
+
+    if BC.np is not None:
+        OP_RETURNs = [OP_RETURNs[0] for raw_block in raw_blocks for txid, OP_RETURNs in BP.get_raw_block_OP_RETURNs(raw_block)]
+        measure("parser: codec decode_payloads",
+                lambda: BC.decode_payloads(OP_RETURNs),
+                len(OP_RETURNs))
+
+def make_certificate_values(rng, i):
+    return ("example-bench-{}.org".format(i),
+            random_bytes(rng, 32).hex(),
+            "02" + random_bytes(rng, 32).hex(),
+            "03" + "ca" * 32,
+            "2N" + random_bytes(rng, 16).hex())
+
+def benchmark_logger(rng, num_certificates, working_dir):
+    certificate_values = [make_certificate_values(rng, i) for i in range(num_certificates)]
+    csv_path = os.path.join(working_dir, "bench-{}.csv".format(num_certificates))
+
+    def add_certificates():
+        rev_logger = RL.RevocationLogger()
+        for values in certificate_values:
+            rev_logger.add_certificate(*values)
+        return rev_logger
+
+    rev_logger = measure("logger: add_certificate ({})".format(num_certificates), add_certificates, num_certificates)
+
+    def update_certificates(rev_logger):
+        for DNS, fingerprint, co_pubkey, ca_pubkey, multisig_address in certificate_values:
+            rev_logger.tx_pair_sent(DNS, "aa" * 32, "bb" * 32)
+            rev_logger.cert_revoked_from_mempool(fingerprint[:32], Decimal("0.00000170"), Decimal("0.00000307"))
+
+    measure("logger: tx_pair_sent + cert_revoked_from_mempool ({})".format(num_certificates),
+            update_certificates,
+            num_certificates,
+            setup=lambda: (add_certificates(),))
+
+    measure("logger: write CSV ({})".format(num_certificates),
+            lambda: rev_logger.write(csv_path),
+            num_certificates)
+    measure("logger: read CSV ({})".format(num_certificates),
+            lambda: RL.RevocationLogger().read(csv_path),
+            num_certificates)
+
+    if BC.np is None:
+        return
+
+    columns_path = os.path.join(working_dir, "bench-{}".format(num_certificates) + RL.COLUMNS_LOG_SUFFIX)
+    measure("logger: write columns ({})".format(num_certificates),
+            lambda: rev_logger.write(columns_path),
+            num_certificates)
+    measure("logger: read columns ({})".format(num_certificates),
+            lambda: RL.RevocationLogger().read(columns_path),
+            num_certificates)
+
+def make_certificate():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "example-bench.org")])
+    return (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(datetime.datetime(2024, 1, 1))
+            .not_valid_after(datetime.datetime(2025, 1, 1))
+            .sign(private_key, hashes.SHA256()))
+
+def make_revocation_inputs(rng):
+    """Returns the arguments of `create_local_revocation_transactions`
+    but the OP_RETURN, for a synthetic CO key, CA key and CO coin
+
+    """
+    co_wif = BT.b58encode_check(bytes([BT.TESTNET_WIF_VERSION]) + (rng.randrange(1, BT.SECP256K1_ORDER)).to_bytes(32, "big") + b"\x01")
+    private_key, co_pubkey = BT.get_private_key(co_wif)
+    ca_pubkey = ec.generate_private_key(ec.SECP256K1()).public_key().public_bytes(serialization.Encoding.X962,
+                                                                                  serialization.PublicFormat.CompressedPoint)
+
+    cert_multisig_redeemScript = BT.get_multisig_redeemScript(
+        1,
+        [bytes.fromhex(pubkey) for pubkey in RC.get_multisig_pubkeys(co_pubkey.hex(), ca_pubkey.hex().encode())])
+    co_scriptPubKey = bytes([BT.OP_0, 20]) + BT.hash160(co_pubkey)
+
+    return (BT.get_p2sh_address(cert_multisig_redeemScript, BT.TESTNET_P2SH_VERSION),
+            ca_pubkey.hex().encode(),
+            {"scriptPubKey": co_scriptPubKey.hex()},
+            co_wif,
+            [{"txid": random_bytes(rng, 32).hex(),
+              "vout": 0,
+              "amount": Decimal("0.00000600"),
+              "scriptPubKey": co_scriptPubKey.hex(),
+              "spendable": True,
+              "safe": True}])
+
+def benchmark_transactions(rng, num_transactions):
+    certificate = make_certificate()
+    fingerprint = certificate.fingerprint(hashes.SHA256()).hex()
+
+    measure("transactions: create_OP_RETURN_script",
+            lambda: [RC.create_OP_RETURN_script(certificate, i % 4) for i in range(num_transactions)],
+            num_transactions)
+    measure("transactions: get_OP_RETURN_script",
+            lambda: [RC.get_OP_RETURN_script(fingerprint, 1429, i % 4) for i in range(num_transactions)],
+            num_transactions)
+
+    revocation_inputs = make_revocation_inputs(rng)
+    OP_RETURN = RC.get_OP_RETURN_script(fingerprint, 1429, 0)
+    measure("transactions: create_local_revocation_transactions",
+            lambda: [RC.create_local_revocation_transactions(*revocation_inputs, OP_RETURN) for i in range(num_transactions)],
+            num_transactions)
+
+def main(suites, num_certificates, num_blocks, txs_per_block, density, num_transactions, seed=0, json_path=None):
+    # The logger logs every certificate it adds and every update at INFO
+    logging.disable(logging.INFO)
+    rng = random.Random(seed)
+
+    if "parser" in suites:
+        benchmark_parser(rng, num_blocks, txs_per_block, density)
+
+    if "logger" in suites:
+        with tempfile.TemporaryDirectory() as working_dir:
+            for num in num_certificates:
+                benchmark_logger(rng, num, working_dir)
+
+    if "transactions" in suites:
+        benchmark_transactions(rng, num_transactions)
+
+    if json_path is not None:
+        with open(json_path, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BlockVoke parser, revocation logger and revocation transaction building on synthetic fixtures")
+    parser.add_argument("-s", "--suite", type=str, action="append", choices=SUITES, help="Benchmark suite to run (can be repeated, all by default)")
+    parser.add_argument("-n", "--num-certificates", type=int, action="append", help="Number of certificates in the logger benchmarks (can be repeated, 10000 and 100000 by default)")
+    parser.add_argument("-b", "--blocks", type=int, help="Number of synthetic blocks parsed (default: %(default)s)", default=20)
+    parser.add_argument("-t", "--txs-per-block", type=int, help="Number of transactions per synthetic block (default: %(default)s)", default=2000)
+    parser.add_argument("-d", "--density", type=float, help="Share of the transactions carrying a BlockVoke revocation (default: %(default)s)", default=0.05)
+    parser.add_argument("-x", "--transactions", type=int, help="Number of revocation transaction pairs built (default: %(default)s)", default=200)
+    parser.add_argument("-r", "--seed", type=int, help="Seed of the synthetic fixtures (default: %(default)s)", default=0)
+    parser.add_argument("-m", "--no-memory", action="store_true", help="Do not rerun each benchmark under tracemalloc to measure its peak memory")
+    parser.add_argument("-j", "--json", type=str, help="Also write the results to this JSON file, to compare runs")
+    args = parser.parse_args()
+    trace_memory = not args.no_memory
+    main(args.suite or SUITES,
+         args.num_certificates or [10000, 100000],
+         args.blocks,
+         args.txs_per_block,
+         args.density,
+         args.transactions,
+         args.seed,
+         args.json)
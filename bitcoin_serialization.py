@@ -0,0 +1,250 @@
+"""Python lib to read and write serialized bitcoin blocks and
+ transactions without going through bitcoind's JSON decoding
+
+"""
+
+import hashlib
+import struct
+from collections import namedtuple
+
+OP_RETURN = 0x6a
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_16 = 0x60
+
+BLOCK_HEADER_SIZE = 80
+
+TransactionInput = namedtuple("TransactionInput", ["txid", "vout", "scriptSig", "sequence", "witness"])
+TransactionOutput = namedtuple("TransactionOutput", ["value", "scriptPubKey"])
+Transaction = namedtuple("Transaction", ["txid", "version", "vin", "vout", "locktime"])
+BlockHeader = namedtuple("BlockHeader", ["hash", "version", "previousblockhash", "merkleroot", "time", "bits", "nonce"])
+
+def dsha256(data) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+def read_varint(raw, offset):
+    """Reads a CompactSize unsigned integer
+
+    Returns the value and the offset just past it.
+
+    """
+    prefix = raw[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    if prefix == 0xfd:
+        return struct.unpack_from("<H", raw, offset + 1)[0], offset + 3
+    if prefix == 0xfe:
+        return struct.unpack_from("<I", raw, offset + 1)[0], offset + 5
+    return struct.unpack_from("<Q", raw, offset + 1)[0], offset + 9
+
+def serialize_varint(n) -> bytes:
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b"\xfd" + struct.pack("<H", n)
+    if n <= 0xffffffff:
+        return b"\xfe" + struct.pack("<I", n)
+    return b"\xff" + struct.pack("<Q", n)
+
+def is_segwit_transaction(raw, offset):
+    return raw[offset + 4] == 0 and raw[offset + 5] != 0
+
+def get_transaction_end(raw, offset):
+    """Walks over the transaction starting at `offset` without decoding it
+
+    Returns the offset just past the transaction.
+
+    """
+    segwit = is_segwit_transaction(raw, offset)
+    offset = offset + (6 if segwit else 4)
+
+    num_inputs, offset = read_varint(raw, offset)
+    for _ in range(num_inputs):
+        script_length, offset = read_varint(raw, offset + 36)
+        offset = offset + script_length + 4
+
+    num_outputs, offset = read_varint(raw, offset)
+    for _ in range(num_outputs):
+        script_length, offset = read_varint(raw, offset + 8)
+        offset = offset + script_length
+
+    if segwit:
+        for _ in range(num_inputs):
+            num_items, offset = read_varint(raw, offset)
+            for _ in range(num_items):
+                item_length, offset = read_varint(raw, offset)
+                offset = offset + item_length
+
+    return offset + 4
+
+def parse_transaction(raw, offset=0):
+    """Decodes the transaction starting at `offset`
+
+    Returns the `Transaction` and the offset just past it.  The txid is
+    hex encoded in the byte order bitcoind displays it.
+
+    """
+    tx_start = offset
+    segwit = is_segwit_transaction(raw, offset)
+    version = struct.unpack_from("<i", raw, offset)[0]
+    offset = offset + (6 if segwit else 4)
+    body_start = offset
+
+    vin = []
+    num_inputs, offset = read_varint(raw, offset)
+    for _ in range(num_inputs):
+        prev_txid = raw[offset:offset + 32][::-1].hex()
+        prev_vout = struct.unpack_from("<I", raw, offset + 32)[0]
+        script_length, offset = read_varint(raw, offset + 36)
+        scriptSig = bytes(raw[offset:offset + script_length])
+        offset = offset + script_length
+        sequence = struct.unpack_from("<I", raw, offset)[0]
+        offset = offset + 4
+        vin.append(TransactionInput(prev_txid, prev_vout, scriptSig, sequence, []))
+
+    vout = []
+    num_outputs, offset = read_varint(raw, offset)
+    for _ in range(num_outputs):
+        value = struct.unpack_from("<q", raw, offset)[0]
+        script_length, offset = read_varint(raw, offset + 8)
+        vout.append(TransactionOutput(value, bytes(raw[offset:offset + script_length])))
+        offset = offset + script_length
+    body_end = offset
+
+    if segwit:
+        for tx_input in vin:
+            num_items, offset = read_varint(raw, offset)
+            for _ in range(num_items):
+                item_length, offset = read_varint(raw, offset)
+                tx_input.witness.append(bytes(raw[offset:offset + item_length]))
+                offset = offset + item_length
+
+    locktime = struct.unpack_from("<I", raw, offset)[0]
+    offset = offset + 4
+
+    txid = dsha256(bytes(raw[tx_start:tx_start + 4]) + bytes(raw[body_start:body_end]) + bytes(raw[offset - 4:offset]))[::-1].hex()
+
+    return Transaction(txid, version, vin, vout, locktime), offset
+
+def parse_block_header(raw_block):
+    """Decodes the 80 byte header at the start of a serialized block
+
+    """
+    version, previousblockhash, merkleroot, time, bits, nonce = struct.unpack_from("<i32s32sIII", raw_block, 0)
+    return BlockHeader(dsha256(bytes(raw_block[:BLOCK_HEADER_SIZE]))[::-1].hex(),
+                       version,
+                       previousblockhash[::-1].hex(),
+                       merkleroot[::-1].hex(),
+                       time,
+                       format(bits, "08x"),
+                       nonce)
+
+def iter_block_transactions(raw_block):
+    """Yields the (start, end) offsets of every transaction in a serialized block
+
+    """
+    num_transactions, offset = read_varint(raw_block, BLOCK_HEADER_SIZE)
+    for _ in range(num_transactions):
+        end = get_transaction_end(raw_block, offset)
+        yield offset, end
+        offset = end
+
+def get_script_pushes(script, offset=0):
+    """Returns the data pushed by a push-only script, or None if the
+    script contains any other opcode
+
+    """
+    pushes = []
+    while offset < len(script):
+        opcode = script[offset]
+        offset = offset + 1
+        if opcode < OP_PUSHDATA1:
+            length = opcode
+        elif opcode == OP_PUSHDATA1:
+            length, offset = script[offset], offset + 1
+        elif opcode == OP_PUSHDATA2:
+            length, offset = struct.unpack_from("<H", script, offset)[0], offset + 2
+        elif opcode == OP_PUSHDATA4:
+            length, offset = struct.unpack_from("<I", script, offset)[0], offset + 4
+        elif opcode <= OP_16:
+            pushes.append(b"")
+            continue
+        else:
+            return None
+        if offset + length > len(script):
+            return None
+        pushes.append(bytes(script[offset:offset + length]))
+        offset = offset + length
+    return pushes
+
+def get_nulldata_pushes(scriptPubKey):
+    """Returns the pushed data of an OP_RETURN (`nulldata`) output script,
+    or None for any other script
+
+    """
+    if not scriptPubKey or scriptPubKey[0] != OP_RETURN:
+        return None
+    return get_script_pushes(scriptPubKey, 1)
+
+def serialize_script_push(data) -> bytes:
+    """Serializes the script opcodes pushing `data`
+
+    """
+    if len(data) < OP_PUSHDATA1:
+        return bytes([len(data)]) + data
+    if len(data) <= 0xff:
+        return bytes([OP_PUSHDATA1, len(data)]) + data
+    if len(data) <= 0xffff:
+        return bytes([OP_PUSHDATA2]) + struct.pack("<H", len(data)) + data
+    return bytes([OP_PUSHDATA4]) + struct.pack("<I", len(data)) + data
+
+def serialize_outpoint(tx_input) -> bytes:
+    return bytes.fromhex(tx_input.txid)[::-1] + struct.pack("<I", tx_input.vout)
+
+def serialize_output(tx_output) -> bytes:
+    return struct.pack("<q", tx_output.value) + serialize_varint(len(tx_output.scriptPubKey)) + tx_output.scriptPubKey
+
+def serialize_transaction(tx, witness=True) -> bytes:
+    """Serializes a `Transaction`
+
+    The segwit marker and the witnesses are written if `witness` is set
+    and any input has a witness.  The `txid` field is ignored.
+
+    """
+    witness = witness and any(tx_input.witness for tx_input in tx.vin)
+
+    raw = [struct.pack("<i", tx.version)]
+    if witness:
+        raw.append(b"\x00\x01")
+
+    raw.append(serialize_varint(len(tx.vin)))
+    for tx_input in tx.vin:
+        raw.append(serialize_outpoint(tx_input))
+        raw.append(serialize_varint(len(tx_input.scriptSig)))
+        raw.append(tx_input.scriptSig)
+        raw.append(struct.pack("<I", tx_input.sequence))
+
+    raw.append(serialize_varint(len(tx.vout)))
+    for tx_output in tx.vout:
+        raw.append(serialize_output(tx_output))
+
+    if witness:
+        for tx_input in tx.vin:
+            raw.append(serialize_varint(len(tx_input.witness)))
+            for item in tx_input.witness:
+                raw.append(serialize_varint(len(item)))
+                raw.append(item)
+
+    raw.append(struct.pack("<I", tx.locktime))
+    return b"".join(raw)
+
+def get_txid(tx) -> str:
+    return dsha256(serialize_transaction(tx, witness=False))[::-1].hex()
+
+def get_vsize(tx) -> int:
+    """Returns the virtual size (BIP141 weight / 4, rounded up) of a `Transaction`
+
+    """
+    weight = 3 * len(serialize_transaction(tx, witness=False)) + len(serialize_transaction(tx))
+    return (weight + 3) // 4
@@ -0,0 +1,402 @@
+"""Python lib to build and sign the BlockVoke funding and revocation
+ transactions without bitcoind
+
+Supports spending P2PKH, P2WPKH and P2SH-P2WPKH outputs of the CO
+address and the P2SH 1-of-2 multisig output of a certificate.
+
+"""
+
+import hashlib
+import struct
+from decimal import Decimal
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed, decode_dss_signature, encode_dss_signature
+
+from bitcoin_serialization import (OP_RETURN, Transaction, TransactionInput, TransactionOutput,
+                                   dsha256, serialize_varint, serialize_script_push, serialize_outpoint,
+                                   serialize_output, serialize_transaction, get_txid, get_vsize)
+
+OP_0 = 0x00
+OP_1 = 0x51
+OP_DUP = 0x76
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_HASH160 = 0xa9
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+
+SIGHASH_ALL = 0x01
+
+TX_VERSION = 2
+# Opts in to replace-by-fee, like createrawtransaction does
+SEQUENCE_RBF = 0xfffffffd
+
+SATOSHIS_PER_BITCOIN = 100000000
+
+# bitcoind's dust limits at the default -dustrelayfee of 3 sat/vB
+DUST_LIMIT = 546
+SEGWIT_DUST_LIMIT = 294
+
+SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BECH32_ALPHABET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+# Address and WIF prefixes of testnet, the chain the PoC runs on
+TESTNET_P2PKH_VERSION = 0x6f
+TESTNET_P2SH_VERSION = 0xc4
+TESTNET_WIF_VERSION = 0xef
+TESTNET_BECH32_HRP = "tb"
+
+# Largest DER signature with a low S value, plus the sighash type byte
+MAX_SIGNATURE_SIZE = 72
+
+# Message word order, rotations and constants of the left and right lines of RIPEMD-160
+__RIPEMD160_WORDS_LEFT__ = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+                            7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+                            3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+                            1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+                            4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13]
+__RIPEMD160_WORDS_RIGHT__ = [5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+                             6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+                             15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+                             8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+                             12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11]
+__RIPEMD160_ROTATIONS_LEFT__ = [11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+                                7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+                                11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+                                11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+                                9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6]
+__RIPEMD160_ROTATIONS_RIGHT__ = [8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+                                 9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+                                 9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+                                 15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+                                 8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11]
+__RIPEMD160_CONSTANTS_LEFT__ = [0x00000000, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
+__RIPEMD160_CONSTANTS_RIGHT__ = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0x00000000]
+
+def __rol32__(x, n):
+    return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+def __ripemd160_f__(round_, x, y, z):
+    if round_ == 0:
+        return x ^ y ^ z
+    if round_ == 1:
+        return (x & y) | (~x & z)
+    if round_ == 2:
+        return (x | ~y) ^ z
+    if round_ == 3:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+def __ripemd160__(data) -> bytes:
+    """Pure Python RIPEMD-160, for OpenSSL 3 builds of hashlib without the
+    legacy provider
+
+    """
+    data = bytes(data)
+    data = data + b"\x80" + b"\x00" * ((55 - len(data)) % 64) + struct.pack("<Q", 8 * len(data))
+    state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0]
+
+    for offset in range(0, len(data), 64):
+        words = struct.unpack_from("<16I", data, offset)
+        al, bl, cl, dl, el = state
+        ar, br, cr, dr, er = state
+        for j in range(80):
+            round_ = j >> 4
+            t = (__rol32__((al + __ripemd160_f__(round_, bl, cl, dl) + words[__RIPEMD160_WORDS_LEFT__[j]]
+                            + __RIPEMD160_CONSTANTS_LEFT__[round_]) & 0xffffffff,
+                           __RIPEMD160_ROTATIONS_LEFT__[j]) + el) & 0xffffffff
+            al, bl, cl, dl, el = el, t, bl, __rol32__(cl, 10), dl
+            t = (__rol32__((ar + __ripemd160_f__(4 - round_, br, cr, dr) + words[__RIPEMD160_WORDS_RIGHT__[j]]
+                            + __RIPEMD160_CONSTANTS_RIGHT__[round_]) & 0xffffffff,
+                           __RIPEMD160_ROTATIONS_RIGHT__[j]) + er) & 0xffffffff
+            ar, br, cr, dr, er = er, t, br, __rol32__(cr, 10), dr
+        state = [(state[1] + cl + dr) & 0xffffffff,
+                 (state[2] + dl + er) & 0xffffffff,
+                 (state[3] + el + ar) & 0xffffffff,
+                 (state[4] + al + br) & 0xffffffff,
+                 (state[0] + bl + cr) & 0xffffffff]
+
+    return struct.pack("<5I", *state)
+
+def ripemd160(data) -> bytes:
+    try:
+        return hashlib.new("ripemd160", data).digest()
+    except ValueError:
+        # OpenSSL 3 builds without the legacy provider
+        return __ripemd160__(data)
+
+def hash160(data) -> bytes:
+    return ripemd160(hashlib.sha256(data).digest())
+
+def to_satoshis(amount) -> int:
+    return int(Decimal(amount) * SATOSHIS_PER_BITCOIN)
+
+def b58decode_check(address) -> bytes:
+    n = 0
+    for char in address:
+        n = n * 58 + BASE58_ALPHABET.index(char)
+    raw = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    raw = b"\x00" * (len(address) - len(address.lstrip("1"))) + raw
+
+    payload, checksum = raw[:-4], raw[-4:]
+    if dsha256(payload)[:4] != checksum:
+        raise ValueError("Invalid base58 checksum in `{}`".format(address))
+    return payload
+
+def b58encode_check(payload) -> str:
+    raw = payload + dsha256(payload)[:4]
+    n = int.from_bytes(raw, "big")
+    encoded = ""
+    while n > 0:
+        n, remainder = divmod(n, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    return "1" * (len(raw) - len(raw.lstrip(b"\x00"))) + encoded
+
+def __bech32_polymod__(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if ((top >> i) & 1) else 0
+    return checksum
+
+def __bech32_hrp_expand__(hrp):
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+def __convert_bits__(data, from_bits, to_bits, pad):
+    acc, bits, converted = 0, 0, []
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits = bits + from_bits
+        while bits >= to_bits:
+            bits = bits - to_bits
+            converted.append((acc >> bits) & ((1 << to_bits) - 1))
+    if pad and bits:
+        converted.append((acc << (to_bits - bits)) & ((1 << to_bits) - 1))
+    elif not pad and (bits >= from_bits or (acc << (to_bits - bits)) & ((1 << to_bits) - 1)):
+        raise ValueError("Invalid padding in bech32 data")
+    return converted
+
+def segwit_encode(hrp, witness_version, witness_program) -> str:
+    """Encodes a segwit v0 (BIP173, bech32) address
+
+    """
+    data = [witness_version] + __convert_bits__(witness_program, 8, 5, True)
+    polymod = __bech32_polymod__(__bech32_hrp_expand__(hrp) + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(BECH32_ALPHABET[value] for value in data + checksum)
+
+def segwit_decode(hrp, address):
+    """Returns the witness version and program of a segwit v0 address
+
+    """
+    address = address.lower()
+    separator = address.rfind("1")
+    if address[:separator] != hrp or len(address) - separator < 7:
+        raise ValueError("Invalid bech32 address `{}`".format(address))
+    data = [BECH32_ALPHABET.index(char) for char in address[separator + 1:]]
+    if __bech32_polymod__(__bech32_hrp_expand__(hrp) + data) != 1:
+        raise ValueError("Invalid bech32 checksum in `{}`".format(address))
+    witness_version, witness_program = data[0], bytes(__convert_bits__(data[1:-6], 5, 8, False))
+    if witness_version != 0 or len(witness_program) not in (20, 32):
+        raise ValueError("Unsupported segwit address `{}`".format(address))
+    return witness_version, witness_program
+
+def get_address_scriptPubKey(address, hrp=TESTNET_BECH32_HRP) -> bytes:
+    """Returns the output script paying to a P2PKH, P2SH or segwit v0
+    address
+
+    """
+    if address.lower().startswith(hrp + "1"):
+        witness_version, witness_program = segwit_decode(hrp, address)
+        return bytes([OP_0, len(witness_program)]) + witness_program
+
+    payload = b58decode_check(address)
+    if payload[0] in (TESTNET_P2SH_VERSION, 0x05):
+        return bytes([OP_HASH160, 20]) + payload[1:] + bytes([OP_EQUAL])
+    return get_p2pkh_scriptPubKey(payload[1:])
+
+def get_scriptPubKey_address(scriptPubKey, hrp=TESTNET_BECH32_HRP):
+    """Returns the testnet address of an output script, or None if it has
+    no address
+
+    """
+    if len(scriptPubKey) == 25 and scriptPubKey == get_p2pkh_scriptPubKey(scriptPubKey[3:23]):
+        return b58encode_check(bytes([TESTNET_P2PKH_VERSION]) + scriptPubKey[3:23])
+    if len(scriptPubKey) == 23 and scriptPubKey[:2] == bytes([OP_HASH160, 20]) and scriptPubKey[-1] == OP_EQUAL:
+        return b58encode_check(bytes([TESTNET_P2SH_VERSION]) + scriptPubKey[2:22])
+    if len(scriptPubKey) in (22, 34) and scriptPubKey[0] == OP_0 and scriptPubKey[1] == len(scriptPubKey) - 2:
+        return segwit_encode(hrp, 0, scriptPubKey[2:])
+    return None
+
+def get_wif(private_key, version=TESTNET_WIF_VERSION) -> str:
+    """Encodes a private key as the compressed WIF `dumpprivkey` returns
+
+    """
+    return b58encode_check(bytes([version]) + private_key.private_numbers().private_value.to_bytes(32, "big") + b"\x01")
+
+def get_private_key(wif):
+    """Decodes a WIF private key, as returned by `dumpprivkey`
+
+    Returns the key and its serialized public key.
+
+    """
+    payload = b58decode_check(wif)
+    compressed = len(payload) == 34 and payload[-1] == 0x01
+    private_key = ec.derive_private_key(int.from_bytes(payload[1:33], "big"), ec.SECP256K1())
+    pubkey = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.X962,
+        format=(serialization.PublicFormat.CompressedPoint if compressed
+                else serialization.PublicFormat.UncompressedPoint))
+    return private_key, pubkey
+
+def get_multisig_redeemScript(required, pubkeys) -> bytes:
+    """Returns the `required`-of-n CHECKMULTISIG script of `pubkeys`, in
+    the order given, as `addmultisigaddress` builds it
+
+    """
+    return (bytes([OP_1 - 1 + required])
+            + b"".join(serialize_script_push(pubkey) for pubkey in pubkeys)
+            + bytes([OP_1 - 1 + len(pubkeys), OP_CHECKMULTISIG]))
+
+def get_p2sh_scriptPubKey(redeemScript) -> bytes:
+    return bytes([OP_HASH160, 20]) + hash160(redeemScript) + bytes([OP_EQUAL])
+
+def get_p2sh_address(redeemScript, version) -> str:
+    return b58encode_check(bytes([version]) + hash160(redeemScript))
+
+def get_p2pkh_scriptPubKey(pubkey_hash) -> bytes:
+    return bytes([OP_DUP, OP_HASH160, 20]) + pubkey_hash + bytes([OP_EQUALVERIFY, OP_CHECKSIG])
+
+def get_nulldata_scriptPubKey(data) -> bytes:
+    return bytes([OP_RETURN]) + serialize_script_push(data)
+
+def get_dust_limit(scriptPubKey) -> int:
+    return SEGWIT_DUST_LIMIT if scriptPubKey[:1] == bytes([OP_0]) else DUST_LIMIT
+
+def sign(private_key, sighash) -> bytes:
+    """Signs a sighash, with a low S value as required by bitcoind's
+    standardness rules, and appends SIGHASH_ALL
+
+    """
+    r, s = decode_dss_signature(private_key.sign(sighash, ec.ECDSA(Prehashed(hashes.SHA256()))))
+    if s > SECP256K1_ORDER // 2:
+        s = SECP256K1_ORDER - s
+    return encode_dss_signature(r, s) + bytes([SIGHASH_ALL])
+
+def get_legacy_sighash(tx, index, scriptCode) -> bytes:
+    vin = [tx_input._replace(scriptSig=(scriptCode if i == index else b""), witness=[])
+           for i, tx_input in enumerate(tx.vin)]
+    return dsha256(serialize_transaction(tx._replace(vin=vin), witness=False) + struct.pack("<I", SIGHASH_ALL))
+
+def get_segwit_sighash(tx, index, scriptCode, amount) -> bytes:
+    """BIP143 signature hash of input `index` spending `amount` satoshis
+
+    """
+    tx_input = tx.vin[index]
+    preimage = (struct.pack("<i", tx.version)
+                + dsha256(b"".join(serialize_outpoint(i) for i in tx.vin))
+                + dsha256(b"".join(struct.pack("<I", i.sequence) for i in tx.vin))
+                + serialize_outpoint(tx_input)
+                + serialize_varint(len(scriptCode)) + scriptCode
+                + struct.pack("<q", amount)
+                + struct.pack("<I", tx_input.sequence)
+                + dsha256(b"".join(serialize_output(o) for o in tx.vout))
+                + struct.pack("<I", tx.locktime)
+                + struct.pack("<I", SIGHASH_ALL))
+    return dsha256(preimage)
+
+def __sign_input__(tx, index, private_key, pubkey, prevout, dummy=False):
+    """Returns the scriptSig and witness of input `index`
+
+    `prevout` is the (scriptPubKey, amount, redeemScript) of the spent
+    output, `redeemScript` being None unless it is a multisig P2SH output.
+    With `dummy` set, placeholder signatures of the largest size are used
+    to estimate the size of the signed transaction.
+
+    """
+    scriptPubKey, amount, redeemScript = prevout
+    pubkey_hash = hash160(pubkey)
+
+    if redeemScript is not None:
+        if get_p2sh_scriptPubKey(redeemScript) != scriptPubKey:
+            raise ValueError("redeemScript does not match the P2SH output")
+        signature = b"\x00" * MAX_SIGNATURE_SIZE if dummy else sign(private_key, get_legacy_sighash(tx, index, redeemScript))
+        # OP_0 for the extra element CHECKMULTISIG pops
+        return bytes([OP_0]) + serialize_script_push(signature) + serialize_script_push(redeemScript), []
+
+    if scriptPubKey == get_p2pkh_scriptPubKey(pubkey_hash):
+        signature = b"\x00" * MAX_SIGNATURE_SIZE if dummy else sign(private_key, get_legacy_sighash(tx, index, scriptPubKey))
+        return serialize_script_push(signature) + serialize_script_push(pubkey), []
+
+    witness_program = bytes([OP_0, 20]) + pubkey_hash
+    if scriptPubKey == witness_program:
+        scriptSig = b""
+    elif scriptPubKey == get_p2sh_scriptPubKey(witness_program):
+        scriptSig = serialize_script_push(witness_program)
+    else:
+        raise ValueError("Cannot sign output script `{}`".format(scriptPubKey.hex()))
+
+    signature = b"\x00" * MAX_SIGNATURE_SIZE if dummy else sign(private_key,
+                                                                get_segwit_sighash(tx, index, get_p2pkh_scriptPubKey(pubkey_hash), amount))
+    return scriptSig, [signature, pubkey]
+
+def sign_transaction(tx, private_key, pubkey, prevouts, dummy=False):
+    """Signs every input of `tx` with `private_key`
+
+    `prevouts` holds the (scriptPubKey, amount, redeemScript) of the
+    output spent by each input.  Returns the signed `Transaction` with its
+    txid filled in.
+
+    """
+    return sign_transaction_inputs(tx, [(private_key, pubkey)] * len(tx.vin), prevouts, dummy)
+
+def sign_transaction_inputs(tx, keys, prevouts, dummy=False):
+    """Signs each input of `tx` with its own (private key, pubkey) in
+    `keys`
+
+    """
+    vin = []
+    for index, (tx_input, (private_key, pubkey), prevout) in enumerate(zip(tx.vin, keys, prevouts)):
+        scriptSig, witness = __sign_input__(tx, index, private_key, pubkey, prevout, dummy)
+        vin.append(tx_input._replace(scriptSig=scriptSig, witness=witness))
+    tx = tx._replace(vin=vin)
+    return tx._replace(txid=get_txid(tx))
+
+def fund_transaction(outputs, utxos, change_scriptPubKey, private_key, pubkey, fee_rate=1):
+    """Adds inputs from `utxos` (as returned by `listunspent`) paying for
+    `outputs` and a fee of `fee_rate` sat/vB, and a change output
+
+    Like `fundrawtransaction`, the change output is appended last and is
+    left out if it would be dust.  Returns the unsigned `Transaction` and
+    the prevouts of its inputs.
+
+    """
+    utxos = sorted((utxo for utxo in utxos if utxo.get("spendable", True) and utxo.get("safe", True)),
+                   key=lambda utxo: utxo["amount"],
+                   reverse=True)
+    target = sum(output.value for output in outputs)
+
+    vin, prevouts = [], []
+    for utxo in utxos:
+        vin.append(TransactionInput(utxo["txid"], utxo["vout"], b"", SEQUENCE_RBF, []))
+        prevouts.append((bytes.fromhex(utxo["scriptPubKey"]), to_satoshis(utxo["amount"]), None))
+
+        available = sum(amount for scriptPubKey, amount, redeemScript in prevouts)
+        for change_outputs in ([TransactionOutput(0, change_scriptPubKey)], []):
+            tx = Transaction(None, TX_VERSION, vin, list(outputs) + change_outputs, 0)
+            fee = get_vsize(sign_transaction(tx, private_key, pubkey, prevouts, dummy=True)) * fee_rate
+            change = available - target - fee
+            if change_outputs and change >= get_dust_limit(change_scriptPubKey):
+                return tx._replace(vout=list(outputs) + [TransactionOutput(change, change_scriptPubKey)]), prevouts
+            if not change_outputs and change >= 0:
+                # The remainder is too small for a change output and goes to the fee
+                return tx, prevouts
+
+    raise ValueError("Insufficient funds")
@@ -0,0 +1,132 @@
+"""Reorg-aware scanning of new blocks
+
+"""
+
+from blockvoke_bitcoin_rpc import get_bitcoind_connection
+from blockvoke_parser import get_blocks, parse_block_header
+
+class BlockScanner(object):
+    """Scans blocks in height order and follows chain reorganisations
+
+    The hash of every scanned block is kept as a checkpoint.  Each block
+    must build on the checkpoint below it (`previousblockhash`); when it
+    does not, the scanner walks back to the last checkpoint that is still
+    in the active chain, calls `on_rollback(fork_height)` so the records
+    from the orphaned blocks can be dropped, and re-scans only the blocks
+    above the fork.
+
+    `on_block(height, raw_block, header)` is called for every scanned
+    block with the serialized block and its decoded header.
+
+    """
+    def __init__(self,
+                 start_height,
+                 on_block,
+                 on_rollback,
+                 rpcconnect=None,
+                 checkpoints=None,
+                 max_checkpoints=1000,
+                 batch_size=10):
+        self.on_block = on_block
+        self.on_rollback = on_rollback
+        self.rpcconnect = rpcconnect
+        self.checkpoints = dict(checkpoints) if checkpoints else {}
+        self.max_checkpoints = max_checkpoints
+        self.batch_size = batch_size
+        self.height = max(self.checkpoints) if self.checkpoints else start_height - 1
+
+    def scan(self, stop_height=None):
+        """Scans every block up to `stop_height` (the chain tip by default)
+
+        Returns the number of blocks scanned.
+
+        """
+        tip = self.check_reorg()
+
+        if stop_height is not None:
+            tip = min(tip, stop_height)
+
+        num_blocks = 0
+        while self.height < tip:
+            heights = range(self.height + 1, min(self.height + 1 + self.batch_size, tip + 1))
+            for height, raw_block in zip(heights, get_blocks(heights, self.rpcconnect, verbosity=0)):
+                if not self.add_block(height, raw_block):
+                    break
+                num_blocks = num_blocks + 1
+        return num_blocks
+
+    def check_reorg(self):
+        """Rolls back to the fork if the last scanned block is no longer in
+        the active chain
+
+        Returns the height of the chain tip.
+
+        """
+        btd = get_bitcoind_connection(rpcconnect=self.rpcconnect)
+        tip = btd.getblockcount()
+
+        if self.height in self.checkpoints and (tip < self.height
+                                                or btd.getblockhash(self.height) != self.checkpoints[self.height]):
+            self.rollback()
+        return tip
+
+    def add_block(self, height, raw_block):
+        """Scans `raw_block` if it builds on the last scanned block
+
+        Returns False, after rolling back to the fork, if it does not.
+
+        """
+        connected = self.__connect_block__(height, raw_block)
+        if connected is None:
+            self.rollback()
+        return bool(connected)
+
+    def __connect_block__(self, height, raw_block):
+        """Scans `raw_block` if it is the next block
+
+        Returns False for any other height, and None if the block does not
+        build on the last scanned block.
+
+        """
+        if height != self.height + 1:
+            return False
+
+        raw_block = bytes.fromhex(raw_block) if isinstance(raw_block, str) else raw_block
+        header = parse_block_header(raw_block)
+
+        if self.height in self.checkpoints and header.previousblockhash != self.checkpoints[self.height]:
+            return None
+
+        self.on_block(height, raw_block, header)
+
+        self.checkpoints[height] = header.hash
+        self.checkpoints.pop(height - self.max_checkpoints, None)
+        self.height = height
+        return True
+
+    def add_next_block(self, raw_block):
+        """Scans a block pushed by bitcoind (e.g. over ZMQ)
+
+        The block is scanned directly if it extends the last scanned
+        block, otherwise the scanner catches up by polling.
+
+        """
+        if self.height not in self.checkpoints or not self.add_block(self.height + 1, raw_block):
+            self.scan()
+
+    def rollback(self):
+        """Rolls back to the highest checkpoint in the active chain
+
+        """
+        btd = get_bitcoind_connection(rpcconnect=self.rpcconnect)
+        tip = btd.getblockcount()
+
+        # If the fork is older than every checkpoint, all of them are re-scanned
+        fork_height = self.height
+        while fork_height in self.checkpoints and (fork_height > tip
+                                                   or btd.getblockhash(fork_height) != self.checkpoints[fork_height]):
+            del self.checkpoints[fork_height]
+            fork_height = fork_height - 1
+
+        self.height = fork_height
+        self.on_rollback(fork_height)
@@ -0,0 +1,341 @@
+"""asyncio JSON-RPC client to bitcoind, and coroutine versions of the
+ mempool and block watchers
+
+"""
+
+import json
+import time
+import base64
+import asyncio
+import functools
+import itertools
+import traceback
+from decimal import Decimal
+
+import rpc_metrics as RM
+from blockvoke_bitcoin_rpc import get_rpc_config, get_wallet_session_cache, JSONRPCException, EncodeDecimal, RPC_HTTP_TIMEOUT
+from blockvoke_parser import MempoolTracker
+from block_scanner import BlockScanner
+
+# bitcoind serves 4 RPC threads (`-rpcthreads`) with a work queue of 16
+# (`-rpcworkqueue`) by default and answers 503 once the queue is full
+RPC_MAX_SESSIONS = 16
+
+class AsyncBitcoindSessionPool(object):
+    """Pool of keep-alive HTTP sessions to one bitcoind host
+
+    At most `max_sessions` requests are in flight at a time, further
+    requests wait for a free session.
+
+    """
+    def __init__(self, host, port, timeout=RPC_HTTP_TIMEOUT, max_sessions=RPC_MAX_SESSIONS):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.__idle_sessions__ = []
+        self.__semaphore__ = asyncio.Semaphore(max_sessions)
+
+    async def checkout(self):
+        """Returns a (reader, writer) session and whether it was used before
+
+        """
+        await self.__semaphore__.acquire()
+        if self.__idle_sessions__:
+            return self.__idle_sessions__.pop(), True
+        try:
+            return await self.connect(), False
+        except BaseException:
+            self.__semaphore__.release()
+            raise
+
+    async def connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    def checkin(self, session):
+        self.__idle_sessions__.append(session)
+        self.__semaphore__.release()
+
+    def discard(self, session):
+        session[1].close()
+        self.__semaphore__.release()
+
+    def close(self):
+        idle_sessions, self.__idle_sessions__ = self.__idle_sessions__, []
+        for reader, writer in idle_sessions:
+            writer.close()
+
+class AsyncBitcoindConnection(object):
+    """asyncio version of `BitcoindConnection`
+
+    Every attribute is a coroutine function calling the RPC method of the
+    same name, e.g. `await btd.getblockcount()`.  Requests are recorded in
+    `rpc_metrics.RPC_METRICS` too.
+
+    """
+    __id_count__ = itertools.count(1)
+
+    def __init__(self, session_pool, path, rpcuser, rpcpassword):
+        self.session_pool = session_pool
+        self.path = path
+        self.wallet_name = path[len("/wallet/"):] if path.startswith("/wallet/") else ""
+        self.__request_head__ = ("POST {0} HTTP/1.1\r\n"
+                                 "Host: {1}\r\n"
+                                 "Authorization: Basic {2}\r\n"
+                                 "Content-Type: application/json\r\n"
+                                 "Content-Length: ").format(path,
+                                                            session_pool.host,
+                                                            base64.b64encode("{0}:{1}".format(rpcuser, rpcpassword).encode()).decode()).encode()
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    async def call(self, method, *params):
+        response = await self.__post__({"version": "1.1",
+                                        "method": method,
+                                        "params": params,
+                                        "id": next(AsyncBitcoindConnection.__id_count__)})
+        if response.get("error") is not None:
+            raise JSONRPCException(response["error"])
+        elif "result" not in response:
+            raise JSONRPCException({"code": -343, "message": "missing JSON-RPC result"})
+        return response["result"]
+
+    async def batch_(self, rpc_calls, return_exceptions=False):
+        """Batch RPC call
+
+        Pass array of arrays: [ [ "method", params... ], ... ]
+        Returns array of results.  The first failed call raises its
+        JSONRPCException, unless `return_exceptions` is set: then it is
+        returned in place of the call's result.
+
+        """
+        responses = await self.__post__([{"jsonrpc": "2.0",
+                                          "method": rpc_call[0],
+                                          "params": rpc_call[1:],
+                                          "id": next(AsyncBitcoindConnection.__id_count__)} for rpc_call in rpc_calls])
+        if isinstance(responses, dict):
+            raise JSONRPCException(responses.get("error") or {"code": -32700, "message": "Parse error"})
+
+        results = []
+        for response in responses:
+            if response.get("error") is not None:
+                result = JSONRPCException(response["error"])
+            elif "result" not in response:
+                result = JSONRPCException({"code": -343, "message": "missing JSON-RPC result"})
+            else:
+                result = response["result"]
+            if isinstance(result, JSONRPCException) and not return_exceptions:
+                raise result
+            results.append(result)
+        return results
+
+    async def __post__(self, payload):
+        postdata = json.dumps(payload, default=EncodeDecimal).encode()
+        request = self.__request_head__ + str(len(postdata)).encode() + b"\r\n\r\n" + postdata
+        response, response_size = None, 0
+
+        # Waiting for a free session is part of the latency
+        start = time.perf_counter()
+        session, reused = await self.session_pool.checkout()
+        try:
+            try:
+                response, response_size, keep_alive = await asyncio.wait_for(self.__request__(session, request), self.session_pool.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # bitcoind dropped the idle keep-alive session, retry once on a new socket
+                session[1].close()
+                session = await self.session_pool.connect()
+                response, response_size, keep_alive = await asyncio.wait_for(self.__request__(session, request), self.session_pool.timeout)
+        except BaseException:
+            self.session_pool.discard(session)
+            raise
+        finally:
+            RM.RPC_METRICS.record_request(payload, self.wallet_name, time.perf_counter() - start, len(postdata), response_size, response)
+
+        if keep_alive:
+            self.session_pool.checkin(session)
+        else:
+            self.session_pool.discard(session)
+
+        return response
+
+    async def __request__(self, session, request):
+        reader, writer = session
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("bitcoind closed the connection")
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "content-length" in headers:
+            responsedata = await reader.readexactly(int(headers["content-length"]))
+        else:
+            responsedata = await reader.read()
+            keep_alive = False
+
+        if headers.get("content-type") != "application/json":
+            raise JSONRPCException({"code": -342,
+                                    "message": "non-JSON HTTP response with '{0} {1}' from server".format(status, reason)})
+
+        return json.loads(responsedata, parse_float=Decimal), len(responsedata), keep_alive
+
+__async_bitcoind_session_pools__ = {}
+__async_bitcoind_connections__ = {}
+
+def get_async_bitcoind_connection(wallet_name=None, rpcconnect=None) -> AsyncBitcoindConnection:
+    """Connects to the JSON RPC bitcoind server from a running event loop
+
+    As with `get_bitcoind_connection`, one connection is kept per
+    (rpcconnect, wallet_name) and all wallets on a host share the host's
+    session pool.
+
+    """
+    bitcoind_ip = rpcconnect if rpcconnect != None else "127.0.0.1"
+
+    if (bitcoind_ip, wallet_name) not in __async_bitcoind_connections__:
+        bitcoind_rpcuser, bitcoind_rpcpass, bitcoind_rpcport = get_rpc_config()
+
+        if bitcoind_ip not in __async_bitcoind_session_pools__:
+            __async_bitcoind_session_pools__[bitcoind_ip] = AsyncBitcoindSessionPool(bitcoind_ip, bitcoind_rpcport)
+
+        __async_bitcoind_connections__[(bitcoind_ip, wallet_name)] = AsyncBitcoindConnection(
+            __async_bitcoind_session_pools__[bitcoind_ip],
+            ("/wallet/{}".format(wallet_name) if wallet_name else "/"),
+            bitcoind_rpcuser,
+            bitcoind_rpcpass)
+
+    return __async_bitcoind_connections__[(bitcoind_ip, wallet_name)]
+
+def close_async_bitcoind_connections():
+    """Closes every pooled session, to be called before the event loop ends
+
+    """
+    for session_pool in __async_bitcoind_session_pools__.values():
+        session_pool.close()
+    __async_bitcoind_session_pools__.clear()
+    __async_bitcoind_connections__.clear()
+
+async def acquire_wallet(wallet_name, rpcconnect=None, create=False) -> AsyncBitcoindConnection:
+    """Coroutine version of `WalletSessionCache.acquire`
+
+    The wallets are loaded and unloaded from the default executor, through
+    the same cache as `wallet_session`.
+
+    """
+    await asyncio.get_running_loop().run_in_executor(None,
+                                                     get_wallet_session_cache(rpcconnect).acquire,
+                                                     wallet_name,
+                                                     create)
+    return get_async_bitcoind_connection(wallet_name, rpcconnect)
+
+async def release_wallet(wallet_name, rpcconnect=None):
+    await asyncio.get_running_loop().run_in_executor(None,
+                                                     get_wallet_session_cache(rpcconnect).release,
+                                                     wallet_name)
+
+class AsyncMempoolTracker(MempoolTracker):
+    """`MempoolTracker` whose `poll` and `wait` are coroutines
+
+    The new transactions are fetched concurrently.
+
+    """
+    async def poll(self):
+        btd = get_async_bitcoind_connection(rpcconnect=self.rpcconnect)
+
+        rawmempool = set(await btd.getrawmempool())
+        new_txids = list(rawmempool - self.txids)
+        txs = []
+
+        for txid, tx in zip(new_txids,
+                            await asyncio.gather(*[btd.getrawtransaction(txid, True) for txid in new_txids],
+                                                 return_exceptions=True)):
+            if isinstance(tx, JSONRPCException):
+                # Mined or evicted between getrawmempool and getrawtransaction
+                rawmempool.discard(txid)
+            elif isinstance(tx, (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError)):
+                # Lost bitcoind: keep the txids of the last poll, so that
+                # the next poll fetches these transactions again
+                traceback.print_exception(type(tx), tx, tx.__traceback__)
+                self.poll_interval = min(self.poll_interval * 2, self.max_poll_interval)
+                return []
+            elif isinstance(tx, BaseException):
+                raise tx
+            else:
+                txs.append(tx)
+
+        self.txids = rawmempool
+
+        if txs:
+            self.poll_interval = self.min_poll_interval
+        else:
+            self.poll_interval = min(self.poll_interval * 2, self.max_poll_interval)
+
+        return txs
+
+    async def wait(self):
+        await asyncio.sleep(self.poll_interval)
+
+class AsyncBlockScanner(BlockScanner):
+    """`BlockScanner` whose `scan`, `add_block`, `add_next_block` and
+    `rollback` are coroutines
+
+    """
+    async def scan(self, stop_height=None):
+        btd = get_async_bitcoind_connection(rpcconnect=self.rpcconnect)
+        tip = await btd.getblockcount()
+
+        if self.height in self.checkpoints and (tip < self.height
+                                                or await btd.getblockhash(self.height) != self.checkpoints[self.height]):
+            await self.rollback()
+
+        if stop_height is not None:
+            tip = min(tip, stop_height)
+
+        num_blocks = 0
+        while self.height < tip:
+            heights = range(self.height + 1, min(self.height + 1 + self.batch_size, tip + 1))
+            blockhashes = await btd.batch_([["getblockhash", height] for height in heights])
+            raw_blocks = await btd.batch_([["getblock", blockhash, 0] for blockhash in blockhashes])
+            for height, raw_block in zip(heights, raw_blocks):
+                if not await self.add_block(height, raw_block):
+                    break
+                num_blocks = num_blocks + 1
+        return num_blocks
+
+    async def add_block(self, height, raw_block):
+        connected = self.__connect_block__(height, raw_block)
+        if connected is None:
+            await self.rollback()
+        return bool(connected)
+
+    async def add_next_block(self, raw_block):
+        if self.height not in self.checkpoints or not await self.add_block(self.height + 1, raw_block):
+            await self.scan()
+
+    async def rollback(self):
+        btd = get_async_bitcoind_connection(rpcconnect=self.rpcconnect)
+        tip = await btd.getblockcount()
+
+        fork_height = self.height
+        while fork_height in self.checkpoints and (fork_height > tip
+                                                   or await btd.getblockhash(fork_height) != self.checkpoints[fork_height]):
+            del self.checkpoints[fork_height]
+            fork_height = fork_height - 1
+
+        self.height = fork_height
+        self.on_rollback(fork_height)
@@ -4,40 +4,372 @@
 """
 
 import os
+import json
+import time
+import base64
+import threading
+import functools
+import http.client
+import itertools
+import atexit
+import contextlib
+from collections import OrderedDict
 
-from bitcoinlib.services.bitcoind import BitcoindClient
 from bitcoinlib.config.config import configparser
-from bitcoinlib.services.authproxy import AuthServiceProxy
+from bitcoinlib.services.authproxy import JSONRPCException, EncodeDecimal
 from decimal import Decimal
 
-BITCOIND_CONFIG_FILE_PATH = os.path.join(os.path.realpath("config"), "bitcoin.conf")
+import rpc_metrics as RM
+
+# BLOCKVOKE_BITCOIND_CONF points the scripts at another node, e.g. the one of `run-local-bitcoind.py`
+BITCOIND_CONFIG_FILE_PATH = os.environ.get("BLOCKVOKE_BITCOIND_CONF",
+                                           os.path.join(os.path.realpath("config"), "bitcoin.conf"))
 ALTERNATE_BITCOIND_CONFIG_FILE_PATH = os.path.join(os.path.realpath("config"), "bitcoin.conf")
 
+RPC_HTTP_TIMEOUT = 30
+RPC_MAX_IDLE_SESSIONS = 8
+MAX_LOADED_WALLETS = 50
+
+# bitcoind's RPC error codes
+RPC_WALLET_ERROR = -4
+RPC_WALLET_NOT_FOUND = -18
+RPC_WALLET_ALREADY_LOADED = -35
+
 def get_help():
     print(get_bitcoind_connection().help())
 
-def get_bitcoind_connection(wallet_name=None, rpcconnect=None) -> BitcoindClient:
+@functools.lru_cache(maxsize=None)
+def get_rpc_config(config_file_path=BITCOIND_CONFIG_FILE_PATH):
+    """Reads the rpcuser, rpcpassword and rpcport from bitcoin.conf
+
+    The file is parsed only once per process.
+
+    """
+    cp = configparser.ConfigParser()
+
+    cp.read(config_file_path)
+
+    return cp.get("rpc", "rpcuser"), cp.get("rpc", "rpcpassword"), cp.get("rpc", "rpcport")
+
+class BitcoindSessionPool(object):
+    """Pool of idle keep-alive HTTP sessions to one bitcoind host
+
+    """
+    def __init__(self, host, port, timeout=RPC_HTTP_TIMEOUT, max_idle_sessions=RPC_MAX_IDLE_SESSIONS):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.max_idle_sessions = max_idle_sessions
+        self.__idle_sessions__ = []
+        self.__lock__ = threading.Lock()
+
+    def checkout(self):
+        with self.__lock__:
+            if self.__idle_sessions__:
+                return self.__idle_sessions__.pop()
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def checkin(self, session):
+        with self.__lock__:
+            if len(self.__idle_sessions__) < self.max_idle_sessions:
+                self.__idle_sessions__.append(session)
+                return
+        session.close()
+
+    def close(self):
+        with self.__lock__:
+            idle_sessions, self.__idle_sessions__ = self.__idle_sessions__, []
+        for session in idle_sessions:
+            session.close()
+
+class BitcoindConnection(object):
+    """JSON-RPC proxy to bitcoind backed by keep-alive HTTP sessions
+
+    Used like `AuthServiceProxy`: every attribute is an RPC method, and
+    `batch_` sends a JSON-RPC batch array.  An HTTP session is checked out
+    of the host's pool for each request and returned afterwards, so a
+    connection can be shared between threads, and a single thread reuses
+    the same session for every call.  Every request is recorded in
+    `rpc_metrics.RPC_METRICS`.
+
+    """
+    __id_count__ = itertools.count(1)
+
+    def __init__(self, session_pool, path, rpcuser, rpcpassword):
+        self.session_pool = session_pool
+        self.path = path
+        self.wallet_name = path[len("/wallet/"):] if path.startswith("/wallet/") else ""
+        self.__headers__ = {"Host": session_pool.host,
+                            "Authorization": "Basic " + base64.b64encode("{0}:{1}".format(rpcuser, rpcpassword).encode()).decode(),
+                            "Content-type": "application/json"}
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def call(self, method, *params):
+        response = self.__post__({"version": "1.1",
+                                  "method": method,
+                                  "params": params,
+                                  "id": next(BitcoindConnection.__id_count__)})
+        if response.get("error") is not None:
+            raise JSONRPCException(response["error"])
+        elif "result" not in response:
+            raise JSONRPCException({"code": -343, "message": "missing JSON-RPC result"})
+        return response["result"]
+
+    def batch_(self, rpc_calls, return_exceptions=False):
+        """Batch RPC call
+
+        Pass array of arrays: [ [ "method", params... ], ... ]
+        Returns array of results.  The first failed call raises its
+        JSONRPCException, unless `return_exceptions` is set: then it is
+        returned in place of the call's result.
+
+        """
+        responses = self.__post__([{"jsonrpc": "2.0",
+                                    "method": rpc_call[0],
+                                    "params": rpc_call[1:],
+                                    "id": next(BitcoindConnection.__id_count__)} for rpc_call in rpc_calls])
+        if isinstance(responses, dict):
+            raise JSONRPCException(responses.get("error") or {"code": -32700, "message": "Parse error"})
+
+        results = []
+        for response in responses:
+            if response.get("error") is not None:
+                result = JSONRPCException(response["error"])
+            elif "result" not in response:
+                result = JSONRPCException({"code": -343, "message": "missing JSON-RPC result"})
+            else:
+                result = response["result"]
+            if isinstance(result, JSONRPCException) and not return_exceptions:
+                raise result
+            results.append(result)
+        return results
+
+    def __post__(self, payload):
+        postdata = json.dumps(payload, default=EncodeDecimal)
+        response, response_size = None, 0
+        start = time.perf_counter()
+
+        session = self.session_pool.checkout()
+        try:
+            try:
+                reused = session.sock is not None
+                response, response_size = self.__request__(session, postdata)
+            except (http.client.HTTPException, ConnectionError):
+                if not reused:
+                    raise
+                # bitcoind dropped the idle keep-alive session, retry once on a new socket
+                session.close()
+                response, response_size = self.__request__(session, postdata)
+        except BaseException:
+            session.close()
+            raise
+        finally:
+            RM.RPC_METRICS.record_request(payload, self.wallet_name, time.perf_counter() - start, len(postdata), response_size, response)
+
+        self.session_pool.checkin(session)
+
+        return response
+
+    def __request__(self, session, postdata):
+        session.request("POST", self.path, postdata, self.__headers__)
+        http_response = session.getresponse()
+        responsedata = http_response.read()
+
+        if http_response.will_close:
+            session.close()
+
+        if http_response.getheader("Content-Type") != "application/json":
+            raise JSONRPCException({"code": -342,
+                                    "message": "non-JSON HTTP response with '{0} {1}' from server".format(http_response.status,
+                                                                                                           http_response.reason)})
+
+        return json.loads(responsedata, parse_float=Decimal), len(responsedata)
+
+__bitcoind_session_pools__ = {}
+__bitcoind_connections__ = {}
+__bitcoind_connections_lock__ = threading.Lock()
+
+def get_bitcoind_connection(wallet_name=None, rpcconnect=None) -> BitcoindConnection:
     """Connects to the JSON RPC bitocind server
     
     `127.0.0.1` is used if rpcconnect is not specified.
 
+    One connection is kept per (rpcconnect, wallet_name) for the lifetime
+    of the process.  All wallets on a host share that host's pool of
+    keep-alive HTTP sessions.
+
     """
 
     bitcoind_ip = rpcconnect if rpcconnect != None else "127.0.0.1"
 
-    cp = configparser.ConfigParser()
+    with __bitcoind_connections_lock__:
+        if (bitcoind_ip, wallet_name) not in __bitcoind_connections__:
+            bitcoind_rpcuser, bitcoind_rpcpass, bitcoind_rpcport = get_rpc_config()
+
+            if bitcoind_ip not in __bitcoind_session_pools__:
+                __bitcoind_session_pools__[bitcoind_ip] = BitcoindSessionPool(bitcoind_ip, bitcoind_rpcport)
 
-    cp.read(BITCOIND_CONFIG_FILE_PATH)
+            __bitcoind_connections__[(bitcoind_ip, wallet_name)] = BitcoindConnection(
+                __bitcoind_session_pools__[bitcoind_ip],
+                ("/wallet/{}".format(wallet_name) if wallet_name else "/"),
+                bitcoind_rpcuser,
+                bitcoind_rpcpass)
 
-    bitcoind_rpcuser, bitcoind_rpcpass, bitcoind_rpcport = cp.get("rpc", "rpcuser"), cp.get("rpc", "rpcpassword"), cp.get("rpc", "rpcport")
+        return __bitcoind_connections__[(bitcoind_ip, wallet_name)]
 
-    service_url = "http://{0}:{1}@{2}:{3}{4}".format(bitcoind_rpcuser,
-                                                     bitcoind_rpcpass,
-                                                     bitcoind_ip,
-                                                     bitcoind_rpcport,
-                                                     ("/wallet/{}".format(wallet_name) if wallet_name else ""))
+def close_bitcoind_connections():
+    """Closes every pooled HTTP session
 
-    return AuthServiceProxy(service_url)
+    """
+    with __bitcoind_connections_lock__:
+        for session_pool in __bitcoind_session_pools__.values():
+            session_pool.close()
+        __bitcoind_session_pools__.clear()
+        __bitcoind_connections__.clear()
+
+class WalletSessionCache(object):
+    """Keeps up to `max_loaded_wallets` wallets of one bitcoind loaded
+    across calls
+
+    `acquire` loads a wallet unless it is still loaded from an earlier
+    session, and returns its shared connection.  Wallets are unloaded
+    lazily: only when more than `max_loaded_wallets` are loaded is the
+    least recently used wallet that is not in use unloaded.  A wallet
+    that is already loaded in bitcoind, e.g. by an earlier run, is simply
+    taken over.  A wallet being unloaded keeps its entry, and holds its
+    load lock until bitcoind has unloaded it, so that a session acquiring
+    it meanwhile waits and loads it again.
+
+    """
+    def __init__(self, rpcconnect=None, max_loaded_wallets=MAX_LOADED_WALLETS):
+        self.rpcconnect = rpcconnect
+        self.max_loaded_wallets = max_loaded_wallets
+        # Wallet name -> [number of sessions using it, load lock, loaded, unloading], least recently used first
+        self.__wallets__ = OrderedDict()
+        self.__lock__ = threading.Lock()
+
+    def acquire(self, wallet_name, create=False) -> BitcoindConnection:
+        with self.__lock__:
+            if wallet_name not in self.__wallets__:
+                self.__wallets__[wallet_name] = [0, threading.Lock(), False, False]
+            wallet = self.__wallets__[wallet_name]
+            wallet[0] = wallet[0] + 1
+            self.__wallets__.move_to_end(wallet_name)
+
+        try:
+            with wallet[1]:
+                if not wallet[2]:
+                    self.__load__(wallet_name, create)
+                    wallet[2] = True
+            # A failing unloadwallet must not keep this wallet pinned
+            self.__evict__()
+        except BaseException:
+            self.release(wallet_name)
+            raise
+
+        return get_bitcoind_connection(wallet_name, self.rpcconnect)
+
+    def release(self, wallet_name):
+        with self.__lock__:
+            self.__wallets__[wallet_name][0] = self.__wallets__[wallet_name][0] - 1
+            if not self.__wallets__[wallet_name][2] and self.__wallets__[wallet_name][0] == 0:
+                del self.__wallets__[wallet_name]
+
+        self.__evict__()
+
+    def close(self):
+        """Unloads every wallet that is not in use
+
+        """
+        self.__evict__(0)
+
+    def __load__(self, wallet_name, create):
+        btd = get_bitcoind_connection(rpcconnect=self.rpcconnect)
+        try:
+            if create:
+                try:
+                    btd.createwallet(wallet_name)
+                    return
+                except JSONRPCException as E:
+                    if E.code != RPC_WALLET_ERROR:
+                        raise
+            btd.loadwallet(wallet_name)
+        except JSONRPCException as E:
+            if E.code != RPC_WALLET_ALREADY_LOADED:
+                raise
+
+    def __evict__(self, max_loaded_wallets=None):
+        max_loaded_wallets = self.max_loaded_wallets if max_loaded_wallets is None else max_loaded_wallets
+
+        while True:
+            with self.__lock__:
+                if sum(not wallet[3] for wallet in self.__wallets__.values()) <= max_loaded_wallets:
+                    return
+                # Not in use, so no session holds its load lock
+                wallet_name, wallet = next(((wallet_name, wallet) for wallet_name, wallet in self.__wallets__.items()
+                                            if wallet[0] == 0 and not wallet[3]), (None, None))
+                if wallet_name is None:
+                    return
+                wallet[1].acquire()
+                wallet[3] = True
+
+            unloaded = False
+            try:
+                try:
+                    get_bitcoind_connection(rpcconnect=self.rpcconnect).unloadwallet(wallet_name)
+                except JSONRPCException as E:
+                    if E.code != RPC_WALLET_NOT_FOUND:
+                        raise
+                unloaded = True
+            finally:
+                with self.__lock__:
+                    wallet[3] = False
+                    if unloaded:
+                        wallet[2] = False
+                        if wallet[0] == 0:
+                            del self.__wallets__[wallet_name]
+                wallet[1].release()
+
+__wallet_session_caches__ = {}
+
+def get_wallet_session_cache(rpcconnect=None) -> WalletSessionCache:
+    with __bitcoind_connections_lock__:
+        if rpcconnect not in __wallet_session_caches__:
+            __wallet_session_caches__[rpcconnect] = WalletSessionCache(rpcconnect)
+        return __wallet_session_caches__[rpcconnect]
+
+@contextlib.contextmanager
+def wallet_session(wallet_name, rpcconnect=None, create=False):
+    """Loads `wallet_name` (creating it if `create` is set and it does not
+    exist) for the duration of the `with` block
+
+    Yields the wallet's connection.  The wallet stays loaded afterwards
+    for the next session, see `WalletSessionCache`.
+
+    """
+    wallet_session_cache = get_wallet_session_cache(rpcconnect)
+    btd = wallet_session_cache.acquire(wallet_name, create)
+    try:
+        yield btd
+    finally:
+        wallet_session_cache.release(wallet_name)
+
+@atexit.register
+def close_wallet_sessions():
+    """Unloads the wallets kept loaded by `wallet_session`
+
+    """
+    with __bitcoind_connections_lock__:
+        wallet_session_caches = list(__wallet_session_caches__.values())
+    for wallet_session_cache in wallet_session_caches:
+        try:
+            wallet_session_cache.close()
+        except (JSONRPCException, http.client.HTTPException, OSError) as E:
+            print("Unable to unload wallets: {}".format(E))
 
 def __initialize_faucet__():
     """Creates a wallet with address that provides bitcoin to the CO's
@@ -100,12 +432,10 @@ def mine_blocks(num=10):
    """Mines some blocks to the miner's address
 
    """ 
-   btd = get_bitcoind_connection("miner")
-   btd.loadwallet("miner")
-   miner_address = list(btd.getaddressesbylabel("mineraddress").keys())[0]
+   with wallet_session("miner") as btd:
+       miner_address = list(btd.getaddressesbylabel("mineraddress").keys())[0]
 
-   btd.generatetoaddress(num, miner_address)
-   btd.unloadwallet("miner")
+       btd.generatetoaddress(num, miner_address)
 
 def get_faucet_info():
     """Get the address of faucet and unspent balance
@@ -116,23 +446,17 @@ def get_faucet_info():
 
     """
 
-    btd = get_bitcoind_connection("testnetfaucet")
-    btd.loadwallet("testnetfaucet")
-
-    faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())
+    with wallet_session("testnetfaucet") as btd:
+        faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())
 
-    unspent = btd.listunspent(1, 9999999, faucet_address)
-
-    btd.unloadwallet("testnetfaucet")
+        unspent = btd.listunspent(1, 9999999, faucet_address)
 
     return unspent
 
 def get_bitcoin_from_faucet2(address, amount):
-    btd = get_bitcoind_connection("testnetfaucet")
-    btd.loadwallet("testnetfaucet")
-    btd.sendtoaddress(address, amount, fee_rate="1")
-    # mine_blocks(1)
-    btd.unloadwallet("testnetfaucet")
+    with wallet_session("testnetfaucet") as btd:
+        btd.sendtoaddress(address, amount, fee_rate="1")
+        # mine_blocks(1)
 
 def get_bitcoin_from_faucet(address, amount):
     """Get some bitcoin from faucet
@@ -142,11 +466,8 @@ def get_bitcoin_from_faucet(address, amount):
     Faucet should already be initialized
 
     """
-    btd = get_bitcoind_connection("testnetfaucet")
-    btd.loadwallet("testnetfaucet")
-    faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())[0]
-
-    try:
+    with wallet_session("testnetfaucet") as btd:
+        faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())[0]
 
         rawtransaction = btd.createrawtransaction(
             [],
@@ -168,11 +489,5 @@ def get_bitcoin_from_faucet(address, amount):
         #       type(signed_rawtransaction))
         
         txid = btd.sendrawtransaction(signed_rawtransaction["hex"])
-        
-    except Exception as E:
-        btd.unloadwallet("testnetfaucet")
-        raise E
-
-    btd.unloadwallet("testnetfaucet")
 
     return txid
@@ -0,0 +1,121 @@
+"""Codec of the BlockVoke OP_RETURN payload
+
+A revocation is a single 31 byte push after OP_RETURN:
+
+    "BlockVoke\\x00"     10 bytes  identifier
+    fingerprint-16     16 bytes  first half of the certificate's SHA-256 fingerprint
+    days               4 bytes   big endian, days from 2020-02-02 to the certificate's `not_valid_before`
+    revocation code    1 byte
+
+`encode_payload` and `decode_payload` handle one payload.
+`decode_payloads` decodes many at once into NumPy arrays, for indexers
+and analysis tools going through millions of revocations.
+
+"""
+
+import struct
+from datetime import datetime
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BLOCKVOKE_IDENTIFIER = "BlockVoke".encode() + b"\x00"
+BLOCKVOKE_EPOCH = datetime(2020, 2, 2)
+
+PAYLOAD_STRUCT = struct.Struct(">10s16sIB")
+PAYLOAD_SIZE = PAYLOAD_STRUCT.size
+
+# Offsets of the fields in the hex encoded payload
+FINGERPRINT_16_HEX_SLICE = slice(2 * 10, 2 * 26)
+DAYS_HEX_SLICE = slice(2 * 26, 2 * 30)
+REVOCATION_CODE_HEX_SLICE = slice(2 * 30, 2 * 31)
+
+BlockVokePayload = namedtuple("BlockVokePayload", ["fingerprint_16", "days", "revocation_code"])
+
+if np is not None:
+    PAYLOAD_DTYPE = np.dtype([("identifier", "u1", (10,)),
+                              ("fingerprint_16", "u1", (16,)),
+                              ("days", ">u4"),
+                              ("revocation_code", "u1")])
+    __HEX_DIGITS__ = np.array([format(i, "02x").encode() for i in range(256)], dtype="S2")
+
+def get_days_since_epoch(not_valid_before) -> int:
+    return (not_valid_before - BLOCKVOKE_EPOCH).days
+
+def encode_payload(fingerprint_16, days, revocation_code) -> bytes:
+    """Packs a revocation
+
+    `fingerprint_16` is 16 bytes or 32 hex digits; a full fingerprint is
+    cut to its first 16 bytes.
+
+    """
+    if isinstance(fingerprint_16, str):
+        fingerprint_16 = bytes.fromhex(fingerprint_16[:32])
+    fingerprint_16 = fingerprint_16[:16]
+    if len(fingerprint_16) != 16:
+        raise ValueError("fingerprint-16 must be 16 bytes, not {}".format(len(fingerprint_16)))
+
+    return PAYLOAD_STRUCT.pack(BLOCKVOKE_IDENTIFIER, fingerprint_16, days, revocation_code)
+
+def decode_payload(payload) -> BlockVokePayload:
+    """Unpacks a revocation, given as bytes or hex
+
+    Raises ValueError if `payload` is not a BlockVoke payload.
+
+    """
+    if isinstance(payload, str):
+        payload = bytes.fromhex(payload)
+    if len(payload) != PAYLOAD_SIZE:
+        raise ValueError("BlockVoke payload must be {0} bytes, not {1}".format(PAYLOAD_SIZE, len(payload)))
+
+    identifier, fingerprint_16, days, revocation_code = PAYLOAD_STRUCT.unpack(payload)
+    if identifier != BLOCKVOKE_IDENTIFIER:
+        raise ValueError("Not a BlockVoke payload")
+
+    return BlockVokePayload(fingerprint_16, days, revocation_code)
+
+def __to_bytes__(payload):
+    if isinstance(payload, str):
+        try:
+            return bytes.fromhex(payload)
+        except ValueError:
+            return b""
+    return payload
+
+def decode_payloads(payloads):
+    """Decodes many payloads (bytes or hex) at once
+
+    Returns a structured array with the `PAYLOAD_DTYPE` fields, one
+    record per payload, and a boolean array that is False for the
+    payloads that are not valid BlockVoke payloads.  The records of
+    invalid payloads are zeroed.
+
+    """
+    if np is None:
+        raise ImportError("numpy is required to decode BlockVoke payloads in batches")
+
+    payloads = [__to_bytes__(payload) for payload in payloads]
+
+    valid = np.fromiter((len(payload) == PAYLOAD_SIZE for payload in payloads), dtype=bool, count=len(payloads))
+    records = np.zeros(len(payloads), dtype=PAYLOAD_DTYPE)
+    records[valid] = np.frombuffer(b"".join(payload for payload, is_valid in zip(payloads, valid) if is_valid),
+                                   dtype=PAYLOAD_DTYPE)
+
+    valid &= (records["identifier"] == np.frombuffer(BLOCKVOKE_IDENTIFIER, dtype="u1")).all(axis=1)
+    records[~valid] = 0
+
+    return records, valid
+
+def get_fingerprint_16_hex(fingerprints_16):
+    """Converts the `fingerprint_16` column of `decode_payloads` to an
+    array of 32 hex digit byte strings, as stored by the revocation log
+    and the indexes
+
+    """
+    if np is None:
+        raise ImportError("numpy is required to decode BlockVoke payloads in batches")
+
+    return np.ascontiguousarray(__HEX_DIGITS__[fingerprints_16]).view("S32").reshape(len(fingerprints_16))
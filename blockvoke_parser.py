@@ -1,16 +1,61 @@
+import bisect
+import time
+import http.client
 import traceback
-from blockvoke_bitcoin_rpc import get_bitcoind_connection
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from blockvoke_bitcoin_rpc import get_bitcoind_connection, JSONRPCException
+import blockvoke_codec as BC
+from bitcoin_serialization import OP_RETURN, OP_PUSHDATA1, iter_block_transactions, parse_transaction, parse_block_header, get_nulldata_pushes
 
-def get_block_tx_list(height, rpcconnect=None):
+BLOCKVOKE_IDENTIFIER = "BlockVoke".encode()
+
+def get_block(height, rpcconnect=None, verbosity=2):
+    """Fetches the block at `height` in two round trips
+
+    At verbosity 2, `getblock` returns every transaction decoded, so no
+    `getrawtransaction` calls are needed per txid.
+
+    """
     btd = get_bitcoind_connection(rpcconnect=rpcconnect)
 
-    blockhash = btd.getblockhash(height)
-    txids = btd.getblock(blockhash)["tx"]
+    return btd.getblock(btd.getblockhash(height), verbosity)
+
+def get_blocks(heights, rpcconnect=None, verbosity=2):
+    """Fetches the blocks at `heights` using two JSON-RPC batch requests
+
+    """
+    heights = list(heights)
+    if not heights:
+        return []
+
+    btd = get_bitcoind_connection(rpcconnect=rpcconnect)
 
-    return [btd.getrawtransaction(txid, 1, blockhash) for txid in txids]
+    blockhashes = btd.batch_([["getblockhash", height] for height in heights])
+
+    return btd.batch_([["getblock", blockhash, verbosity] for blockhash in blockhashes])
+
+def get_block_tx_list_from_block(block):
+    """Returns the decoded transactions of a verbosity 2 block
+
+    The block fields that `getrawtransaction <txid> 1 <blockhash>` adds
+    to each transaction are filled in, so the transactions look the same
+    as the ones fetched one by one.
+
+    """
+    for tx in block["tx"]:
+        tx["blockhash"] = block["hash"]
+        tx["confirmations"] = block["confirmations"]
+        tx["time"] = block["time"]
+        tx["blocktime"] = block["time"]
+
+    return block["tx"]
+
+def get_block_tx_list(height, rpcconnect=None):
+    return get_block_tx_list_from_block(get_block(height, rpcconnect))
 
 def get_tx_list_in_blockrange(blockrange, rpcconnect=None):
-    return [tx for block_tx_list in [get_block_tx_list(height, rpcconnect) for height in blockrange] for tx in block_tx_list] 
+    return [tx for block in get_blocks(blockrange, rpcconnect) for tx in get_block_tx_list_from_block(block)]
 
 def is_OP_RETURN_OUTPUT(output):
     return output["scriptPubKey"]["type"] == "nulldata" and output["scriptPubKey"]["asm"][10:28] == "BlockVoke".encode().hex()
@@ -19,10 +64,159 @@ def get_OP_RETURN(tx):
     return [output["scriptPubKey"]["asm"][10:] for output in filter(is_OP_RETURN_OUTPUT, tx["vout"])]
 
 def get_cert_fingerprint_16(opreturn):
-    return opreturn[20:20+32]
+    return opreturn[BC.FINGERPRINT_16_HEX_SLICE]
+
+def get_cert_days(opreturn):
+    return int(opreturn[BC.DAYS_HEX_SLICE], 16)
+
+def get_revocation_code(opreturn):
+    return int(opreturn[BC.REVOCATION_CODE_HEX_SLICE], 16)
+
+def is_revocation_payload(opreturn):
+    """Whether the first OP_RETURN of a transaction is a valid 31 byte
+    BlockVoke payload, as checked by `blockvoke_codec.decode_payload`
+
+    """
+    try:
+        BC.decode_payload(opreturn)
+    except ValueError:
+        return False
+    return True
 
 def get_revocations(tx_list):
-    return [get_cert_fingerprint_16(OP_RETURN[0]) for OP_RETURN in [get_OP_RETURN(tx) for tx in tx_list] if OP_RETURN]
+    return [get_cert_fingerprint_16(OP_RETURN[0]) for OP_RETURN in [get_OP_RETURN(tx) for tx in tx_list]
+            if OP_RETURN and is_revocation_payload(OP_RETURN[0])]
+
+def find_raw_OP_RETURN_candidates(raw):
+    """Returns the offsets in `raw` of every "BlockVoke" string that is
+    pushed directly after an OP_RETURN
+
+    This is a byte search only, the transactions around the offsets are
+    not parsed.
+
+    """
+    candidates = []
+    offset = raw.find(BLOCKVOKE_IDENTIFIER)
+    while offset != -1:
+        if ((offset >= 2 and raw[offset-2] == OP_RETURN and raw[offset-1] < OP_PUSHDATA1)
+            or (offset >= 3 and raw[offset-3] == OP_RETURN and raw[offset-2] == OP_PUSHDATA1)):
+            candidates.append(offset)
+        offset = raw.find(BLOCKVOKE_IDENTIFIER, offset + 1)
+    return candidates
+
+def get_raw_OP_RETURN(tx):
+    """Same as `get_OP_RETURN`, for a transaction decoded by `parse_transaction`
+
+    """
+    OP_RETURNs = []
+    for output in tx.vout:
+        pushes = get_nulldata_pushes(output.scriptPubKey)
+        if pushes and pushes[0].startswith(BLOCKVOKE_IDENTIFIER):
+            OP_RETURNs.append(" ".join(push.hex() for push in pushes))
+    return OP_RETURNs
+
+def get_raw_block_OP_RETURNs(raw_block):
+    """Returns (txid, OP_RETURNs) for the BlockVoke transactions in a
+    serialized block (`getblock <hash> 0`)
+
+    Only the transactions that contain a BlockVoke OP_RETURN candidate
+    are decoded.
+
+    """
+    raw_block = bytes.fromhex(raw_block) if isinstance(raw_block, str) else raw_block
+
+    candidates = find_raw_OP_RETURN_candidates(raw_block)
+    if not candidates:
+        return []
+
+    blockvoke_txs = []
+    for start, end in iter_block_transactions(raw_block):
+        if start > candidates[-1]:
+            break
+        i = bisect.bisect_left(candidates, start)
+        if i < len(candidates) and candidates[i] < end:
+            tx, _ = parse_transaction(raw_block, start)
+            OP_RETURNs = get_raw_OP_RETURN(tx)
+            if OP_RETURNs:
+                blockvoke_txs.append((tx.txid, OP_RETURNs))
+    return blockvoke_txs
+
+def get_raw_transaction_OP_RETURNs(raw_txs):
+    """Returns (txid, OP_RETURNs) for the BlockVoke transactions in a list
+    of serialized transactions (`getrawtransaction <txid>`)
+
+    """
+    blockvoke_txs = []
+    for raw_tx in raw_txs:
+        raw_tx = bytes.fromhex(raw_tx) if isinstance(raw_tx, str) else raw_tx
+        if find_raw_OP_RETURN_candidates(raw_tx):
+            tx, _ = parse_transaction(raw_tx)
+            OP_RETURNs = get_raw_OP_RETURN(tx)
+            if OP_RETURNs:
+                blockvoke_txs.append((tx.txid, OP_RETURNs))
+    return blockvoke_txs
+
+def get_revocations_from_raw_block(raw_block):
+    return [get_cert_fingerprint_16(OP_RETURNs[0]) for txid, OP_RETURNs in get_raw_block_OP_RETURNs(raw_block)
+            if is_revocation_payload(OP_RETURNs[0])]
+
+def get_revocations_from_raw_transactions(raw_txs):
+    return [get_cert_fingerprint_16(OP_RETURNs[0]) for txid, OP_RETURNs in get_raw_transaction_OP_RETURNs(raw_txs)
+            if is_revocation_payload(OP_RETURNs[0])]
+
+def get_raw_block(height, rpcconnect=None):
+    return get_block(height, rpcconnect, verbosity=0)
+
+def get_revocations_in_block(height, rpcconnect=None):
+    return get_revocations_from_raw_block(get_raw_block(height, rpcconnect))
+
+def iter_blockrange(block_function, blockrange, rpcconnect=None, workers=1, use_processes=False, max_pending=None):
+    """Yields (height, block_function(height, rpcconnect)) for every height
+    in `blockrange`, in height order
+
+    With `workers` > 1 the blocks are fetched and parsed concurrently in a
+    thread pool, or a process pool if `use_processes` is set (the
+    `block_function` must then be picklable).  At most `max_pending`
+    blocks (2 * `workers` by default) are in flight or waiting to be
+    consumed, so memory use does not grow with the range.
+
+    """
+    if workers <= 1:
+        for height in blockrange:
+            yield height, block_function(height, rpcconnect)
+        return
+
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+
+    with (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(workers) as executor:
+        try:
+            for height in blockrange:
+                if len(pending) >= max_pending:
+                    pending_height, result = pending.popleft()
+                    yield pending_height, result.result()
+                pending.append((height, executor.submit(block_function, height, rpcconnect)))
+
+            while pending:
+                pending_height, result = pending.popleft()
+                yield pending_height, result.result()
+        finally:
+            for pending_height, result in pending:
+                result.cancel()
+
+def iter_revocations_in_blockrange(blockrange, rpcconnect=None, workers=1, use_processes=False, max_pending=None):
+    """Yields (height, revocations) block by block
+
+    See `iter_blockrange` for the parallel mode.
+
+    """
+    return iter_blockrange(get_revocations_in_block, blockrange, rpcconnect, workers, use_processes, max_pending)
+
+def iter_block_tx_lists_in_blockrange(blockrange, rpcconnect=None, workers=1, max_pending=None):
+    """Yields (height, decoded transactions) block by block
+
+    """
+    return iter_blockrange(get_block_tx_list, blockrange, rpcconnect, workers, False, max_pending)
 
 def get_tx_list_in_mempool(rpcconnect=None):
     btd = get_bitcoind_connection(rpcconnect=rpcconnect)
@@ -32,8 +226,60 @@ def get_tx_list_in_mempool(rpcconnect=None):
 
     for txid in rawmempool:
         try:
-            txs.append(btd.decoderawtransaction(btd.getrawtransaction(txid)))
+            txs.append(btd.getrawtransaction(txid, True))
         except Exception as E:
             traceback.print_exception(type(E), E, E.__traceback__)
-            btd = get_bitcoind_connection(rpcconnect=rpcconnect)
     return txs
+
+class MempoolTracker(object):
+    """Follows the mempool between polls
+
+    Each `poll` diffs the txids in the mempool against the previous poll,
+    fetches only the new transactions (one decoded `getrawtransaction`
+    each) and forgets the txids that have left the mempool.  The poll
+    interval doubles while nothing new arrives, up to
+    `max_poll_interval`, and drops back to `min_poll_interval` as soon as
+    new transactions show up.
+
+    """
+    def __init__(self, rpcconnect=None, min_poll_interval=0.5, max_poll_interval=5):
+        self.rpcconnect = rpcconnect
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_interval = min_poll_interval
+        self.txids = set()
+
+    def poll(self):
+        """Returns the decoded transactions that entered the mempool since
+        the last poll
+
+        """
+        btd = get_bitcoind_connection(rpcconnect=self.rpcconnect)
+
+        rawmempool = set(btd.getrawmempool())
+        txs = []
+
+        for txid in rawmempool - self.txids:
+            try:
+                txs.append(btd.getrawtransaction(txid, True))
+            except JSONRPCException:
+                # Mined or evicted between getrawmempool and getrawtransaction
+                rawmempool.discard(txid)
+            except (OSError, http.client.HTTPException) as E:
+                # Lost bitcoind: keep the txids of the last poll, so that
+                # the next poll fetches these transactions again
+                traceback.print_exception(type(E), E, E.__traceback__)
+                self.poll_interval = min(self.poll_interval * 2, self.max_poll_interval)
+                return []
+
+        self.txids = rawmempool
+
+        if txs:
+            self.poll_interval = self.min_poll_interval
+        else:
+            self.poll_interval = min(self.poll_interval * 2, self.max_poll_interval)
+
+        return txs
+
+    def wait(self):
+        time.sleep(self.poll_interval)
@@ -0,0 +1,131 @@
+"""Python lib to follow bitcoind's ZMQ notifications for BlockVoke
+ revocations
+
+bitcoind must be started with `-zmqpubrawtx`, `-zmqpubrawblock` and
+`-zmqpubsequence` pointing at the endpoints given to
+`BlockVokeZMQSubscriber`.
+
+"""
+
+import struct
+from collections import OrderedDict
+
+from blockvoke_parser import get_cert_fingerprint_16, get_raw_block_OP_RETURNs, get_raw_transaction_OP_RETURNs, is_revocation_payload
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+ZMQ_TOPICS = ("rawtx", "rawblock", "sequence")
+
+# Transactions kept while waiting for their `rawtx` or mempool `sequence` notification
+MAX_PENDING_TRANSACTIONS = 10000
+
+class BlockVokeZMQSubscriber(object):
+    """Subscribes to the `rawtx`, `rawblock` and `sequence` topics and
+    hands the BlockVoke revocations in them to callbacks
+
+    `on_mempool_revocations(fingerprints)` is called for transactions
+    entering the mempool, and `on_raw_block(raw_block)` with every
+    connected block, to be passed on to a `BlockScanner`.
+
+    bitcoind also publishes `rawtx` for every transaction of a connected
+    block, so a transaction is only taken as entering the mempool once
+    its `sequence` "A" (mempool acceptance) notification arrived too;
+    the others are left to the block.  bitcoind
+    numbers the messages of every topic, so
+    `on_missed_notifications(topic)` is called when messages were dropped
+    and the caller has to fall back to polling.
+    `on_block_disconnected(blockhash)` is called for blocks removed by a
+    reorg.
+
+    """
+    def __init__(self,
+                 zmq_endpoints,
+                 on_mempool_revocations,
+                 on_raw_block,
+                 on_missed_notifications=None,
+                 on_block_disconnected=None,
+                 receive_timeout=1000):
+        if zmq is None:
+            raise ImportError("pyzmq is required to subscribe to bitcoind ZMQ notifications")
+
+        self.on_mempool_revocations = on_mempool_revocations
+        self.on_raw_block = on_raw_block
+        self.on_missed_notifications = on_missed_notifications
+        self.on_block_disconnected = on_block_disconnected
+        self.receive_timeout = receive_timeout
+        self.__sequence_numbers__ = {}
+        # txid -> fingerprints of the revocations whose "A" has not arrived yet
+        self.__pending_revocations__ = OrderedDict()
+        # txids of the "A" notifications whose `rawtx` has not arrived yet
+        self.__accepted_txids__ = OrderedDict()
+
+        self.socket = zmq.Context.instance().socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, 0)
+        for topic in ZMQ_TOPICS:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        for zmq_endpoint in zmq_endpoints:
+            self.socket.connect(zmq_endpoint)
+
+    def receive(self):
+        """Waits up to `receive_timeout` ms for one notification and
+        dispatches it
+
+        Returns False if nothing arrived.
+
+        """
+        if not self.socket.poll(self.receive_timeout):
+            return False
+
+        topic, body, sequence = self.socket.recv_multipart()
+        topic = topic.decode()
+        sequence = struct.unpack("<I", sequence)[0]
+
+        if (topic in self.__sequence_numbers__
+            and sequence != (self.__sequence_numbers__[topic] + 1) & 0xffffffff
+            and self.on_missed_notifications):
+            self.on_missed_notifications(topic)
+        self.__sequence_numbers__[topic] = sequence
+
+        if topic == "rawtx":
+            for txid, OP_RETURNs in get_raw_transaction_OP_RETURNs([body]):
+                if not is_revocation_payload(OP_RETURNs[0]):
+                    continue
+                if self.__accepted_txids__.pop(txid, False):
+                    self.on_mempool_revocations([get_cert_fingerprint_16(OP_RETURNs[0])])
+                else:
+                    self.__add_pending__(self.__pending_revocations__, txid, get_cert_fingerprint_16(OP_RETURNs[0]))
+        elif topic == "rawblock":
+            for txid, OP_RETURNs in get_raw_block_OP_RETURNs(body):
+                self.__pending_revocations__.pop(txid, None)
+            self.on_raw_block(body)
+        elif topic == "sequence":
+            label = body[32:33]
+            if label == b"A":
+                txid = body[:32].hex()
+                fingerprint_16 = self.__pending_revocations__.pop(txid, None)
+                if fingerprint_16 is not None:
+                    self.on_mempool_revocations([fingerprint_16])
+                else:
+                    self.__add_pending__(self.__accepted_txids__, txid, True)
+            elif label == b"D" and self.on_block_disconnected:
+                self.on_block_disconnected(body[:32].hex())
+
+        return True
+
+    def __add_pending__(self, pending, txid, value):
+        pending[txid] = value
+        if len(pending) > MAX_PENDING_TRANSACTIONS:
+            pending.popitem(last=False)
+
+    def run(self, stop):
+        """Dispatches notifications until `stop()` returns True
+
+        """
+        while not stop():
+            self.receive()
+
+    def close(self):
+        self.socket.close(linger=0)
@@ -0,0 +1,122 @@
+"""Index of the BlockVoke metadata of the issued certificates
+
+Revoking a certificate needs its fingerprint, `not_valid_before`, multisig
+address and redeemScript, and the CA and CO pubkeys.  They are extracted
+once when the certificate is issued and kept in an SQLite database, so
+revocations neither parse the PEM file nor rebuild the multisig with
+bitcoind.  Every entry records the mtime and size of the certificate
+file it was read from, and is re-read when the file changed.
+
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+
+import revoke_certificate as RC
+import bitcoin_transactions as BT
+import blockvoke_codec as BC
+
+CERTIFICATE_METADATA_FILE = "./working_dir/certificate_metadata.sqlite"
+
+CERTIFICATE_METADATA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    dns_name TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    multisig_address TEXT NOT NULL,
+    redeemScript TEXT NOT NULL,
+    ca_pubkey TEXT NOT NULL,
+    co_pubkey TEXT NOT NULL,
+    not_valid_before_days INTEGER NOT NULL,
+    cert_mtime_ns INTEGER NOT NULL,
+    cert_size INTEGER NOT NULL
+);
+"""
+
+CertificateMetadata = namedtuple("CertificateMetadata", ["dns_name",
+                                                         "fingerprint",
+                                                         "multisig_address",
+                                                         "redeemScript",
+                                                         "ca_pubkey",
+                                                         "co_pubkey",
+                                                         "not_valid_before_days"])
+
+def get_certificate_path(DNS, working_dir="./working_dir"):
+    return os.path.join(working_dir, "certificates", "{}-cert.pem".format(DNS))
+
+def read_certificate_metadata(DNS, co_pubkey, working_dir="./working_dir") -> CertificateMetadata:
+    """Parses the certificate of `DNS`, whose CO key is `co_pubkey` (hex)
+
+    """
+    BlockVokeCertificate, cert_multisig_address, ca_address_pubkey_hex = RC.load_blockvoke_certificate(DNS, working_dir)
+
+    cert_multisig_redeemScript = BT.get_multisig_redeemScript(
+        1,
+        [bytes.fromhex(pubkey) for pubkey in RC.get_multisig_pubkeys(co_pubkey, ca_address_pubkey_hex)])
+
+    if BT.b58decode_check(cert_multisig_address.decode())[1:] != BT.hash160(cert_multisig_redeemScript):
+        raise Exception("Error: CO pubkey `{0}` does not match the multisig address '{1}' of `{2}`".format(
+            co_pubkey,
+            cert_multisig_address.decode(),
+            DNS))
+
+    return CertificateMetadata(DNS,
+                               BlockVokeCertificate.fingerprint(BlockVokeCertificate.signature_hash_algorithm).hex(),
+                               cert_multisig_address.decode(),
+                               cert_multisig_redeemScript.hex(),
+                               ca_address_pubkey_hex.decode(),
+                               co_pubkey,
+                               BC.get_days_since_epoch(BlockVokeCertificate.not_valid_before))
+
+class CertificateMetadataIndex(object):
+    def __init__(self, index_file_path=CERTIFICATE_METADATA_FILE):
+        self.db = sqlite3.connect(index_file_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(CERTIFICATE_METADATA_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, DNS, co_pubkey, working_dir="./working_dir") -> CertificateMetadata:
+        """Reads and indexes the certificate of `DNS`
+
+        """
+        # Taken before reading, so a certificate replaced meanwhile is found stale
+        cert_stat = os.stat(get_certificate_path(DNS, working_dir))
+        cert_metadata = read_certificate_metadata(DNS, co_pubkey, working_dir)
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO certificates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            tuple(cert_metadata) + (cert_stat.st_mtime_ns, cert_stat.st_size))
+
+        return cert_metadata
+
+    def get(self, DNS, working_dir="./working_dir"):
+        """Returns the `CertificateMetadata` of `DNS`, or None if it is not
+        indexed
+
+        A stale entry is re-read from the certificate, and dropped if the
+        certificate is gone.
+
+        """
+        row = self.db.execute("SELECT * FROM certificates WHERE dns_name = ?", (DNS,)).fetchone()
+        if row is None:
+            return None
+
+        cert_metadata, cert_mtime_ns, cert_size = CertificateMetadata(*row[:-2]), row[-2], row[-1]
+
+        try:
+            cert_stat = os.stat(get_certificate_path(DNS, working_dir))
+        except FileNotFoundError:
+            self.remove(DNS)
+            return None
+
+        if (cert_stat.st_mtime_ns, cert_stat.st_size) != (cert_mtime_ns, cert_size):
+            return self.add(DNS, cert_metadata.co_pubkey, working_dir)
+
+        return cert_metadata
+
+    def remove(self, DNS):
+        with self.db:
+            self.db.execute("DELETE FROM certificates WHERE dns_name = ?", (DNS,))
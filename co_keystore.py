@@ -0,0 +1,97 @@
+"""Keystore of the CO keys of many certificates in one HD wallet
+
+Instead of one bitcoind wallet per certificate, the CO addresses are
+derived from a single HD wallet, one derivation index per certificate.
+The DNS name, derivation index, address and public key of every CO key
+are kept in an SQLite database, so finding the CO address of a
+certificate is an index lookup and no wallet has to be loaded.  The
+shared wallet stays loaded for signing, see `wallet_session`.
+
+"""
+
+import sqlite3
+from collections import namedtuple
+
+from blockvoke_bitcoin_rpc import wallet_session
+
+CO_KEYSTORE_FILE = "./working_dir/co_keystore.sqlite"
+CO_KEYSTORE_WALLET = "blockvoke-co-keystore"
+
+CO_KEYSTORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS co_keys (
+    dns_name TEXT PRIMARY KEY,
+    derivation_index INTEGER NOT NULL,
+    hdkeypath TEXT NOT NULL,
+    address TEXT NOT NULL UNIQUE,
+    pubkey TEXT NOT NULL
+);
+"""
+
+COKey = namedtuple("COKey", ["dns_name", "derivation_index", "hdkeypath", "address", "pubkey"])
+
+def get_derivation_index(hdkeypath) -> int:
+    """Returns the last index of a BIP32 path such as `m/84'/1'/0'/0/5`
+
+    """
+    return int(hdkeypath.rsplit("/", 1)[-1].rstrip("'h"))
+
+class COKeystore(object):
+    def __init__(self,
+                 keystore_file_path=CO_KEYSTORE_FILE,
+                 bitcoin_wallet=CO_KEYSTORE_WALLET,
+                 rpcconnect=None):
+        self.bitcoin_wallet = bitcoin_wallet
+        self.rpcconnect = rpcconnect
+        self.db = sqlite3.connect(keystore_file_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(CO_KEYSTORE_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get(self, DNS):
+        row = self.db.execute("SELECT * FROM co_keys WHERE dns_name = ?", (DNS,)).fetchone()
+        return COKey(*row) if row else None
+
+    def get_address(self, DNS) -> str:
+        co_key = self.get(DNS)
+        if co_key is None:
+            raise KeyError("No CO key for `{}` in the keystore".format(DNS))
+        return co_key.address
+
+    def get_all(self):
+        return [COKey(*row) for row in self.db.execute("SELECT * FROM co_keys ORDER BY derivation_index")]
+
+    def new_key(self, DNS) -> COKey:
+        """Derives the next key of the HD wallet for `DNS`, or returns the
+        key it already has
+
+        """
+        return self.new_keys([DNS])[0]
+
+    def new_keys(self, DNS_names, batch_size=1000):
+        """Derives the keys of many certificates with batched RPC calls
+
+        The HD wallet is created on first use.  Returns the `COKey` of every
+        name in `DNS_names`.
+
+        """
+        new_DNS_names = [DNS for DNS in dict.fromkeys(DNS_names) if self.get(DNS) is None]
+
+        if new_DNS_names:
+            with wallet_session(self.bitcoin_wallet, self.rpcconnect, create=True) as btd:
+                for i in range(0, len(new_DNS_names), batch_size):
+                    batch = new_DNS_names[i:i + batch_size]
+                    # The label lets `getaddressesbylabel` find the address as with one wallet per certificate
+                    addresses = btd.batch_([["getnewaddress", "{}-coaddress".format(DNS)] for DNS in batch])
+                    addresses_info = btd.batch_([["getaddressinfo", address] for address in addresses])
+                    with self.db:
+                        self.db.executemany("INSERT INTO co_keys VALUES (?, ?, ?, ?, ?)",
+                                            [(DNS,
+                                              get_derivation_index(address_info["hdkeypath"]),
+                                              address_info["hdkeypath"],
+                                              address,
+                                              address_info["pubkey"]) for DNS, address, address_info in zip(batch, addresses, addresses_info)])
+
+        return [self.get(DNS) for DNS in DNS_names]
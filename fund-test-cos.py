@@ -3,88 +3,104 @@
 import blockvoke_bitcoin_rpc as BBR
 import generate_certificate as GC
 import revocation_logger as RL
+import co_keystore as CK
+import rpc_metrics as RM
 import sys, argparse
 import tqdm
 from decimal import Decimal
 
 
 TEST_LOGGER_CSV_FILE = "./working_dir/test_logs/TEST_{}.csv"
+TEST_LOGGER_JOURNAL_FILE = "./working_dir/test_logs/TEST_{}.journal"
 
-def main(id, batch_size):
+def main(id, batch_size, keystore_file_path=None):
+    co_keystore = CK.COKeystore(keystore_file_path) if keystore_file_path is not None else None
     bv_test_logger = RL.RevocationLogger()
-    bv_test_logger.read(TEST_LOGGER_CSV_FILE.format(id))
+    bv_test_logger.read(TEST_LOGGER_CSV_FILE.format(id), TEST_LOGGER_JOURNAL_FILE.format(id))
+    bv_test_logger.open_journal(TEST_LOGGER_JOURNAL_FILE.format(id), TEST_LOGGER_CSV_FILE.format(id))
     print("Fetching CO addresses")
     transaction_outputs = {}
+    co_dns_names = {}
     for cert_dns_name, log_value in tqdm.tqdm(bv_test_logger.certificates.items()):
-        DNS = log_value["Cert DNS name"]
+        DNS = log_value.dns_name
 
-        if log_value["CO_funded"] == "True":
+        if log_value.co_funded:
             print("CO `{}` is already funded, skipping".format(DNS))
             continue
 
-        bv_test_logger.set_co_funded(DNS)
-        btd_co = BBR.get_bitcoind_connection(DNS)
-        btd_co.loadwallet(DNS)
-        try:
-            co_address = list(btd_co.getaddressesbylabel("{}-coaddress".format(DNS)).keys())[0]
-            transaction_outputs[co_address] = Decimal("0.00000600") 
-        except Exception as E:
-            btd_co.unloadwallet(DNS)
-            print(E)
-            raise(E)
+        if co_keystore is not None:
+            co_address = co_keystore.get_address(DNS)
         else:
-            btd_co.unloadwallet(DNS)
+            with BBR.wallet_session(DNS) as btd_co:
+                try:
+                    co_address = list(btd_co.getaddressesbylabel("{}-coaddress".format(DNS)).keys())[0]
+                except Exception as E:
+                    print(E)
+                    raise(E)
+        transaction_outputs[co_address] = Decimal("0.00000600") 
+        co_dns_names[co_address] = DNS
 
+    if co_keystore is not None:
+        co_keystore.close()
 
-    btd = BBR.get_bitcoind_connection("testnetfaucet")
-    btd.loadwallet("testnetfaucet")
-    faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())[0]
+    with BBR.wallet_session("testnetfaucet") as btd:
+        faucet_address = list(btd.getaddressesbylabel("testnetfaucet").keys())[0]
 
-    transaction_batches = [{}]
+        transaction_batches = [{}]
 
-    i = 0
-    for k, v in transaction_outputs.items():
-        if i >= batch_size:
-            transaction_batches.append({})
-            i=0
-        transaction_batches[-1][k] = v
-        i=i+1
+        i = 0
+        for k, v in transaction_outputs.items():
+            if i >= batch_size:
+                transaction_batches.append({})
+                i=0
+            transaction_batches[-1][k] = v
+            i=i+1
 
-    txids = []
-    fees = 0
-    for transaction_batch in tqdm.tqdm(transaction_batches, desc="Sending transactions in {} batches".format(len(transaction_batches))):
-        try:
-            rawtransaction = btd.createrawtransaction([], transaction_batch)
-            funded_rawtransaction = btd.fundrawtransaction(
-                rawtransaction,
-                {
-                    "changeAddress": faucet_address,
-                    "fee_rate":1
-                })
-            fee = funded_rawtransaction["fee"]
-            signed_rawtransaction = btd.signrawtransactionwithwallet(
-                funded_rawtransaction["hex"])
+        txids = []
+        fees = 0
+        for transaction_batch in tqdm.tqdm(transaction_batches, desc="Sending transactions in {} batches".format(len(transaction_batches))):
+            try:
+                rawtransaction = btd.createrawtransaction([], transaction_batch)
+                funded_rawtransaction = btd.fundrawtransaction(
+                    rawtransaction,
+                    {
+                        "changeAddress": faucet_address,
+                        "fee_rate":1
+                    })
+                fee = funded_rawtransaction["fee"]
+                signed_rawtransaction = btd.signrawtransactionwithwallet(
+                    funded_rawtransaction["hex"])
 
-            decoded_rawtransaction = btd.decoderawtransaction(signed_rawtransaction["hex"])
+                decoded_rawtransaction = btd.decoderawtransaction(signed_rawtransaction["hex"])
+
+                txid = btd.sendrawtransaction(signed_rawtransaction["hex"])
+                txids.append(txid)
+                fees = fees+fee
+                # txid = 1
+            except Exception as E:
+                print("Exception Occurred:")
+                bv_test_logger.compact(TEST_LOGGER_CSV_FILE.format(id))
+                raise(E)
+            for co_address in transaction_batch:
+                bv_test_logger.set_co_funded(co_dns_names[co_address])
+            bv_test_logger.sync_journal()
 
-            txid = btd.sendrawtransaction(signed_rawtransaction["hex"])
-            txids.append(txid)
-            fees = fees+fee
-            # txid = 1
-        except Exception as E:
-            print("Exception Occurred:")
-            raise(E)
         try:
-            bv_test_logger.write(TEST_LOGGER_CSV_FILE.format(id))
+            bv_test_logger.compact(TEST_LOGGER_CSV_FILE.format(id))
         except Exception as E:
             print("Error saving revocation logger file")
+        bv_test_logger.close_journal()
     
-    print("`{0}` Transactions sent successfully, spending `{1}` BTC as fees".format(len(txids), fees))
-    btd.unloadwallet("testnetfaucet")
+        print("`{0}` Transactions sent successfully, spending `{1}` BTC as fees".format(len(txids), fees))
            
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fund CO addresses with the required amount of bitcoin for the PoC test")
     parser.add_argument("-i", "--id", type=str, help="Test identifier", required=True)
     parser.add_argument("-b", "--batch-size", type=int, help="Batch size, i.e., maximum number of outputs per transaction", default=100)
+    parser.add_argument("-k", "--keystore", type=str, nargs="?", const=CK.CO_KEYSTORE_FILE, help="Look the CO addresses up in this keystore (default: %(const)s) instead of loading every CO wallet")
+    parser.add_argument("-m", "--rpc-metrics", type=str, help="Also write the per-method RPC metrics to this file, as JSON if it ends in .json and as Prometheus text otherwise")
     args = parser.parse_args()
-    main(args.id, args.batch_size)
+    try:
+        main(args.id, args.batch_size, args.keystore)
+    finally:
+        RM.report(args.rpc_metrics)
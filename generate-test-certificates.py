@@ -3,10 +3,17 @@
 import blockvoke_bitcoin_rpc as BBR
 import generate_certificate as GC
 import revocation_logger as RL
+import co_keystore as CK
+import acme_issuance as AI
+import certificate_metadata as CM
+import rpc_metrics as RM
 import sys, argparse
 import tqdm
+import time
+import concurrent.futures
 
 TEST_LOGGER_CSV_FILE = "./working_dir/test_logs/TEST_{}.csv"
+TEST_LOGGER_JOURNAL_FILE = "./working_dir/test_logs/TEST_{}.journal"
 CERT_COUNTRY = "DE"
 CERT_STATE = "Niedersachsen"
 CERT_LOCATION = "Göttingen"
@@ -15,46 +22,111 @@ CERT_ORGANISATIONAL_UNIT = "Example {0}-{1} Organisational Unit"
 CERT_COMMON_NAME = "example-{0}-{1}.org"
 CERT_DNS = CERT_COMMON_NAME
 CERT_EMAIL = "co@example-{0}-{1}.org"
+ACME_ACCOUNT_EMAIL = "co@example-{0}.org"
+ISSUANCE_WORKERS = 8
 
-def main(num, id):
+def generate_test_certificate(id, i, private_key, co_keystore, acme_issuer, certificate_index):
+    return GC.generate_certificate(
+        CERT_COUNTRY,
+        CERT_STATE,
+        CERT_LOCATION,
+        CERT_ORGANISATION.format(id, i),
+        CERT_ORGANISATIONAL_UNIT.format(id, i),
+        CERT_COMMON_NAME.format(id, i),
+        CERT_DNS.format(id, i),
+        CERT_EMAIL.format(id, i),
+        co_keystore=co_keystore,
+        private_key=private_key,
+        acme_issuer=acme_issuer,
+        certificate_index=certificate_index)
+
+def log_test_certificate(bv_test_logger, id, i, future) -> bool:
+    """Logs the certificate issued by `future`
+
+    Returns whether it was issued.
+
+    """
+    try:
+        certificate_fingerprint, co_address_pubkey, ca_address_pubkey, cert_multisig_address = future.result()
+    except Exception as E:
+        print("Error generating Certificate {}".format(i))
+        print(E)
+        return False
+
+    try:
+        bv_test_logger.add_certificate(
+            CERT_DNS.format(id, i),
+            certificate_fingerprint,
+            co_address_pubkey,
+            ca_address_pubkey,
+            cert_multisig_address)
+    except Exception as E:
+       print("Error logging generated Certificate {}".format(i)) 
+       raise(E)
+
+    return True
+
+def main(num, id, keystore_file_path=None, processes=None, workers=ISSUANCE_WORKERS):
     bv_test_logger = RL.RevocationLogger()
+    # Recover the certificates of an interrupted run
+    bv_test_logger.read(TEST_LOGGER_CSV_FILE.format(id), TEST_LOGGER_JOURNAL_FILE.format(id))
+    bv_test_logger.open_journal(TEST_LOGGER_JOURNAL_FILE.format(id), TEST_LOGGER_CSV_FILE.format(id))
+
+    pending = [i for i in range(1, num+1) if CERT_DNS.format(id, i) not in bv_test_logger.certificates]
+
+    co_keystore = None
+    if keystore_file_path is not None:
+        co_keystore = CK.COKeystore(keystore_file_path)
+        print("Deriving CO keys")
+        co_keystore.new_keys([CERT_DNS.format(id, i) for i in pending])
+
+    acme_issuer = AI.ACMEIssuer(ACME_ACCOUNT_EMAIL.format(id))
+    certificate_index = CM.CertificateMetadataIndex()
+
     print("Generating test Certificates")
-    for i in tqdm.tqdm(range(1, num+1)):
-        
-        try:
-            certificate_fingerprint, co_address_pubkey, ca_address_pubkey, cert_multisig_address = GC.generate_certificate(
-            CERT_COUNTRY,
-            CERT_STATE,
-            CERT_LOCATION,
-            CERT_ORGANISATION.format(id, i),
-            CERT_ORGANISATIONAL_UNIT.format(id, i),
-            CERT_COMMON_NAME.format(id, i),
-            CERT_DNS.format(id, i),
-            CERT_EMAIL.format(id, i))
-
-        except Exception as E:
-            print("Error generating Certificate {}".format(i))
-            print(E)
-            continue
-
-        try:
-            bv_test_logger.add_certificate(
-                CERT_DNS.format(id, i),
-                certificate_fingerprint,
-                co_address_pubkey,
-                ca_address_pubkey,
-                cert_multisig_address)
-        except Exception as E:
-           print("Error logging generated Certificate {}".format(i)) 
-           raise(E)
-
-    bv_test_logger.write(TEST_LOGGER_CSV_FILE.format(id))
+    num_issued = 0
+    start_time = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor, tqdm.tqdm(total=len(pending)) as progress:
+        futures = {}
+        # The RSA keys of the certificates are generated ahead in a process
+        # pool, and up to `workers` orders are in flight at pebble at a time
+        for i, private_key in zip(pending, GC.generate_private_keys(len(pending), processes)):
+            futures[executor.submit(generate_test_certificate, id, i, private_key, co_keystore, acme_issuer, certificate_index)] = i
+
+            if len(futures) >= 2 * workers:
+                done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    num_issued = num_issued + log_test_certificate(bv_test_logger, id, futures.pop(future), future)
+                    progress.update()
+
+        for future in concurrent.futures.as_completed(futures):
+            num_issued = num_issued + log_test_certificate(bv_test_logger, id, futures[future], future)
+            progress.update()
+    elapsed_time = time.monotonic() - start_time
+
+    print("Issued `{0}` certificates in `{1:.2f}` s, `{2:.2f}` certificates/s".format(num_issued,
+                                                                                     elapsed_time,
+                                                                                     num_issued / elapsed_time if elapsed_time else 0))
+
+    bv_test_logger.compact(TEST_LOGGER_CSV_FILE.format(id))
+    bv_test_logger.close_journal()
+    certificate_index.close()
+    if co_keystore is not None:
+        co_keystore.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Certificates for a BlockVoke test scenario")
     parser.add_argument("-n", "--num", type=int, help="Number of certificates to generate", required=True)
     parser.add_argument("-i", "--id", type=str, help="Test identifier", required=True)
+    parser.add_argument("-k", "--keystore", type=str, nargs="?", const=CK.CO_KEYSTORE_FILE, help="Derive the CO keys from the shared `{}` HD wallet and record them in this keystore (default: %(const)s) instead of creating one wallet per certificate".format(CK.CO_KEYSTORE_WALLET))
+
+    parser.add_argument("-p", "--processes", type=int, help="Number of processes generating the certificate keys (default: one per core)")
+    parser.add_argument("-w", "--workers", type=int, help="Number of certificates issued by pebble concurrently (default: %(default)s)", default=ISSUANCE_WORKERS)
+    parser.add_argument("-m", "--rpc-metrics", type=str, help="Also write the per-method RPC metrics to this file, as JSON if it ends in .json and as Prometheus text otherwise")
 
     args = parser.parse_args()
-    main(args.num, args.id)
+    try:
+        main(args.num, args.id, args.keystore, args.processes, args.workers)
+    finally:
+        RM.report(args.rpc_metrics)
 
@@ -1,10 +1,53 @@
 # Python lib to generate a `BlockVoke` Certificate
 
 import subprocess, os, shutil
+import collections
+from concurrent.futures import ProcessPoolExecutor
 import blockvoke_bitcoin_rpc as bitcoin
-from cryptography.x509 import load_pem_x509_certificate, ObjectIdentifier, SubjectAlternativeName, DNSName
+from cryptography.x509 import (load_pem_x509_certificate, ObjectIdentifier, SubjectAlternativeName, DNSName,
+                               CertificateSigningRequestBuilder, Name, NameAttribute)
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 
-CSR_OPENSSL_CNF = "oid_section = new_oids\n[ new_oids ]\nCO_Bitcoin_Pubkey=1.2.3.4\n\n[req]\ndistinguished_name = req_distinguished_name\n# attributes		= req_attributes\nreq_extensions = v3_req\nprompt = no\n\n[req_distinguished_name]\nC = {0}\nST = {1}\nL = {2}\nO = {3}\nOU = {4}\nCN = {5}\nCO_Bitcoin_Pubkey		= {6}\n[v3_req]\nsubjectAltName = @alt_names\n\n[alt_names]\nDNS.1 = {7}"
+# Temporary BlockVoke ObjectIdentifier, the CO_Bitcoin_Pubkey attribute of the CSR subject
+CO_BITCOIN_PUBKEY_OID = ObjectIdentifier("1.2.3.4")
+
+CERT_KEY_SIZE = 2048
+# Keys generated ahead per worker process by `generate_private_keys`
+KEYS_AHEAD_PER_WORKER = 4
+
+def generate_private_key() -> bytes:
+    """Generates an RSA key, returned DER encoded so it can be passed
+    between processes
+
+    """
+    return rsa.generate_private_key(public_exponent=65537, key_size=CERT_KEY_SIZE).private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption())
+
+def generate_private_keys(num, max_workers=None):
+    """Yields `num` RSA keys generated by a pool of `max_workers`
+    processes (one per core by default)
+
+    Only a few keys per process are generated ahead of the consumer.
+
+    """
+    max_workers = max_workers if max_workers is not None else os.cpu_count()
+    if max_workers <= 1:
+        for i in range(num):
+            yield serialization.load_der_private_key(generate_private_key(), password=None)
+        return
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = collections.deque()
+        for i in range(num):
+            futures.append(executor.submit(generate_private_key))
+            if len(futures) >= max_workers * KEYS_AHEAD_PER_WORKER:
+                yield serialization.load_der_private_key(futures.popleft().result(), password=None)
+        while futures:
+            yield serialization.load_der_private_key(futures.popleft().result(), password=None)
 
 def create_CSR(country,
                state,
@@ -15,31 +58,33 @@ def create_CSR(country,
                co_bitcoin_pubkey,
                DNS,
                working_dir="./working_dir",
-               openssl_working_dir="./working_dir/openssl"):
-
-    with open("{0}/openssl-{1}.cnf".format(openssl_working_dir, DNS), "w") as openssl_cnf:
-        openssl_cnf.write(CSR_OPENSSL_CNF.format(country, state,
-                                               location, organisation,
-                                               organisational_unit,
-                                               common_name,
-                                               co_bitcoin_pubkey,
-                                               DNS))
-
-    ret = subprocess.run(["openssl", "req", "-newkey",
-                          "rsa:2048", "-keyout",
-                          "{0}/cert-keys/PRIVATEKEY-{1}.key".format(working_dir,
-                                                                    DNS), "-out",
-                          "{0}/csrs/CSR-{1}.csr".format(working_dir,
-                                                        DNS), "-nodes", "-config",
-                          "{0}/openssl-{1}.cnf".format(openssl_working_dir,
-                                                       DNS)], capture_output=True)
-    # print(ret.stderr.decode())
-    # print(ret.stdout.decode())
-
-    ret.check_returncode()
-
-    subprocess.run(["openssl", "req", "-noout", "-text", "-in",
-                    "{0}/csrs/CSR-{1}.csr".format(working_dir, DNS)], capture_output=True)
+               private_key=None):
+    """Writes a new unencrypted private key and a CSR carrying
+    `co_bitcoin_pubkey` to `working_dir`
+
+    `private_key` is generated unless given, e.g. from `generate_private_keys`.
+
+    """
+    if private_key is None:
+        private_key = serialization.load_der_private_key(generate_private_key(), password=None)
+
+    CSR = CertificateSigningRequestBuilder().subject_name(Name([
+        NameAttribute(NameOID.COUNTRY_NAME, country),
+        NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, state),
+        NameAttribute(NameOID.LOCALITY_NAME, location),
+        NameAttribute(NameOID.ORGANIZATION_NAME, organisation),
+        NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, organisational_unit),
+        NameAttribute(NameOID.COMMON_NAME, common_name),
+        NameAttribute(CO_BITCOIN_PUBKEY_OID, co_bitcoin_pubkey)
+    ])).add_extension(SubjectAlternativeName([DNSName(DNS)]), critical=False).sign(private_key, hashes.SHA256())
+
+    with open("{0}/cert-keys/PRIVATEKEY-{1}.key".format(working_dir, DNS), "wb") as key_file:
+        key_file.write(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                 format=serialization.PrivateFormat.PKCS8,
+                                                 encryption_algorithm=serialization.NoEncryption()))
+
+    with open("{0}/csrs/CSR-{1}.csr".format(working_dir, DNS), "wb") as csr_file:
+        csr_file.write(CSR.public_bytes(serialization.Encoding.PEM))
 
 def generate_certificate(country,
                          state,
@@ -50,38 +95,44 @@ def generate_certificate(country,
                          DNS,
                          email,
                          working_dir="./working_dir",
-                         openssl_working_dir="./working_dir/openssl",
                          certbot_working_dir="./working_dir/certbot",
                          pebble_server="https://localhost:14000/dir",
-                         bitcoin_wallet=None):
+                         bitcoin_wallet=None,
+                         co_keystore=None,
+                         private_key=None,
+                         acme_issuer=None,
+                         certificate_index=None):
 
     """
     Generate Certificate (CO)
     
-    1. Create a new address in an existing wallet
-    2. Generates a CSR using openssl with the pubkey of new address (Unencrypted private key)
-    3. Uses certbot to request for certificate generation from pebble ca
+    1. Create a new address in an existing wallet (or derive the next key of the `co_keystore` HD wallet)
+    2. Generates a CSR with the pubkey of new address (Unencrypted private key, `private_key` if given)
+    3. Uses certbot (or `acme_issuer`, an `acme_issuance.ACMEIssuer`) to request for certificate generation from pebble ca
+    4. Records the certificate in `certificate_index`, a `certificate_metadata.CertificateMetadataIndex`, if given
     """
 
-    if bitcoin_wallet is None:
-        bitcoin_wallet = DNS
-        btd = bitcoin.get_bitcoind_connection(bitcoin_wallet)
-        btd.createwallet(bitcoin_wallet)
+    if co_keystore is not None:
+        new_address_pubkey = co_keystore.new_key(DNS).pubkey
     else:
-        btd = bitcoin.get_bitcoind_connection(bitcoin_wallet)
-        btd.loadwallet(bitcoin_wallet)
+        wallet_session_cache = bitcoin.get_wallet_session_cache()
+        if bitcoin_wallet is None:
+            bitcoin_wallet = DNS
+            btd = wallet_session_cache.acquire(bitcoin_wallet, create=True)
+        else:
+            btd = wallet_session_cache.acquire(bitcoin_wallet)
 
-    try:
-        new_address = btd.getnewaddress("{}-coaddress".format(bitcoin_wallet))
-        new_address_pubkey = (btd.getaddressinfo(new_address))["pubkey"]
-    except Exception as E:
-        print("Could not generate a new address for the specified wallet")
+        try:
+            new_address = btd.getnewaddress("{}-coaddress".format(bitcoin_wallet))
+            new_address_pubkey = (btd.getaddressinfo(new_address))["pubkey"]
+        except Exception as E:
+            print("Could not generate a new address for the specified wallet")
 
-        print(E)
+            print(E)
 
-    finally:
-        btd.unloadwallet(bitcoin_wallet)
-        del btd
+        finally:
+            wallet_session_cache.release(bitcoin_wallet)
+            del btd
 
     create_CSR(country,
                state,
@@ -92,37 +143,41 @@ def generate_certificate(country,
                new_address_pubkey,
                DNS,
                working_dir=working_dir,
-               openssl_working_dir=openssl_working_dir)
-
-    subprocess.run(["sudo", "certbot", "--non-interactive",
-                    "--agree-tos", "--email", "'{}'".format(email),
-                    "--no-eff-email", "--no-verify-ssl",
-                    "--standalone",
-                    "--config-dir={}/config".format(certbot_working_dir),
-                    "--logs-dir={}/logs".format(certbot_working_dir),
-                    "--work-dir={}/work".format(certbot_working_dir),
-                    "--server={}".format(pebble_server), "register"], capture_output=True)
-
-    subprocess.run(["sudo", "certbot", "--non-interactive",
-                    "--agree-tos", "--email", "'{}'".format(email),
-                    "--no-eff-email", "--no-verify-ssl",
-                    "--standalone",
-                    "--config-dir={}/config".format(certbot_working_dir),
-                    "--logs-dir={}/logs".format(certbot_working_dir),
-                    "--work-dir={}/work".format(certbot_working_dir),
-                    "--server={}".format(pebble_server), "certonly",
-                    "--csr={0}/csrs/CSR-{1}.csr".format(working_dir,
-                                                        DNS)], capture_output=True)
-
-    os.rename("0000_cert.pem",
-              "{0}/certificates/{1}-cert.pem".format(working_dir, DNS))
-    os.rename("0000_chain.pem",
-              "{0}/certificates/{1}-inter-chain.pem".format(working_dir, DNS))
-    os.rename("0001_chain.pem",
-              "{0}/certificates/{1}-full-chain.pem".format(working_dir, DNS))
-
-    subprocess.run(["openssl", "x509", "-noout", "-text", "-in",
-                    "{0}/certificates/{1}-cert.pem".format(working_dir, DNS)])
+               private_key=private_key)
+
+    if acme_issuer is not None:
+        acme_issuer.issue_certificate(DNS, working_dir)
+    else:
+        subprocess.run(["sudo", "certbot", "--non-interactive",
+                        "--agree-tos", "--email", "'{}'".format(email),
+                        "--no-eff-email", "--no-verify-ssl",
+                        "--standalone",
+                        "--config-dir={}/config".format(certbot_working_dir),
+                        "--logs-dir={}/logs".format(certbot_working_dir),
+                        "--work-dir={}/work".format(certbot_working_dir),
+                        "--server={}".format(pebble_server), "register"], capture_output=True)
+
+        subprocess.run(["sudo", "certbot", "--non-interactive",
+                        "--agree-tos", "--email", "'{}'".format(email),
+                        "--no-eff-email", "--no-verify-ssl",
+                        "--standalone",
+                        "--config-dir={}/config".format(certbot_working_dir),
+                        "--logs-dir={}/logs".format(certbot_working_dir),
+                        "--work-dir={}/work".format(certbot_working_dir),
+                        "--server={}".format(pebble_server), "certonly",
+                        "--csr={0}/csrs/CSR-{1}.csr".format(working_dir,
+                                                            DNS)], capture_output=True)
+
+        os.rename("0000_cert.pem",
+                  "{0}/certificates/{1}-cert.pem".format(working_dir, DNS))
+        os.rename("0000_chain.pem",
+                  "{0}/certificates/{1}-inter-chain.pem".format(working_dir, DNS))
+        os.rename("0001_chain.pem",
+                  "{0}/certificates/{1}-full-chain.pem".format(working_dir, DNS))
+
+        subprocess.run(["openssl", "x509", "-noout", "-text", "-in",
+                        "{0}/certificates/{1}-cert.pem".format(working_dir, DNS)])
+
     BlockVokeCertificate = None
     with open(os.path.join(working_dir,
                            "certificates",
@@ -134,4 +189,7 @@ def generate_certificate(country,
     ca_address_pubkey_hex = BlockVokeCertificate.extensions.get_extension_for_oid(ObjectIdentifier("1.2.3.5")).value.value # Temporary CA Bitcoin Address Pubkey ObjectIdentifier
     certificate_fingerprint = BlockVokeCertificate.fingerprint(BlockVokeCertificate.signature_hash_algorithm).hex()
 
+    if certificate_index is not None:
+        certificate_index.add(DNS, new_address_pubkey, working_dir)
+
     return certificate_fingerprint, new_address_pubkey, ca_address_pubkey_hex.decode(), cert_multisig_address.decode()
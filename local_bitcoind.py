@@ -0,0 +1,1139 @@
+"""Local stand-in for bitcoind's JSON-RPC server, to run the PoC scripts
+at scale without a synced testnet node
+
+`LocalBitcoind` keeps a simulated testnet chain, mempool, UTXO set and
+wallets in memory and answers the RPC methods the scripts call: wallet
+creation, loading and unloading, addresses and multisig addresses, raw
+transactions (create, fund, sign, send, submitpackage), the mempool,
+blocks and mining.  `serve` exposes it over HTTP the way bitcoind does,
+with keep-alive sessions, JSON-RPC batches and `/wallet/<name>`
+endpoints.
+
+Blocks are mined from the mempool every `block_interval` seconds and on
+`generatetoaddress`.  Transactions are checked for missing and
+double-spent inputs, coinbase maturity, the minimum relay fee and, with
+`require_standard`, dust.  Their scripts are not run: this stands in for
+bitcoind in load tests, not in consensus tests.  Given a
+`local_zmq_publisher.ZMQPublisher`, the node publishes the `rawtx`,
+`rawblock` and `sequence` notifications of its mempool and blocks.  Wallet keys are derived from the node's
+seed and the wallet name, so runs with the same seed get the same keys.
+Nothing is persisted.
+
+"""
+
+import math
+import time
+import json
+import base64
+import struct
+import hashlib
+import threading
+import http.server
+import urllib.parse
+from decimal import Decimal, InvalidOperation
+from collections import namedtuple, OrderedDict
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+import bitcoin_transactions as BT
+from bitcoin_serialization import (OP_RETURN, OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4, Transaction, TransactionInput,
+                                   TransactionOutput, dsha256, read_varint, serialize_varint, serialize_script_push,
+                                   parse_transaction, serialize_transaction, get_script_pushes, get_nulldata_pushes,
+                                   get_txid, get_vsize)
+from blockvoke_bitcoin_rpc import (JSONRPCException, EncodeDecimal,
+                                   RPC_WALLET_ERROR, RPC_WALLET_NOT_FOUND, RPC_WALLET_ALREADY_LOADED)
+
+LOCAL_BITCOIND_RPC_PORT = 18453
+# Seconds between two mined blocks, 0 to only mine on `generatetoaddress`
+BLOCK_INTERVAL = 10
+COINBASE_MATURITY = 100
+BLOCK_SUBSIDY = 50 * BT.SATOSHIS_PER_BITCOIN
+MAX_BLOCK_WEIGHT = 4000000
+# Weight kept free in every block for its header and coinbase
+COINBASE_RESERVED_WEIGHT = 4000
+BLOCK_VERSION = 0x20000000
+# regtest's proof of work limit, the blocks are not actually mined
+BLOCK_BITS = 0x207fffff
+BLOCK_DIFFICULTY = 4.656542373906925e-10
+# sat/vB
+MIN_RELAY_FEE_RATE = 1
+DEFAULT_FEE_RATE = 1
+# BTC/kvB, `sendrawtransaction`'s default `maxfeerate`
+DEFAULT_MAX_FEE_RATE = Decimal("0.10")
+# Blocks pay to OP_TRUE unless a mining address is set
+OP_TRUE_SCRIPT = bytes([BT.OP_1])
+COINBASE_TAG = b"/blockvoke-local-bitcoind/"
+HD_KEYPATH = "m/84h/1h/0h/0/{}"
+ADDRESS_TYPES = ("legacy", "p2sh-segwit", "bech32")
+
+# bitcoind's RPC error codes
+RPC_MISC_ERROR = -1
+RPC_INVALID_ADDRESS_OR_KEY = -5
+RPC_WALLET_INSUFFICIENT_FUNDS = -6
+RPC_INVALID_PARAMETER = -8
+RPC_WALLET_INVALID_LABEL_NAME = -11
+RPC_WALLET_NOT_SPECIFIED = -19
+RPC_DESERIALIZATION_ERROR = -22
+RPC_VERIFY_ERROR = -25
+RPC_VERIFY_REJECTED = -26
+RPC_VERIFY_ALREADY_IN_CHAIN = -27
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_PARSE_ERROR = -32700
+
+OPCODE_NAMES = {0x00: "0", 0x4f: "-1", 0x61: "OP_NOP", 0x69: "OP_VERIFY", OP_RETURN: "OP_RETURN", 0x75: "OP_DROP",
+                BT.OP_DUP: "OP_DUP", BT.OP_EQUAL: "OP_EQUAL", BT.OP_EQUALVERIFY: "OP_EQUALVERIFY",
+                BT.OP_HASH160: "OP_HASH160", 0xaa: "OP_HASH256", BT.OP_CHECKSIG: "OP_CHECKSIG",
+                0xad: "OP_CHECKSIGVERIFY", BT.OP_CHECKMULTISIG: "OP_CHECKMULTISIG", 0xaf: "OP_CHECKMULTISIGVERIFY",
+                0xb1: "OP_CHECKLOCKTIMEVERIFY", 0xb2: "OP_CHECKSEQUENCEVERIFY"}
+OPCODE_NAMES.update({BT.OP_1 + i: str(i + 1) for i in range(16)})
+
+UTXO = namedtuple("UTXO", ["value", "scriptPubKey", "height", "coinbase"])
+MempoolEntry = namedtuple("MempoolEntry", ["tx", "raw", "fee", "vsize", "weight", "time"])
+LocalBlock = namedtuple("LocalBlock", ["hash", "header", "txids", "time", "size", "weight"])
+
+def rpc_error(code, message):
+    return JSONRPCException({"code": code, "message": message})
+
+def to_btc(satoshis) -> Decimal:
+    return (Decimal(satoshis) / BT.SATOSHIS_PER_BITCOIN).quantize(Decimal("0.00000001"))
+
+def get_fee_rate(btc_per_kvb) -> Decimal:
+    """Converts a BTC/kvB fee rate to sat/vB
+
+    """
+    return Decimal(str(btc_per_kvb)) * BT.SATOSHIS_PER_BITCOIN / 1000
+
+def get_script_num(data) -> int:
+    if not data:
+        return 0
+    n = int.from_bytes(data, "little") & ~(0x80 << 8 * (len(data) - 1))
+    return -n if data[-1] & 0x80 else n
+
+def serialize_script_num(n) -> bytes:
+    return n.to_bytes((n.bit_length() + 8) // 8, "little") if n else b""
+
+def get_script_asm(script) -> str:
+    """Disassembles a script the way bitcoind's `asm` fields do
+
+    Pushes of up to 4 bytes are shown as numbers, longer ones in hex.
+
+    """
+    tokens, offset = [], 0
+    while offset < len(script):
+        opcode = script[offset]
+        offset = offset + 1
+        if opcode == 0 or opcode > OP_PUSHDATA4:
+            tokens.append(OPCODE_NAMES.get(opcode, "OP_UNKNOWN"))
+            continue
+
+        if opcode < OP_PUSHDATA1:
+            length = opcode
+        else:
+            length_size = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[opcode]
+            length = int.from_bytes(script[offset:offset + length_size], "little")
+            offset = offset + length_size
+        data = script[offset:offset + length]
+        offset = offset + length
+        if len(data) < length:
+            tokens.append("[error]")
+            break
+        tokens.append(str(get_script_num(data)) if len(data) <= 4 else data.hex())
+    return " ".join(tokens)
+
+def parse_multisig_redeemScript(redeemScript):
+    """Returns the (required, pubkeys) of a CHECKMULTISIG script, or None
+
+    """
+    if len(redeemScript) < 3 or redeemScript[-1] != BT.OP_CHECKMULTISIG:
+        return None
+    required, total = redeemScript[0] - BT.OP_1 + 1, redeemScript[-2] - BT.OP_1 + 1
+    pubkeys = get_script_pushes(redeemScript[:-2], 1)
+    if pubkeys is None or not 1 <= required <= total == len(pubkeys) <= 16:
+        return None
+    return required, pubkeys
+
+def get_script_type(scriptPubKey) -> str:
+    if get_nulldata_pushes(scriptPubKey) is not None:
+        return "nulldata"
+    if len(scriptPubKey) == 25 and scriptPubKey == BT.get_p2pkh_scriptPubKey(scriptPubKey[3:23]):
+        return "pubkeyhash"
+    if len(scriptPubKey) == 23 and scriptPubKey[:2] == bytes([BT.OP_HASH160, 20]) and scriptPubKey[-1] == BT.OP_EQUAL:
+        return "scripthash"
+    if len(scriptPubKey) == 22 and scriptPubKey[:2] == bytes([BT.OP_0, 20]):
+        return "witness_v0_keyhash"
+    if len(scriptPubKey) == 34 and scriptPubKey[:2] == bytes([BT.OP_0, 32]):
+        return "witness_v0_scripthash"
+    if parse_multisig_redeemScript(scriptPubKey) is not None:
+        return "multisig"
+    return "nonstandard"
+
+def decode_scriptPubKey(scriptPubKey) -> dict:
+    decoded = {"asm": get_script_asm(scriptPubKey),
+               "hex": scriptPubKey.hex(),
+               "type": get_script_type(scriptPubKey)}
+    address = BT.get_scriptPubKey_address(scriptPubKey)
+    if address is not None:
+        decoded["address"] = address
+    return decoded
+
+def is_coinbase(tx) -> bool:
+    return len(tx.vin) == 1 and tx.vin[0].txid == "00" * 32 and tx.vin[0].vout == 0xffffffff
+
+def parse_raw_transaction(raw):
+    """Decodes a serialized transaction, including transactions without
+    inputs such as `createrawtransaction([], ...)` returns, whose empty
+    input count reads like a segwit marker
+
+    """
+    try:
+        tx, offset = parse_transaction(raw)
+        if offset == len(raw):
+            return tx
+    except (ValueError, IndexError, struct.error):
+        pass
+
+    if raw[4:5] != b"\x00":
+        raise ValueError("TX decode failed")
+
+    vout = []
+    num_outputs, offset = read_varint(raw, 5)
+    for _ in range(num_outputs):
+        value = struct.unpack_from("<q", raw, offset)[0]
+        script_length, offset = read_varint(raw, offset + 8)
+        vout.append(TransactionOutput(value, bytes(raw[offset:offset + script_length])))
+        offset = offset + script_length
+    if offset + 4 != len(raw):
+        raise ValueError("TX decode failed")
+    tx = Transaction(None, struct.unpack_from("<i", raw, 0)[0], [], vout, struct.unpack_from("<I", raw, offset)[0])
+    return tx._replace(txid=get_txid(tx))
+
+def decode_transaction(tx, raw) -> dict:
+    """Returns `tx` in the form of `decoderawtransaction`
+
+    """
+    vin = []
+    for tx_input in tx.vin:
+        if is_coinbase(tx):
+            vin.append({"coinbase": tx_input.scriptSig.hex(), "sequence": tx_input.sequence})
+            continue
+        decoded_input = {"txid": tx_input.txid,
+                         "vout": tx_input.vout,
+                         "scriptSig": {"asm": get_script_asm(tx_input.scriptSig), "hex": tx_input.scriptSig.hex()}}
+        if tx_input.witness:
+            decoded_input["txinwitness"] = [item.hex() for item in tx_input.witness]
+        decoded_input["sequence"] = tx_input.sequence
+        vin.append(decoded_input)
+
+    weight = 3 * len(serialize_transaction(tx, witness=False)) + len(raw)
+    return {"txid": tx.txid,
+            "hash": dsha256(raw)[::-1].hex(),
+            "version": tx.version,
+            "size": len(raw),
+            "vsize": (weight + 3) // 4,
+            "weight": weight,
+            "locktime": tx.locktime,
+            "vin": vin,
+            "vout": [{"value": to_btc(tx_output.value), "n": n, "scriptPubKey": decode_scriptPubKey(tx_output.scriptPubKey)}
+                     for n, tx_output in enumerate(tx.vout)]}
+
+def get_merkle_root(txids) -> bytes:
+    hashes = [bytes.fromhex(txid)[::-1] for txid in txids]
+    while len(hashes) > 1:
+        if len(hashes) % 2:
+            hashes.append(hashes[-1])
+        hashes = [dsha256(hashes[i] + hashes[i + 1]) for i in range(0, len(hashes), 2)]
+    return hashes[0]
+
+def __get_signing_key__(scriptPubKey, redeemScript, get_key):
+    """Returns the key signing an input spending `scriptPubKey` and the
+    redeemScript `sign_transaction_inputs` expects for it, or (None, None)
+
+    `get_key(pubkey_hash)` returns the (private key, pubkey) of a key
+    hash, or None.  Only 1-of-n multisig scripts are signed.
+
+    """
+    script_type = get_script_type(scriptPubKey)
+    if script_type == "pubkeyhash":
+        return get_key(scriptPubKey[3:23]), None
+    if script_type == "witness_v0_keyhash":
+        return get_key(scriptPubKey[2:22]), None
+    if script_type == "scripthash" and redeemScript is not None:
+        if len(redeemScript) == 22 and redeemScript[:2] == bytes([BT.OP_0, 20]):
+            return get_key(redeemScript[2:]), None
+        multisig = parse_multisig_redeemScript(redeemScript)
+        if multisig is not None and multisig[0] == 1:
+            for pubkey in multisig[1]:
+                key = get_key(BT.hash160(pubkey))
+                if key is not None:
+                    return key, redeemScript
+    return None, None
+
+class LocalWallet(object):
+    """Keys, labels and multisig scripts of one `LocalBitcoind` wallet
+
+    The RPC methods called on a wallet endpoint are the `rpc_` methods of
+    this class.  Addresses are bech32 (P2WPKH) by default, as with
+    bitcoind.
+
+    """
+    def __init__(self, node, name):
+        self.node = node
+        self.name = name
+        self.seed = hashlib.sha256(node.seed + name.encode()).digest()
+        # (private value, pubkey) by derivation index
+        self.keys = []
+        # hash160(pubkey) -> derivation index
+        self.key_indexes = {}
+        # Address of a key -> derivation index
+        self.address_keys = {}
+        # scriptPubKey -> address, for every output script of the wallet
+        self.scripts = {}
+        # P2SH scriptPubKey -> redeemScript
+        self.redeemScripts = {}
+        self.labels = {}
+        self.label_addresses = {}
+
+    def __add_script__(self, scriptPubKey, address, label):
+        self.scripts[scriptPubKey] = address
+        if label is not None:
+            self.labels[address] = label
+            self.label_addresses.setdefault(label, []).append(address)
+
+    def __new_key__(self, label, address_type):
+        if address_type not in ADDRESS_TYPES:
+            raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Unknown address type '{}'".format(address_type))
+
+        index = len(self.keys)
+        private_value = int.from_bytes(hashlib.sha256(self.seed + struct.pack(">I", index)).digest(), "big") % (BT.SECP256K1_ORDER - 1) + 1
+        pubkey = ec.derive_private_key(private_value, ec.SECP256K1()).public_key().public_bytes(
+            serialization.Encoding.X962,
+            serialization.PublicFormat.CompressedPoint)
+        pubkey_hash = BT.hash160(pubkey)
+
+        witness_program = bytes([BT.OP_0, 20]) + pubkey_hash
+        if address_type == "legacy":
+            scriptPubKey = BT.get_p2pkh_scriptPubKey(pubkey_hash)
+        elif address_type == "p2sh-segwit":
+            scriptPubKey = BT.get_p2sh_scriptPubKey(witness_program)
+            self.redeemScripts[scriptPubKey] = witness_program
+        else:
+            scriptPubKey = witness_program
+        address = BT.get_scriptPubKey_address(scriptPubKey)
+
+        self.keys.append((private_value, pubkey))
+        self.key_indexes[pubkey_hash] = index
+        self.address_keys[address] = index
+        self.__add_script__(scriptPubKey, address, label)
+        return address
+
+    def get_key(self, pubkey_hash):
+        index = self.key_indexes.get(pubkey_hash)
+        if index is None:
+            return None
+        private_value, pubkey = self.keys[index]
+        return ec.derive_private_key(private_value, ec.SECP256K1()), pubkey
+
+    def __is_trusted__(self, txid) -> bool:
+        """Whether the mempool transaction `txid` only spends outputs of
+        this wallet, as bitcoind trusts its own unconfirmed change
+
+        """
+        return all(self.node.utxos[(tx_input.txid, tx_input.vout)].scriptPubKey in self.scripts
+                   for tx_input in self.node.mempool[txid].tx.vin)
+
+    def __get_unspent__(self, scriptPubKeys):
+        tip = self.node.get_height()
+        unspent = []
+        for scriptPubKey in scriptPubKeys:
+            address = self.scripts[scriptPubKey]
+            redeemScript = self.redeemScripts.get(scriptPubKey)
+            for outpoint in self.node.script_outpoints.get(scriptPubKey, ()):
+                if outpoint in self.node.mempool_spends:
+                    continue
+                utxo = self.node.utxos[outpoint]
+                confirmations = 0 if utxo.height is None else tip - utxo.height + 1
+                if utxo.coinbase and confirmations < COINBASE_MATURITY:
+                    continue
+
+                entry = {"txid": outpoint[0],
+                         "vout": outpoint[1],
+                         "address": address,
+                         "scriptPubKey": scriptPubKey.hex(),
+                         "amount": to_btc(utxo.value),
+                         "confirmations": confirmations,
+                         "spendable": __get_signing_key__(scriptPubKey, redeemScript, self.key_indexes.get)[0] is not None
+                                      and (redeemScript is None or parse_multisig_redeemScript(redeemScript) is None),
+                         "solvable": True,
+                         "safe": confirmations > 0 or self.__is_trusted__(outpoint[0])}
+                if address in self.labels:
+                    entry["label"] = self.labels[address]
+                if redeemScript is not None:
+                    entry["redeemScript"] = redeemScript.hex()
+                unspent.append(entry)
+        return unspent
+
+    def rpc_getnewaddress(self, label="", address_type="bech32"):
+        return self.__new_key__(label, address_type)
+
+    def rpc_getrawchangeaddress(self, address_type="bech32"):
+        return self.__new_key__(None, address_type)
+
+    def rpc_getaddressinfo(self, address):
+        scriptPubKey = self.node.get_address_scriptPubKey(address)
+        info = {"address": address,
+                "scriptPubKey": scriptPubKey.hex(),
+                "ismine": False,
+                "solvable": False,
+                "iswatchonly": False,
+                "isscript": get_script_type(scriptPubKey) == "scripthash",
+                "iswitness": scriptPubKey[0] == BT.OP_0,
+                "labels": []}
+
+        if address in self.address_keys:
+            index = self.address_keys[address]
+            info.update(ismine=True,
+                        solvable=True,
+                        pubkey=self.keys[index][1].hex(),
+                        iscompressed=True,
+                        hdkeypath=HD_KEYPATH.format(index))
+        elif scriptPubKey in self.redeemScripts:
+            required, pubkeys = parse_multisig_redeemScript(self.redeemScripts[scriptPubKey])
+            info.update(ismine=any(BT.hash160(pubkey) in self.key_indexes for pubkey in pubkeys),
+                        solvable=True,
+                        script="multisig",
+                        hex=self.redeemScripts[scriptPubKey].hex(),
+                        sigsrequired=required,
+                        pubkeys=[pubkey.hex() for pubkey in pubkeys])
+
+        if address in self.labels:
+            info["labels"] = [self.labels[address]]
+        return info
+
+    def rpc_getaddressesbylabel(self, label):
+        if label not in self.label_addresses:
+            raise rpc_error(RPC_WALLET_INVALID_LABEL_NAME, "No addresses with label {}".format(label))
+        return {address: {"purpose": "receive"} for address in self.label_addresses[label]}
+
+    def rpc_dumpprivkey(self, address):
+        self.node.get_address_scriptPubKey(address)
+        if address not in self.address_keys:
+            raise rpc_error(RPC_WALLET_ERROR, "Private key for address {} is not known".format(address))
+        private_value, pubkey = self.keys[self.address_keys[address]]
+        return BT.get_wif(ec.derive_private_key(private_value, ec.SECP256K1()))
+
+    def rpc_addmultisigaddress(self, nrequired, keys, label="", address_type="legacy"):
+        if address_type != "legacy":
+            raise rpc_error(RPC_INVALID_PARAMETER, "Only legacy multisig addresses are supported")
+
+        pubkeys = []
+        for key in keys:
+            if key in self.address_keys:
+                pubkeys.append(self.keys[self.address_keys[key]][1])
+                continue
+            try:
+                pubkey = bytes.fromhex(key)
+            except ValueError:
+                pubkey = b""
+            if len(pubkey) not in (33, 65):
+                raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Invalid public key: {}".format(key))
+            pubkeys.append(pubkey)
+        if not 1 <= nrequired <= len(pubkeys) <= 16:
+            raise rpc_error(RPC_INVALID_PARAMETER, "a multisignature address must require at least one key to redeem")
+
+        redeemScript = BT.get_multisig_redeemScript(nrequired, pubkeys)
+        scriptPubKey = BT.get_p2sh_scriptPubKey(redeemScript)
+        address = BT.get_scriptPubKey_address(scriptPubKey)
+        if scriptPubKey not in self.scripts:
+            self.redeemScripts[scriptPubKey] = redeemScript
+            self.__add_script__(scriptPubKey, address, label)
+
+        return {"address": address,
+                "redeemScript": redeemScript.hex(),
+                "descriptor": "sh(multi({0},{1}))".format(nrequired, ",".join(pubkey.hex() for pubkey in pubkeys))}
+
+    def rpc_listunspent(self, minconf=1, maxconf=9999999, addresses=None, include_unsafe=True, query_options=None):
+        if addresses:
+            scriptPubKeys = [scriptPubKey for scriptPubKey in map(self.node.get_address_scriptPubKey, addresses)
+                             if scriptPubKey in self.scripts]
+        else:
+            scriptPubKeys = self.scripts
+        return [utxo for utxo in self.__get_unspent__(scriptPubKeys)
+                if minconf <= utxo["confirmations"] <= maxconf and (include_unsafe or utxo["safe"])]
+
+    def rpc_getbalance(self, dummy="*", minconf=0, include_watchonly=True, avoid_reuse=False):
+        return to_btc(sum(BT.to_satoshis(utxo["amount"]) for utxo in self.__get_unspent__(self.scripts)
+                          if utxo["spendable"] and utxo["safe"] and utxo["confirmations"] >= minconf))
+
+    def rpc_getwalletinfo(self):
+        unspent = [utxo for utxo in self.__get_unspent__(self.scripts) if utxo["spendable"]]
+        return {"walletname": self.name,
+                "balance": to_btc(sum(BT.to_satoshis(utxo["amount"]) for utxo in unspent if utxo["confirmations"] > 0)),
+                "unconfirmed_balance": to_btc(sum(BT.to_satoshis(utxo["amount"]) for utxo in unspent if utxo["confirmations"] == 0)),
+                "keypoolsize": 1000,
+                "private_keys_enabled": True,
+                "descriptors": False}
+
+    def rpc_fundrawtransaction(self, hexstring, options=None):
+        """Adds inputs of the wallet's spendable and safe coins, largest
+        first, and a change output unless it would be dust
+
+        Supports the `changeAddress`, `fee_rate` (sat/vB) and `feeRate`
+        (BTC/kvB) options.
+
+        """
+        options = options if isinstance(options, dict) else {}
+        tx, raw = self.node.decode_raw_transaction(hexstring)
+
+        if "fee_rate" in options:
+            fee_rate = Decimal(str(options["fee_rate"]))
+        elif "feeRate" in options:
+            fee_rate = get_fee_rate(options["feeRate"])
+        else:
+            fee_rate = Decimal(DEFAULT_FEE_RATE)
+        change_scriptPubKey = self.node.get_address_scriptPubKey(options["changeAddress"] if "changeAddress" in options
+                                                                 else self.rpc_getrawchangeaddress())
+
+        vin, keys, prevouts = [], [], []
+        for tx_input in tx.vin:
+            utxo = self.node.utxos.get((tx_input.txid, tx_input.vout))
+            key = (__get_signing_key__(utxo.scriptPubKey, self.redeemScripts.get(utxo.scriptPubKey), self.get_key)[0]
+                   if utxo is not None else None)
+            if key is None:
+                raise rpc_error(RPC_WALLET_ERROR, "Unable to find UTXO for input {0}:{1}".format(tx_input.txid, tx_input.vout))
+            vin.append(tx_input)
+            keys.append(key)
+            prevouts.append((utxo.scriptPubKey, utxo.value, None))
+
+        preset = set((tx_input.txid, tx_input.vout) for tx_input in tx.vin)
+        candidates = iter(sorted((utxo for utxo in self.__get_unspent__(self.scripts)
+                                  if utxo["spendable"] and utxo["safe"] and (utxo["txid"], utxo["vout"]) not in preset),
+                                 key=lambda utxo: utxo["amount"],
+                                 reverse=True))
+        target = sum(tx_output.value for tx_output in tx.vout)
+
+        while True:
+            if vin:
+                available = sum(amount for scriptPubKey, amount, redeemScript in prevouts)
+                for change_outputs in ([TransactionOutput(0, change_scriptPubKey)], []):
+                    funded_tx = tx._replace(vin=vin, vout=list(tx.vout) + change_outputs)
+                    fee = math.ceil(get_vsize(BT.sign_transaction_inputs(funded_tx, keys, prevouts, dummy=True)) * fee_rate)
+                    change = available - target - fee
+                    if change_outputs and change >= BT.get_dust_limit(change_scriptPubKey):
+                        funded_tx = funded_tx._replace(vout=list(tx.vout) + [TransactionOutput(change, change_scriptPubKey)])
+                        return {"hex": serialize_transaction(funded_tx).hex(), "fee": to_btc(fee), "changepos": len(tx.vout)}
+                    if not change_outputs and change >= 0:
+                        # The remainder is too small for a change output and goes to the fee
+                        return {"hex": serialize_transaction(funded_tx).hex(), "fee": to_btc(available - target), "changepos": -1}
+
+            utxo = next(candidates, None)
+            if utxo is None:
+                raise rpc_error(RPC_WALLET_INSUFFICIENT_FUNDS, "Insufficient funds")
+            scriptPubKey = bytes.fromhex(utxo["scriptPubKey"])
+            vin.append(TransactionInput(utxo["txid"], utxo["vout"], b"", BT.SEQUENCE_RBF, []))
+            keys.append(__get_signing_key__(scriptPubKey, self.redeemScripts.get(scriptPubKey), self.get_key)[0])
+            prevouts.append((scriptPubKey, BT.to_satoshis(utxo["amount"]), None))
+
+    def rpc_signrawtransactionwithwallet(self, hexstring, prevtxs=None, sighashtype="ALL"):
+        return self.node.sign_raw_transaction(hexstring, prevtxs, self.get_key, self.redeemScripts.get)
+
+    def rpc_sendtoaddress(self, address, amount, comment="", comment_to="", subtractfeefromamount=False, replaceable=None,
+                          conf_target=None, estimate_mode=None, avoid_reuse=None, fee_rate=None, verbose=False):
+        funded_tx = self.rpc_fundrawtransaction(self.node.rpc_createrawtransaction([], {address: amount}),
+                                                {"fee_rate": fee_rate} if fee_rate is not None else {})
+        return self.node.rpc_sendrawtransaction(self.rpc_signrawtransactionwithwallet(funded_tx["hex"])["hex"])
+
+class LocalBitcoind(object):
+    """Simulated testnet node
+
+    Every RPC method is a `rpc_` method of this class or of `LocalWallet`,
+    run under one lock by `call`.  The UTXO set holds the outputs of the
+    mempool transactions too, with no height; the outputs spent by the
+    mempool are in `mempool_spends` until their spender is mined.
+
+    """
+    def __init__(self, seed=b"", mining_scriptPubKey=OP_TRUE_SCRIPT, require_standard=False, min_relay_fee_rate=MIN_RELAY_FEE_RATE,
+                 zmq_publisher=None):
+        self.seed = seed
+        self.zmq_publisher = zmq_publisher
+        # sat/vB, bitcoind's -minrelaytxfee
+        self.min_relay_fee_rate = Decimal(str(min_relay_fee_rate))
+        # Like testnet's bitcoind, dust and several OP_RETURN outputs are accepted unless set
+        self.require_standard = require_standard
+        self.mining_scriptPubKey = mining_scriptPubKey
+        self.lock = threading.RLock()
+        self.stopping = threading.Event()
+        self.start_time = time.time()
+        self.blocks = []
+        self.block_heights = {}
+        # txid -> serialized transaction, for every transaction in the chain or the mempool
+        self.transactions = {}
+        self.transaction_heights = {}
+        # (txid, vout) -> UTXO
+        self.utxos = {}
+        # scriptPubKey -> outpoints of its unspent outputs
+        self.script_outpoints = {}
+        self.mempool = OrderedDict()
+        # Outpoint -> txid of the mempool transaction spending it
+        self.mempool_spends = {}
+        self.wallets = {}
+        self.loaded_wallets = OrderedDict()
+
+        self.mine_block(OP_TRUE_SCRIPT)
+
+    def get_height(self) -> int:
+        return len(self.blocks) - 1
+
+    def call(self, wallet_name, method, params):
+        """Runs one RPC call
+
+        `wallet_name` is the wallet of the request's `/wallet/<name>`
+        endpoint, or None.  `params` is a list, or a dict of named
+        arguments.
+
+        """
+        args, kwargs = ((), params) if isinstance(params, dict) else (params or (), {})
+        with self.lock:
+            if hasattr(LocalWallet, "rpc_" + method):
+                return getattr(self.get_wallet(wallet_name), "rpc_" + method)(*args, **kwargs)
+            if method == "unloadwallet" and not args and "wallet_name" not in kwargs:
+                args = (wallet_name,)
+            if hasattr(self, "rpc_" + method):
+                return getattr(self, "rpc_" + method)(*args, **kwargs)
+        raise rpc_error(RPC_METHOD_NOT_FOUND, "Method not found")
+
+    def handle_request(self, wallet_name, request):
+        """Returns the JSON-RPC response to a request object
+
+        """
+        response = {"result": None, "error": None, "id": request.get("id") if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise rpc_error(RPC_INVALID_REQUEST, "Invalid Request object")
+            response["result"] = self.call(wallet_name, request["method"], request.get("params"))
+        except JSONRPCException as E:
+            response["error"] = E.error
+        except (TypeError, ValueError, KeyError, IndexError, InvalidOperation) as E:
+            response["error"] = {"code": RPC_MISC_ERROR, "message": str(E)}
+        return response
+
+    def get_wallet(self, wallet_name) -> LocalWallet:
+        if wallet_name is not None:
+            if wallet_name not in self.loaded_wallets:
+                raise rpc_error(RPC_WALLET_NOT_FOUND, "Requested wallet does not exist or is not loaded")
+            return self.loaded_wallets[wallet_name]
+        if len(self.loaded_wallets) == 1:
+            return next(iter(self.loaded_wallets.values()))
+        if not self.loaded_wallets:
+            raise rpc_error(RPC_WALLET_NOT_FOUND, "No wallet is loaded. Load a wallet using loadwallet or create a new one with createwallet.")
+        raise rpc_error(RPC_WALLET_NOT_SPECIFIED, "Wallet file not specified (must request wallet RPC through /wallet/<filename> uri-path).")
+
+    def get_address_scriptPubKey(self, address) -> bytes:
+        try:
+            return BT.get_address_scriptPubKey(address)
+        except (ValueError, IndexError):
+            raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Invalid Bitcoin address: {}".format(address))
+
+    def decode_raw_transaction(self, hexstring):
+        """Returns the `Transaction` and serialization of a hex transaction
+
+        """
+        try:
+            raw = bytes.fromhex(hexstring)
+            return parse_raw_transaction(raw), raw
+        except (ValueError, IndexError, struct.error):
+            raise rpc_error(RPC_DESERIALIZATION_ERROR, "TX decode failed")
+
+    def get_raw_block(self, height) -> bytes:
+        block = self.blocks[height]
+        return block.header + serialize_varint(len(block.txids)) + b"".join(self.transactions[txid] for txid in block.txids)
+
+    def __add_utxo__(self, outpoint, utxo):
+        self.utxos[outpoint] = utxo
+        self.script_outpoints.setdefault(utxo.scriptPubKey, set()).add(outpoint)
+
+    def __spend_utxo__(self, outpoint):
+        utxo = self.utxos.pop(outpoint)
+        outpoints = self.script_outpoints[utxo.scriptPubKey]
+        outpoints.discard(outpoint)
+        if not outpoints:
+            del self.script_outpoints[utxo.scriptPubKey]
+
+    def accept_to_mempool(self, tx, raw, maxfeerate=DEFAULT_MAX_FEE_RATE) -> str:
+        if tx.txid in self.mempool:
+            return tx.txid
+        if tx.txid in self.transaction_heights:
+            raise rpc_error(RPC_VERIFY_ALREADY_IN_CHAIN, "Transaction already in block chain")
+
+        outpoints = [(tx_input.txid, tx_input.vout) for tx_input in tx.vin]
+        if not outpoints:
+            raise rpc_error(RPC_VERIFY_REJECTED, "bad-txns-vin-empty")
+        if len(set(outpoints)) != len(outpoints):
+            raise rpc_error(RPC_VERIFY_REJECTED, "bad-txns-inputs-duplicate")
+
+        input_value = 0
+        for outpoint in outpoints:
+            utxo = self.utxos.get(outpoint)
+            if utxo is None:
+                raise rpc_error(RPC_VERIFY_ERROR, "bad-txns-inputs-missingorspent")
+            if outpoint in self.mempool_spends:
+                raise rpc_error(RPC_VERIFY_REJECTED, "txn-mempool-conflict")
+            if utxo.coinbase and self.get_height() + 1 - utxo.height < COINBASE_MATURITY:
+                raise rpc_error(RPC_VERIFY_REJECTED, "bad-txns-premature-spend-of-coinbase")
+            input_value = input_value + utxo.value
+
+        if self.require_standard:
+            num_nulldata = 0
+            for tx_output in tx.vout:
+                if get_script_type(tx_output.scriptPubKey) == "nulldata":
+                    num_nulldata = num_nulldata + 1
+                elif tx_output.value < BT.get_dust_limit(tx_output.scriptPubKey):
+                    raise rpc_error(RPC_VERIFY_REJECTED, "dust")
+            if num_nulldata > 1:
+                raise rpc_error(RPC_VERIFY_REJECTED, "multi-op-return")
+
+        fee = input_value - sum(tx_output.value for tx_output in tx.vout)
+        if fee < 0:
+            raise rpc_error(RPC_VERIFY_REJECTED, "bad-txns-in-belowout")
+        weight = 3 * len(serialize_transaction(tx, witness=False)) + len(raw)
+        vsize = (weight + 3) // 4
+        if fee < math.ceil(vsize * self.min_relay_fee_rate):
+            raise rpc_error(RPC_VERIFY_REJECTED, "min relay fee not met, {0} < {1}".format(fee, math.ceil(vsize * self.min_relay_fee_rate)))
+        if maxfeerate and fee > vsize * get_fee_rate(maxfeerate):
+            raise rpc_error(RPC_VERIFY_ERROR, "Fee exceeds maximum configured by user (e.g. -maxtxfee, maxfeerate)")
+
+        self.mempool[tx.txid] = MempoolEntry(tx, raw, fee, vsize, weight, int(time.time()))
+        self.transactions[tx.txid] = raw
+        for outpoint in outpoints:
+            self.mempool_spends[outpoint] = tx.txid
+        for n, tx_output in enumerate(tx.vout):
+            if get_script_type(tx_output.scriptPubKey) != "nulldata":
+                self.__add_utxo__((tx.txid, n), UTXO(tx_output.value, tx_output.scriptPubKey, None, False))
+        if self.zmq_publisher is not None:
+            self.zmq_publisher.transaction_added(raw, tx.txid)
+        return tx.txid
+
+    def mine_block(self, scriptPubKey) -> str:
+        """Mines the next block with the mempool transactions that fit,
+        oldest first, and returns its hash
+
+        """
+        height = len(self.blocks)
+        txids, fees, weight = [], 0, COINBASE_RESERVED_WEIGHT
+        for txid, entry in self.mempool.items():
+            if weight + entry.weight > MAX_BLOCK_WEIGHT:
+                # Later transactions may depend on this one, they wait for the next block too
+                break
+            txids.append(txid)
+            fees = fees + entry.fee
+            weight = weight + entry.weight
+
+        for txid in txids:
+            entry = self.mempool.pop(txid)
+            for tx_input in entry.tx.vin:
+                del self.mempool_spends[(tx_input.txid, tx_input.vout)]
+                self.__spend_utxo__((tx_input.txid, tx_input.vout))
+            for n in range(len(entry.tx.vout)):
+                if (txid, n) in self.utxos:
+                    self.utxos[(txid, n)] = self.utxos[(txid, n)]._replace(height=height)
+            self.transaction_heights[txid] = height
+
+        coinbase = Transaction(None,
+                               BT.TX_VERSION,
+                               [TransactionInput("00" * 32,
+                                                 0xffffffff,
+                                                 serialize_script_push(serialize_script_num(height)) + serialize_script_push(COINBASE_TAG),
+                                                 0xffffffff,
+                                                 [])],
+                               [TransactionOutput(BLOCK_SUBSIDY + fees, scriptPubKey)],
+                               0)
+        coinbase = coinbase._replace(txid=get_txid(coinbase))
+        self.transactions[coinbase.txid] = serialize_transaction(coinbase)
+        self.transaction_heights[coinbase.txid] = height
+        self.__add_utxo__((coinbase.txid, 0), UTXO(coinbase.vout[0].value, scriptPubKey, height, True))
+        txids.insert(0, coinbase.txid)
+
+        block_time = max(int(time.time()), self.blocks[-1].time + 1 if self.blocks else 0)
+        header = struct.pack("<i32s32sIII",
+                             BLOCK_VERSION,
+                             bytes.fromhex(self.blocks[-1].hash)[::-1] if self.blocks else bytes(32),
+                             get_merkle_root(txids),
+                             block_time,
+                             BLOCK_BITS,
+                             height)
+        block_hash = dsha256(header)[::-1].hex()
+        size = len(header) + len(serialize_varint(len(txids))) + sum(len(self.transactions[txid]) for txid in txids)
+        # The header and the coinbase have no witness data
+        weight = 4 * (size - sum(len(self.transactions[txid]) for txid in txids[1:])) + weight - COINBASE_RESERVED_WEIGHT
+        self.blocks.append(LocalBlock(block_hash, header, txids, block_time, size, weight))
+        self.block_heights[block_hash] = height
+        if self.zmq_publisher is not None:
+            self.zmq_publisher.block_connected(self.get_raw_block(height), [self.transactions[txid] for txid in txids], block_hash)
+        return block_hash
+
+    def run_miner(self, block_interval=BLOCK_INTERVAL):
+        """Mines a block every `block_interval` seconds until `stopping` is set
+
+        """
+        while not self.stopping.wait(block_interval):
+            with self.lock:
+                self.mine_block(self.mining_scriptPubKey)
+
+    def sign_raw_transaction(self, hexstring, prevtxs, get_key, get_redeemScript):
+        """Signs every input of a hex transaction, see `__get_signing_key__`
+
+        The spent outputs are looked up in `prevtxs` (as passed to
+        `signrawtransactionwithkey`), then in the UTXO set.  Unless every
+        input can be signed, the transaction is returned unchanged with
+        the errors.
+
+        """
+        tx, raw = self.decode_raw_transaction(hexstring)
+        prevtxs = {(prevtx["txid"], prevtx["vout"]): prevtx for prevtx in prevtxs or []}
+
+        keys, prevouts, errors = [], [], []
+        for tx_input in tx.vin:
+            outpoint = (tx_input.txid, tx_input.vout)
+            if outpoint in prevtxs:
+                scriptPubKey = bytes.fromhex(prevtxs[outpoint]["scriptPubKey"])
+                amount = BT.to_satoshis(prevtxs[outpoint]["amount"]) if "amount" in prevtxs[outpoint] else None
+                redeemScript = bytes.fromhex(prevtxs[outpoint]["redeemScript"]) if prevtxs[outpoint].get("redeemScript") else None
+            elif outpoint in self.utxos:
+                scriptPubKey, amount, redeemScript = self.utxos[outpoint].scriptPubKey, self.utxos[outpoint].value, None
+            else:
+                errors.append({"txid": tx_input.txid, "vout": tx_input.vout, "error": "Input not found or already spent"})
+                continue
+
+            key, redeemScript = __get_signing_key__(scriptPubKey,
+                                                    redeemScript if redeemScript is not None else get_redeemScript(scriptPubKey),
+                                                    get_key)
+            if key is None:
+                errors.append({"txid": tx_input.txid, "vout": tx_input.vout, "error": "Unable to sign input, missing key"})
+            elif amount is None and get_script_type(scriptPubKey) != "pubkeyhash" and redeemScript is None:
+                errors.append({"txid": tx_input.txid, "vout": tx_input.vout, "error": "Missing amount"})
+            keys.append(key)
+            prevouts.append((scriptPubKey, amount or 0, redeemScript))
+
+        if errors:
+            return {"hex": hexstring, "complete": False, "errors": errors}
+        return {"hex": serialize_transaction(BT.sign_transaction_inputs(tx, keys, prevouts)).hex(), "complete": True}
+
+    def __get_block_header__(self, height) -> dict:
+        block = self.blocks[height]
+        header = {"hash": block.hash,
+                  "confirmations": self.get_height() - height + 1,
+                  "height": height,
+                  "version": BLOCK_VERSION,
+                  "versionHex": format(BLOCK_VERSION, "08x"),
+                  "merkleroot": block.header[36:68][::-1].hex(),
+                  "time": block.time,
+                  "mediantime": sorted(b.time for b in self.blocks[max(0, height - 10):height + 1])[min(height, 10) // 2],
+                  "nonce": height,
+                  "bits": format(BLOCK_BITS, "08x"),
+                  "difficulty": BLOCK_DIFFICULTY,
+                  "chainwork": format(2 * (height + 1), "064x"),
+                  "nTx": len(block.txids)}
+        if height > 0:
+            header["previousblockhash"] = self.blocks[height - 1].hash
+        if height < self.get_height():
+            header["nextblockhash"] = self.blocks[height + 1].hash
+        return header
+
+    def __get_block_height__(self, blockhash) -> int:
+        if blockhash not in self.block_heights:
+            raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Block not found")
+        return self.block_heights[blockhash]
+
+    def rpc_help(self, command=None):
+        return "\n".join(sorted(name[len("rpc_"):] for name in dir(LocalBitcoind) + dir(LocalWallet) if name.startswith("rpc_")))
+
+    def rpc_stop(self):
+        self.stopping.set()
+        return "Bitcoin server stopping"
+
+    def rpc_uptime(self):
+        return int(time.time() - self.start_time)
+
+    def rpc_createwallet(self, wallet_name, disable_private_keys=False, blank=False, passphrase="", avoid_reuse=False,
+                         descriptors=False, load_on_startup=None, external_signer=False):
+        if wallet_name in self.wallets:
+            raise rpc_error(RPC_WALLET_ERROR,
+                            "Wallet file verification failed. Failed to create database path '{}'. Database already exists.".format(wallet_name))
+        self.wallets[wallet_name] = LocalWallet(self, wallet_name)
+        self.loaded_wallets[wallet_name] = self.wallets[wallet_name]
+        return {"name": wallet_name, "warning": ""}
+
+    def rpc_loadwallet(self, filename, load_on_startup=None):
+        if filename not in self.wallets:
+            raise rpc_error(RPC_WALLET_NOT_FOUND,
+                            "Wallet file verification failed. Failed to load database path '{}'. Path does not exist.".format(filename))
+        if filename in self.loaded_wallets:
+            raise rpc_error(RPC_WALLET_ALREADY_LOADED, "Wallet file verification failed. Wallet \"{}\" is already loaded.".format(filename))
+        self.loaded_wallets[filename] = self.wallets[filename]
+        return {"name": filename, "warning": ""}
+
+    def rpc_unloadwallet(self, wallet_name=None, load_on_startup=None):
+        if wallet_name is None:
+            raise rpc_error(RPC_INVALID_PARAMETER, "Either the RPC endpoint wallet or the wallet name parameter must be provided")
+        if wallet_name not in self.loaded_wallets:
+            raise rpc_error(RPC_WALLET_NOT_FOUND, "Requested wallet does not exist or is not loaded")
+        del self.loaded_wallets[wallet_name]
+        return {"warning": ""}
+
+    def rpc_listwallets(self):
+        return list(self.loaded_wallets)
+
+    def rpc_listwalletdir(self):
+        return {"wallets": [{"name": wallet_name} for wallet_name in self.wallets]}
+
+    def rpc_getblockcount(self):
+        return self.get_height()
+
+    def rpc_getbestblockhash(self):
+        return self.blocks[-1].hash
+
+    def rpc_getblockhash(self, height):
+        if not 0 <= height <= self.get_height():
+            raise rpc_error(RPC_INVALID_PARAMETER, "Block height out of range")
+        return self.blocks[height].hash
+
+    def rpc_getblockheader(self, blockhash, verbose=True):
+        height = self.__get_block_height__(blockhash)
+        return self.__get_block_header__(height) if verbose else self.blocks[height].header.hex()
+
+    def rpc_getblock(self, blockhash, verbosity=1):
+        height = self.__get_block_height__(blockhash)
+        verbosity = int(verbosity)
+        if verbosity == 0:
+            return self.get_raw_block(height).hex()
+
+        block = self.blocks[height]
+        decoded = self.__get_block_header__(height)
+        decoded.update(size=block.size, strippedsize=(block.weight - block.size) // 3, weight=block.weight)
+        if verbosity == 1:
+            decoded["tx"] = list(block.txids)
+        else:
+            decoded["tx"] = []
+            for txid in block.txids:
+                raw = self.transactions[txid]
+                decoded_tx = decode_transaction(parse_raw_transaction(raw), raw)
+                decoded_tx["hex"] = raw.hex()
+                decoded["tx"].append(decoded_tx)
+        return decoded
+
+    def rpc_getblockchaininfo(self):
+        tip = self.__get_block_header__(self.get_height())
+        return {"chain": "test",
+                "blocks": tip["height"],
+                "headers": tip["height"],
+                "bestblockhash": tip["hash"],
+                "difficulty": BLOCK_DIFFICULTY,
+                "time": tip["time"],
+                "mediantime": tip["mediantime"],
+                "verificationprogress": 1,
+                "initialblockdownload": False,
+                "chainwork": tip["chainwork"],
+                "size_on_disk": 0,
+                "pruned": False,
+                "warnings": ""}
+
+    def rpc_getrawmempool(self, verbose=False, mempool_sequence=False):
+        if not verbose:
+            return list(self.mempool)
+        return {txid: self.rpc_getmempoolentry(txid) for txid in self.mempool}
+
+    def rpc_getmempoolentry(self, txid):
+        if txid not in self.mempool:
+            raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Transaction not in mempool")
+        entry = self.mempool[txid]
+        return {"vsize": entry.vsize,
+                "weight": entry.weight,
+                "time": entry.time,
+                "height": self.get_height(),
+                "fees": {"base": to_btc(entry.fee)},
+                "depends": sorted(set(tx_input.txid for tx_input in entry.tx.vin if tx_input.txid in self.mempool)),
+                "bip125-replaceable": any(tx_input.sequence < 0xfffffffe for tx_input in entry.tx.vin)}
+
+    def rpc_getmempoolinfo(self):
+        return {"loaded": True,
+                "size": len(self.mempool),
+                "bytes": sum(entry.vsize for entry in self.mempool.values()),
+                "total_fee": to_btc(sum(entry.fee for entry in self.mempool.values())),
+                "mempoolminfee": to_btc(self.min_relay_fee_rate * 1000),
+                "minrelaytxfee": to_btc(self.min_relay_fee_rate * 1000)}
+
+    def rpc_estimatesmartfee(self, conf_target, estimate_mode="conservative"):
+        return {"feerate": to_btc(DEFAULT_FEE_RATE * 1000), "blocks": conf_target}
+
+    def rpc_getrawtransaction(self, txid, verbose=False, blockhash=None):
+        if txid not in self.transactions:
+            raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY,
+                            "No such mempool or blockchain transaction. Use gettransaction for wallet transactions.")
+        raw = self.transactions[txid]
+        if not verbose:
+            return raw.hex()
+
+        decoded = decode_transaction(parse_raw_transaction(raw), raw)
+        decoded["hex"] = raw.hex()
+        if txid in self.transaction_heights:
+            block = self.blocks[self.transaction_heights[txid]]
+            decoded.update(blockhash=block.hash,
+                           confirmations=self.get_height() - self.transaction_heights[txid] + 1,
+                           time=block.time,
+                           blocktime=block.time)
+        return decoded
+
+    def rpc_decoderawtransaction(self, hexstring, iswitness=None):
+        return decode_transaction(*self.decode_raw_transaction(hexstring))
+
+    def rpc_createrawtransaction(self, inputs, outputs, locktime=0, replaceable=True):
+        vin = [TransactionInput(tx_input["txid"],
+                                tx_input["vout"],
+                                b"",
+                                tx_input.get("sequence", BT.SEQUENCE_RBF if replaceable else 0xffffffff),
+                                []) for tx_input in inputs]
+
+        vout, addresses = [], set()
+        for output in (outputs if isinstance(outputs, list) else [{key: value} for key, value in outputs.items()]):
+            for key, value in output.items():
+                if key == "data":
+                    vout.append(TransactionOutput(0, BT.get_nulldata_scriptPubKey(bytes.fromhex(value))))
+                    continue
+                if key in addresses:
+                    raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, duplicated address: {}".format(key))
+                addresses.add(key)
+                vout.append(TransactionOutput(BT.to_satoshis(value), self.get_address_scriptPubKey(key)))
+
+        return serialize_transaction(Transaction(None, BT.TX_VERSION, vin, vout, locktime)).hex()
+
+    def rpc_signrawtransactionwithkey(self, hexstring, privkeys, prevtxs=None, sighashtype="ALL"):
+        keys = {}
+        for wif in privkeys:
+            try:
+                private_key, pubkey = BT.get_private_key(wif)
+            except (ValueError, IndexError):
+                raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Invalid private key")
+            keys[BT.hash160(pubkey)] = (private_key, pubkey)
+        return self.sign_raw_transaction(hexstring, prevtxs, keys.get, lambda scriptPubKey: None)
+
+    def rpc_sendrawtransaction(self, hexstring, maxfeerate=DEFAULT_MAX_FEE_RATE, maxburnamount=0):
+        return self.accept_to_mempool(*self.decode_raw_transaction(hexstring), maxfeerate)
+
+    def rpc_submitpackage(self, package, maxfeerate=DEFAULT_MAX_FEE_RATE, maxburnamount=0):
+        tx_results, failed = {}, False
+        for hexstring in package:
+            tx, raw = self.decode_raw_transaction(hexstring)
+            wtxid = dsha256(raw)[::-1].hex()
+            try:
+                self.accept_to_mempool(tx, raw, maxfeerate)
+                tx_results[wtxid] = {"txid": tx.txid,
+                                     "vsize": self.mempool[tx.txid].vsize,
+                                     "fees": {"base": to_btc(self.mempool[tx.txid].fee)}}
+            except JSONRPCException as E:
+                failed = True
+                tx_results[wtxid] = {"txid": tx.txid, "error": E.message}
+        return {"package_msg": "transaction failed" if failed else "success",
+                "tx-results": tx_results,
+                "replaced-transactions": []}
+
+    def rpc_gettxout(self, txid, n, include_mempool=True):
+        utxo = self.utxos.get((txid, n))
+        if utxo is None or (utxo.height is None and not include_mempool) or (include_mempool and (txid, n) in self.mempool_spends):
+            return None
+        return {"bestblock": self.blocks[-1].hash,
+                "confirmations": 0 if utxo.height is None else self.get_height() - utxo.height + 1,
+                "value": to_btc(utxo.value),
+                "scriptPubKey": decode_scriptPubKey(utxo.scriptPubKey),
+                "coinbase": utxo.coinbase}
+
+    def rpc_generatetoaddress(self, nblocks, address, maxtries=1000000):
+        scriptPubKey = self.get_address_scriptPubKey(address)
+        return [self.mine_block(scriptPubKey) for _ in range(nblocks)]
+
+    def initialize_test_wallets(self, num_funding_blocks=COINBASE_MATURITY + 1):
+        """Creates the `testnetfaucet`, `miner` and `ca0` wallets of
+        `blockvoke_bitcoin_rpc.__initialize_all__`, and mines
+        `num_funding_blocks` blocks to the faucet so that its first
+        coinbases are spendable
+
+        The blocks mined afterwards pay to the miner.
+
+        """
+        with self.lock:
+            for wallet_name in ("testnetfaucet", "miner", "ca0"):
+                if wallet_name not in self.wallets:
+                    self.rpc_createwallet(wallet_name)
+            faucet_address = self.wallets["testnetfaucet"].rpc_getnewaddress("testnetfaucet")
+            miner_address = self.wallets["miner"].rpc_getnewaddress("mineraddress")
+            self.rpc_generatetoaddress(num_funding_blocks, faucet_address)
+            self.mining_scriptPubKey = self.get_address_scriptPubKey(miner_address)
+
+class LocalBitcoindRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, Nagle would hold the body back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Authorization") != self.server.authorization:
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", "Basic realm=\"jsonrpc\"")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        path = urllib.parse.unquote(self.path)
+        wallet_name = path[len("/wallet/"):] if path.startswith("/wallet/") else None
+
+        try:
+            request = json.loads(body, parse_float=Decimal)
+        except ValueError:
+            self.__respond__(500, {"result": None, "error": {"code": RPC_PARSE_ERROR, "message": "Parse error"}, "id": None})
+            return
+
+        if isinstance(request, list):
+            self.__respond__(200, [self.server.node.handle_request(wallet_name, batch_request) for batch_request in request])
+            return
+
+        response = self.server.node.handle_request(wallet_name, request)
+        if response["error"] is None:
+            self.__respond__(200, response)
+        else:
+            self.__respond__(404 if response["error"]["code"] == RPC_METHOD_NOT_FOUND else 500, response)
+
+    def __respond__(self, status, response):
+        body = json.dumps(response, default=EncodeDecimal).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class LocalBitcoindHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, node, rpcuser, rpcpassword):
+        super().__init__(server_address, LocalBitcoindRequestHandler)
+        self.node = node
+        self.authorization = "Basic " + base64.b64encode("{0}:{1}".format(rpcuser, rpcpassword).encode()).decode()
+
+def serve(node, host, port, rpcuser, rpcpassword, block_interval=BLOCK_INTERVAL):
+    """Serves `node` over JSON-RPC and mines its blocks until the `stop`
+    RPC or an interrupt
+
+    """
+    server = LocalBitcoindHTTPServer((host, port), node, rpcuser, rpcpassword)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if block_interval:
+        threading.Thread(target=node.run_miner, args=(block_interval,), daemon=True).start()
+
+    try:
+        node.stopping.wait()
+    finally:
+        node.stopping.set()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,80 @@
+"""Stand-in for bitcoind's ZMQ notification publisher
+
+Publishes the `rawtx`, `rawblock` and `sequence` topics framed as
+bitcoind does, `[topic, body, sequence number]` with a 4 byte little
+endian sequence number per topic, and in the order bitcoind publishes
+them: a transaction entering the mempool is a `rawtx` followed by a
+`sequence` "A", and a connected block is a `rawtx` for each of its
+transactions, a `sequence` "C" and the `rawblock`.
+
+"""
+
+import struct
+import threading
+
+from blockvoke_zmq import ZMQ_TOPICS
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+class ZMQPublisher(object):
+    """Publishes bitcoind notifications on `zmq_endpoint`
+
+    `zmq_endpoint` may use a wildcard port (`tcp://127.0.0.1:*`); the
+    bound endpoint is `self.endpoint`.
+
+    """
+    def __init__(self, zmq_endpoint):
+        if zmq is None:
+            raise ImportError("pyzmq is required to publish ZMQ notifications")
+
+        self.socket = zmq.Context.instance().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0)
+        self.socket.bind(zmq_endpoint)
+        self.endpoint = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.sequence_numbers = {topic: 0 for topic in ZMQ_TOPICS}
+        self.__mempool_sequence__ = 0
+        self.__lock__ = threading.Lock()
+
+    def publish(self, topic, body):
+        with self.__lock__:
+            sequence = self.sequence_numbers[topic]
+            self.sequence_numbers[topic] = (sequence + 1) & 0xffffffff
+            self.socket.send_multipart([topic.encode(), body, struct.pack("<I", sequence)])
+
+    def skip(self, topic, count=1):
+        """Numbers the next message of `topic` as if `count` were dropped
+        before it, as when a subscriber's queue overflows
+
+        """
+        with self.__lock__:
+            self.sequence_numbers[topic] = (self.sequence_numbers[topic] + count) & 0xffffffff
+
+    def __publish_sequence__(self, hash_hex, label, mempool_sequence=None):
+        body = bytes.fromhex(hash_hex) + label
+        if mempool_sequence is not None:
+            body = body + struct.pack("<Q", mempool_sequence)
+        self.publish("sequence", body)
+
+    def transaction_added(self, raw_tx, txid):
+        self.publish("rawtx", raw_tx)
+        self.__mempool_sequence__ = self.__mempool_sequence__ + 1
+        self.__publish_sequence__(txid, b"A", self.__mempool_sequence__)
+
+    def transaction_removed(self, txid):
+        self.__mempool_sequence__ = self.__mempool_sequence__ + 1
+        self.__publish_sequence__(txid, b"R", self.__mempool_sequence__)
+
+    def block_connected(self, raw_block, raw_txs, blockhash):
+        for raw_tx in raw_txs:
+            self.publish("rawtx", raw_tx)
+        self.__publish_sequence__(blockhash, b"C")
+        self.publish("rawblock", raw_block)
+
+    def block_disconnected(self, blockhash):
+        self.__publish_sequence__(blockhash, b"D")
+
+    def close(self):
+        self.socket.close(linger=0)
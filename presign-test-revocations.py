@@ -0,0 +1,62 @@
+# This file signs the revocation transactions of the funded test certificates ahead of time
+
+import presigned_revocations as PR
+import co_keystore as CK
+import revocation_logger as RL
+import rpc_metrics as RM
+import sys, argparse
+import traceback
+import tqdm
+
+TEST_LOGGER_CSV_FILE = "./working_dir/test_logs/TEST_{}.csv"
+TEST_LOGGER_JOURNAL_FILE = "./working_dir/test_logs/TEST_{}.journal"
+
+def main(testid, store_file_path, revocation_codes, revalidate=False, rpcconnect=None, keystore_file_path=None):
+    rev_logger = RL.RevocationLogger()
+    rev_logger.read(TEST_LOGGER_CSV_FILE.format(testid), TEST_LOGGER_JOURNAL_FILE.format(testid))
+
+    store = PR.PresignedRevocationStore(store_file_path)
+    co_keystore = CK.COKeystore(keystore_file_path) if keystore_file_path is not None else None
+
+    try:
+        if revalidate:
+            for DNS, revocation_code in store.revalidate(rpcconnect):
+                print("Dropped presigned revocation of `{0}` with code `{1}`, its coins were spent".format(DNS, revocation_code))
+
+        num_signed = 0
+        for DNS, cert_log in tqdm.tqdm(rev_logger.certificates.items(), desc="Signing revocations"):
+            if cert_log.tx_pair_sent_timestamp is not None or not cert_log.co_funded:
+                continue
+
+            missing_codes = [revocation_code for revocation_code in revocation_codes
+                             if store.get(DNS, revocation_code) is None]
+            if not missing_codes:
+                continue
+
+            try:
+                PR.presign_revocations(store, DNS, missing_codes, co_keystore=co_keystore)
+                num_signed = num_signed + len(missing_codes)
+            except Exception as E:
+                print("Unable to presign revocations of `{}`:".format(DNS))
+                traceback.print_exception(type(E), E, E.__traceback__)
+
+        print("Signed `{0}` revocation transaction pairs into `{1}`".format(num_signed, store_file_path))
+    finally:
+        store.close()
+        if co_keystore is not None:
+            co_keystore.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sign the revocation transactions of funded test certificates ahead of time")
+    parser.add_argument("-i", "--testid", type=str, help="Test identifier", required=True)
+    parser.add_argument("-d", "--store", type=str, help="Presigned revocation store file", default=PR.PRESIGNED_REVOCATIONS_FILE)
+    parser.add_argument("-c", "--code", type=int, action="append", help="Revocation code to sign for (can be repeated, 0 by default)")
+    parser.add_argument("-v", "--revalidate", action="store_true", help="Drop the presigned revocations whose coins were spent before signing the missing ones")
+    parser.add_argument("-r", "--rpcconnect", type=str, help="Alternate rpcconnect ip address for checking the coins of presigned revocations")
+    parser.add_argument("-k", "--keystore", type=str, nargs="?", const=CK.CO_KEYSTORE_FILE, help="Sign with the CO keys of this keystore (default: %(const)s), for certificates generated with `generate-test-certificates.py -k`")
+    parser.add_argument("-m", "--rpc-metrics", type=str, help="Also write the per-method RPC metrics to this file, as JSON if it ends in .json and as Prometheus text otherwise")
+    args = parser.parse_args()
+    try:
+        main(args.testid, args.store, args.code or [0], args.revalidate, args.rpcconnect, args.keystore)
+    finally:
+        RM.report(args.rpc_metrics)
@@ -0,0 +1,255 @@
+"""Store of revocation transactions signed ahead of time
+
+Once the CO address of a certificate is funded, the TX:Fund/TX:Revoke
+pair of every revocation code can be built and signed in advance.  The
+pairs are kept in an SQLite database keyed by DNS name and revocation
+code, and indexed by fingerprint-16, so revoking a certificate is a
+lookup and one JSON-RPC request broadcasting both transactions, without
+loading the CO wallet.
+
+All pairs of a certificate spend the same coins of the CO address, so
+only one of them can be sent.  When those coins are spent by anything
+else the pairs become invalid; `revalidate` finds and drops them.
+
+"""
+
+import sqlite3
+from collections import namedtuple
+
+import revoke_certificate as RC
+import blockvoke_parser as BP
+from blockvoke_bitcoin_rpc import get_bitcoind_connection, wallet_session, JSONRPCException
+from blockvoke_async import get_async_bitcoind_connection
+from bitcoin_serialization import parse_transaction
+from revocation_logger import unixtimestampnow
+
+PRESIGNED_REVOCATIONS_FILE = "./working_dir/presigned_revocations.sqlite"
+
+PRESIGNED_REVOCATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS presigned_revocations (
+    dns_name TEXT NOT NULL,
+    revocation_code INTEGER NOT NULL,
+    fingerprint_16 TEXT NOT NULL,
+    txfund_txid TEXT NOT NULL,
+    txfund_hex TEXT NOT NULL,
+    txrevoke_txid TEXT NOT NULL,
+    txrevoke_hex TEXT NOT NULL,
+    signed_timestamp INTEGER NOT NULL,
+    PRIMARY KEY (dns_name, revocation_code)
+);
+CREATE INDEX IF NOT EXISTS presigned_revocations_fingerprint_16 ON presigned_revocations (fingerprint_16, revocation_code);
+"""
+
+# bitcoind's `sendrawtransaction` errors
+RPC_VERIFY_REJECTED = -26
+# The transaction is already mined
+RPC_VERIFY_ALREADY_IN_CHAIN = -27
+# Rejection reasons of a transaction that is already in the mempool
+ALREADY_IN_MEMPOOL_REASONS = ("txn-already-in-mempool", "txn-already-known")
+
+PresignedRevocation = namedtuple("PresignedRevocation", ["dns_name",
+                                                         "revocation_code",
+                                                         "fingerprint_16",
+                                                         "txfund_txid",
+                                                         "txfund_hex",
+                                                         "txrevoke_txid",
+                                                         "txrevoke_hex",
+                                                         "signed_timestamp"])
+
+class TxFundRejected(JSONRPCException):
+    """bitcoind rejected the TX:Fund of a presigned pair, so its coins are
+    gone and the pair has to be signed again
+
+    """
+
+class TxRevokeRejected(JSONRPCException):
+    """bitcoind accepted the TX:Fund of a presigned pair but rejected its
+    TX:Revoke, so the pair must not be signed again
+
+    """
+
+class PresignedRevocationStore(object):
+    def __init__(self, store_file_path=PRESIGNED_REVOCATIONS_FILE):
+        self.db = sqlite3.connect(store_file_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(PRESIGNED_REVOCATIONS_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, DNS, revocationCode, txfund_transaction, txrevoke_transaction):
+        """Stores a signed pair as returned by `create_local_revocation_transactions`
+
+        """
+        fingerprint_16 = BP.get_cert_fingerprint_16(BP.get_raw_OP_RETURN(parse_transaction(bytes.fromhex(txrevoke_transaction["hex"]))[0])[0])
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO presigned_revocations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (DNS,
+                             revocationCode,
+                             fingerprint_16,
+                             txfund_transaction["txid"],
+                             txfund_transaction["hex"],
+                             txrevoke_transaction["txid"],
+                             txrevoke_transaction["hex"],
+                             unixtimestampnow()))
+
+    def get(self, DNS, revocationCode):
+        row = self.db.execute("SELECT * FROM presigned_revocations WHERE dns_name = ? AND revocation_code = ?",
+                              (DNS, revocationCode)).fetchone()
+        return PresignedRevocation(*row) if row else None
+
+    def get_by_fingerprint(self, cert_fingerprint_16, revocationCode):
+        row = self.db.execute("SELECT * FROM presigned_revocations WHERE fingerprint_16 = ? AND revocation_code = ?",
+                              (cert_fingerprint_16[:32], revocationCode)).fetchone()
+        return PresignedRevocation(*row) if row else None
+
+    def get_all(self):
+        return [PresignedRevocation(*row) for row in self.db.execute("SELECT * FROM presigned_revocations")]
+
+    def remove(self, DNS, revocationCode=None):
+        """Drops the pair of one revocation code, or all pairs of `DNS`
+
+        """
+        with self.db:
+            if revocationCode is None:
+                self.db.execute("DELETE FROM presigned_revocations WHERE dns_name = ?", (DNS,))
+            else:
+                self.db.execute("DELETE FROM presigned_revocations WHERE dns_name = ? AND revocation_code = ?",
+                                (DNS, revocationCode))
+
+    def revalidate(self, rpcconnect=None, batch_size=1000):
+        """Drops the pairs whose TX:Fund spends coins that are no longer
+        unspent (in the UTXO set or the mempool)
+
+        Returns the (DNS name, revocation code) of the dropped pairs.
+
+        """
+        btd = get_bitcoind_connection(rpcconnect=rpcconnect)
+
+        outpoints = {}
+        for presigned_revocation in self.get_all():
+            txfund_transaction = parse_transaction(bytes.fromhex(presigned_revocation.txfund_hex))[0]
+            for tx_input in txfund_transaction.vin:
+                outpoints.setdefault((tx_input.txid, tx_input.vout), []).append(presigned_revocation)
+
+        outpoints = list(outpoints.items())
+        stale = set()
+        for i in range(0, len(outpoints), batch_size):
+            batch = outpoints[i:i + batch_size]
+            txouts = btd.batch_([["gettxout", txid, vout, True] for (txid, vout), presigned_revocations in batch])
+            for ((txid, vout), presigned_revocations), txout in zip(batch, txouts):
+                if txout is None:
+                    stale.update((presigned_revocation.dns_name, presigned_revocation.revocation_code)
+                                 for presigned_revocation in presigned_revocations)
+
+        for DNS, revocationCode in stale:
+            self.remove(DNS, revocationCode)
+
+        return sorted(stale)
+
+def presign_revocations(store,
+                        DNS,
+                        revocationCodes=(0,),
+                        working_dir="./working_dir",
+                        bitcoin_wallet=None,
+                        co_keystore=None):
+    """Signs and stores the revocation transactions of `DNS` for every
+    code in `revocationCodes`
+
+    The CO wallet is used once for all codes.
+
+    """
+    BlockVokeCertificate, cert_multisig_address, ca_address_pubkey_hex = RC.load_blockvoke_certificate(DNS, working_dir)
+
+    if co_keystore is not None:
+        bitcoin_wallet = co_keystore.bitcoin_wallet
+    elif bitcoin_wallet==None:
+        bitcoin_wallet=DNS
+
+    with wallet_session(bitcoin_wallet) as btd:
+        coaddress = (co_keystore.get_address(DNS) if co_keystore is not None
+                     else list(btd.getaddressesbylabel("{}-coaddress".format(DNS)).keys())[0])
+
+        coaddress_info, coaddress_privkey, utxos = btd.batch_([["getaddressinfo", coaddress],
+                                                               ["dumpprivkey", coaddress],
+                                                               ["listunspent", 0, 9999999, [coaddress]]])
+
+    for revocationCode in revocationCodes:
+        txfund_transaction, txrevoke_transaction = RC.create_local_revocation_transactions(
+            cert_multisig_address.decode(),
+            ca_address_pubkey_hex,
+            coaddress_info,
+            coaddress_privkey,
+            utxos,
+            RC.create_OP_RETURN_script(BlockVokeCertificate, revocationCode))
+        store.add(DNS, revocationCode, txfund_transaction, txrevoke_transaction)
+
+def __get_send_rpc_calls__(presigned_revocation, submit_package):
+    if submit_package:
+        return [["submitpackage", [presigned_revocation.txfund_hex, presigned_revocation.txrevoke_hex]]]
+    # bitcoind runs the calls of a batch in order, so TX:Fund is in the mempool before TX:Revoke
+    return [["sendrawtransaction", presigned_revocation.txfund_hex],
+            ["sendrawtransaction", presigned_revocation.txrevoke_hex]]
+
+def __is_already_sent__(result):
+    return (isinstance(result, JSONRPCException)
+            and (result.code == RPC_VERIFY_ALREADY_IN_CHAIN
+                 or any(reason in (result.message or "") for reason in ALREADY_IN_MEMPOOL_REASONS)))
+
+def __check_send_results__(presigned_revocation, submit_package, results):
+    """Raises the rejection of either transaction of the pair, as
+    `TxFundRejected` or `TxRevokeRejected`
+
+    A transaction bitcoind already has, in the mempool or in a block,
+    was sent.  A rejected TX:Fund makes the TX:Revoke fail too, so only
+    the TX:Fund's error is raised then.
+
+    """
+    if submit_package:
+        if isinstance(results[0], JSONRPCException):
+            raise results[0]
+        errors = {tx_result["txid"]: JSONRPCException({"code": RPC_VERIFY_REJECTED, "message": tx_result["error"]})
+                  for tx_result in results[0]["tx-results"].values() if tx_result.get("error")}
+        results = [errors.get(presigned_revocation.txfund_txid), errors.get(presigned_revocation.txrevoke_txid)]
+
+    txfund_result, txrevoke_result = results
+    if isinstance(txfund_result, JSONRPCException) and not __is_already_sent__(txfund_result):
+        raise TxFundRejected(txfund_result.error)
+    if isinstance(txrevoke_result, JSONRPCException) and not __is_already_sent__(txrevoke_result):
+        raise TxRevokeRejected(txrevoke_result.error)
+
+def send_presigned_revocation(store, DNS, revocationCode, rpcconnect=None, submit_package=False):
+    """Broadcasts the presigned pair of `DNS` in one JSON-RPC request,
+    as two `sendrawtransaction` calls or one `submitpackage`
+
+    Returns the txids, or None if no pair was signed for `revocationCode`.
+    Raises `TxFundRejected` if the pair has to be signed again, and
+    `TxRevokeRejected` if only its TX:Fund was broadcast.
+
+    """
+    presigned_revocation = store.get(DNS, revocationCode)
+    if presigned_revocation is None:
+        return None
+
+    __check_send_results__(presigned_revocation,
+                           submit_package,
+                           get_bitcoind_connection(rpcconnect=rpcconnect).batch_(__get_send_rpc_calls__(presigned_revocation, submit_package),
+                                                                                 return_exceptions=True))
+
+    return presigned_revocation.txfund_txid, presigned_revocation.txrevoke_txid
+
+async def async_send_presigned_revocation(store, DNS, revocationCode, rpcconnect=None, submit_package=False):
+    """Coroutine version of `send_presigned_revocation`
+
+    """
+    presigned_revocation = store.get(DNS, revocationCode)
+    if presigned_revocation is None:
+        return None
+
+    __check_send_results__(presigned_revocation,
+                           submit_package,
+                           await get_async_bitcoind_connection(rpcconnect=rpcconnect).batch_(__get_send_rpc_calls__(presigned_revocation, submit_package),
+                                                                                             return_exceptions=True))
+
+    return presigned_revocation.txfund_txid, presigned_revocation.txrevoke_txid
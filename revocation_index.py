@@ -0,0 +1,157 @@
+"""Persistent index of the BlockVoke revocations on the blockchain
+
+Maps the fingerprint-16 of every revoked certificate to the revocation
+transaction, the block it was mined in and the revocation code.  The
+index is an SQLite database that is synced block by block from the last
+indexed height, every block in its own database transaction, so an
+interrupted sync resumes from the last complete block.  The indexed
+block hashes are the checkpoints of the `BlockScanner`, so revocations
+from blocks orphaned by a reorg are removed on the next sync.
+
+"""
+
+import sqlite3
+from collections import namedtuple
+
+import blockvoke_parser as BP
+import blockvoke_codec as BC
+from block_scanner import BlockScanner
+
+REVOCATION_INDEX_FILE = "./working_dir/revocation_index.sqlite"
+
+REVOCATION_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revocations (
+    fingerprint_16 TEXT PRIMARY KEY,
+    txid TEXT NOT NULL,
+    block_height INTEGER NOT NULL,
+    block_hash TEXT NOT NULL,
+    revocation_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS revocations_block_height ON revocations (block_height);
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+"""
+
+Revocation = namedtuple("Revocation", ["fingerprint_16", "txid", "block_height", "block_hash", "revocation_code"])
+
+class RevocationIndex(object):
+    def __init__(self, index_file_path=REVOCATION_INDEX_FILE):
+        self.db = sqlite3.connect(index_file_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(REVOCATION_INDEX_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get_revocation(self, cert_fingerprint_16):
+        """Returns the `Revocation` of a certificate, or None if it is not
+        revoked in the indexed blocks
+
+        """
+        row = self.db.execute("SELECT fingerprint_16, txid, block_height, block_hash, revocation_code FROM revocations WHERE fingerprint_16 = ?",
+                              (cert_fingerprint_16[:32],)).fetchone()
+        return Revocation(*row) if row else None
+
+    def is_revoked(self, cert_fingerprint_16) -> bool:
+        return self.get_revocation(cert_fingerprint_16) is not None
+
+    def get_indexed_height(self):
+        """Returns the height of the last indexed block, or None if the
+        index is empty
+
+        """
+        return self.db.execute("SELECT MAX(height) FROM blocks").fetchone()[0]
+
+    def get_block_hash(self, height):
+        row = self.db.execute("SELECT hash FROM blocks WHERE height = ?", (height,)).fetchone()
+        return row[0] if row else None
+
+    def get_checkpoints(self, num_checkpoints):
+        return dict(self.db.execute("SELECT height, hash FROM blocks ORDER BY height DESC LIMIT ?", (num_checkpoints,)).fetchall())
+
+    def rollback(self, fork_height):
+        """Removes everything indexed from the blocks above `fork_height`
+
+        """
+        with self.db:
+            self.db.execute("DELETE FROM revocations WHERE block_height > ?", (fork_height,))
+            self.db.execute("DELETE FROM blocks WHERE height > ?", (fork_height,))
+
+    def add_block(self, height, raw_block):
+        """Indexes the revocations in a serialized block
+
+        Only the first revocation of a certificate is kept.  Returns the
+        number of revocations added.
+
+        """
+        raw_block = bytes.fromhex(raw_block) if isinstance(raw_block, str) else raw_block
+        blockhash = BP.parse_block_header(raw_block).hash
+
+        blockvoke_txs = BP.get_raw_block_OP_RETURNs(raw_block)
+        revocations = []
+        if blockvoke_txs:
+            # Malformed payloads are not revocations
+            payloads, valid = BC.decode_payloads([OP_RETURNs[0] for txid, OP_RETURNs in blockvoke_txs])
+            for (txid, OP_RETURNs), cert_fingerprint_16, revocation_code, is_valid in zip(blockvoke_txs,
+                                                                                        BC.get_fingerprint_16_hex(payloads["fingerprint_16"]),
+                                                                                        payloads["revocation_code"],
+                                                                                        valid):
+                if is_valid:
+                    revocations.append((cert_fingerprint_16.decode(), txid, height, blockhash, int(revocation_code)))
+
+        with self.db:
+            num_revocations = self.db.executemany("INSERT OR IGNORE INTO revocations VALUES (?, ?, ?, ?, ?)", revocations).rowcount
+            self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (height, blockhash))
+
+        return num_revocations
+
+    def sync(self, start_height=0, stop_height=None, rpcconnect=None, max_reorg_depth=1000, workers=1):
+        """Indexes the blocks after the last indexed height up to
+        `stop_height` (the chain tip by default)
+
+        `start_height` is only used for an empty index.  With `workers` > 1
+        the blocks deeper than `max_reorg_depth` below the tip are fetched
+        concurrently before the remaining blocks are scanned one by one.
+        Returns the number of revocations added.
+
+        """
+        num_revocations = [0]
+
+        def on_block(height, raw_block, header):
+            num_revocations[0] = num_revocations[0] + self.add_block(height, raw_block)
+
+        def get_block_scanner():
+            return BlockScanner(start_height,
+                                on_block,
+                                self.rollback,
+                                rpcconnect,
+                                checkpoints=self.get_checkpoints(max_reorg_depth),
+                                max_checkpoints=max_reorg_depth)
+
+        block_scanner = get_block_scanner()
+        if workers > 1:
+            # The indexed tip may have been orphaned while the index was not
+            # synced, which must be rolled back before backfilling on top of it
+            tip = block_scanner.check_reorg()
+            indexed_height = self.get_indexed_height()
+            backfill_height = tip - max_reorg_depth
+            if stop_height is not None:
+                backfill_height = min(backfill_height, stop_height)
+            backfill_range = range(start_height if indexed_height is None else indexed_height + 1, backfill_height + 1)
+            previousblockhash = self.get_block_hash(backfill_range.start - 1)
+            for height, raw_block in BP.iter_blockrange(BP.get_raw_block, backfill_range, rpcconnect, workers):
+                raw_block = bytes.fromhex(raw_block) if isinstance(raw_block, str) else raw_block
+                header = BP.parse_block_header(raw_block)
+                if previousblockhash is not None and header.previousblockhash != previousblockhash:
+                    # Reorganised while backfilling, the scanner below rolls it back
+                    break
+                num_revocations[0] = num_revocations[0] + self.add_block(height, raw_block)
+                previousblockhash = header.hash
+            block_scanner = get_block_scanner()
+
+        block_scanner.scan(stop_height)
+
+        return num_revocations[0]
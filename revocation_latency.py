@@ -0,0 +1,146 @@
+"""Latency distributions of the revocation stages of a test log
+
+The stages are measured between the transitions `RevocationLogger`
+timestamps: the revocation pair being sent, the revocation being first
+witnessed (in the mempool or a block) and its block being witnessed.
+Latencies are taken from the monotonic clock, falling back to the
+nanosecond wall clock and then to the one-second timestamps for
+certificates logged without them.  The percentiles of every stage are
+computed over the whole test and over windows of the time the pairs were
+sent, with one NumPy sort per stage.
+
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PERCENTILES = (50, 90, 99)
+NS_PER_SECOND = 1000000000
+
+# Clocks in the order they are tried, with the nanoseconds per unit
+CLOCKS = [("monotonic", 1), ("wall", 1), ("seconds", NS_PER_SECOND)]
+
+# CertificateRecord slot of each transition, per clock
+EVENT_SLOTS = {"sent": {"monotonic": "tx_pair_sent_monotonic_ns",
+                        "wall": "tx_pair_sent_timestamp_ns",
+                        "seconds": "tx_pair_sent_timestamp"},
+               "witnessed": {"monotonic": "revocation_monotonic_ns",
+                             "wall": "revocation_timestamp_ns",
+                             "seconds": "revocation_timestamp"},
+               "block": {"monotonic": "revocation_block_monotonic_ns",
+                         "wall": "revocation_block_timestamp_ns"}}
+
+# (stage, start transition, end transition, revocation type it is measured for, None for all)
+STAGES = [("sent->mempool", "sent", "witnessed", "mempool"),
+          ("mempool->block", "witnessed", "block", "mempool"),
+          ("sent->block", "sent", "block", None),
+          ("sent->witnessed", "sent", "witnessed", None)]
+
+def get_log_columns(rev_logger) -> dict:
+    """Returns the transition timestamps of every certificate of a
+    RevocationLogger as int64 arrays, -1 where unset, and the revocation
+    types
+
+    """
+    if np is None:
+        raise ImportError("numpy is required for the revocation latency report")
+
+    certificates = list(rev_logger.certificates.values())
+    slots = set(slot for event_slots in EVENT_SLOTS.values() for slot in event_slots.values())
+    columns = {slot: np.fromiter((-1 if getattr(certificate, slot) is None else getattr(certificate, slot)
+                                  for certificate in certificates),
+                                 dtype="i8",
+                                 count=len(certificates))
+               for slot in slots}
+    columns["revocation_type"] = np.array([certificate.revocation_type or "" for certificate in certificates], dtype="U10")
+    return columns
+
+def get_wall_times(columns, event):
+    """Returns the wall clock time in nanoseconds since the epoch of a
+    transition, NaN where it is unset
+
+    """
+    times = np.full(len(columns["revocation_type"]), np.nan)
+    for clock, scale in CLOCKS:
+        if clock == "monotonic" or clock not in EVENT_SLOTS[event]:
+            continue
+        column = columns[EVENT_SLOTS[event][clock]]
+        unset = np.isnan(times) & (column >= 0)
+        times[unset] = column[unset] * float(scale)
+    return times
+
+def get_stage_latencies(columns, start_event, end_event):
+    """Returns the latency in nanoseconds between two transitions of every
+    certificate, NaN unless both were timestamped on a common clock
+
+    """
+    latencies = np.full(len(columns["revocation_type"]), np.nan)
+    for clock, scale in CLOCKS:
+        if clock not in EVENT_SLOTS[start_event] or clock not in EVENT_SLOTS[end_event]:
+            continue
+        start, end = columns[EVENT_SLOTS[start_event][clock]], columns[EVENT_SLOTS[end_event][clock]]
+        measured = np.isnan(latencies) & (start >= 0) & (end >= 0)
+        latencies[measured] = (end[measured] - start[measured]) * float(scale)
+    return latencies
+
+def get_group_percentiles(groups, values, percentiles=PERCENTILES):
+    """Returns the distinct `groups` and the count, percentiles and maximum
+    of the `values` of each
+
+    The percentiles are interpolated linearly, as `np.percentile` does.
+
+    """
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    distinct_groups, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    last = starts + counts - 1
+
+    distribution = {"count": counts}
+    for percentile in percentiles:
+        position = starts + (counts - 1) * (percentile / 100)
+        lower = np.floor(position).astype("i8")
+        upper = np.minimum(lower + 1, last)
+        distribution["p{}".format(percentile)] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    distribution["max"] = values[last]
+    return distinct_groups, distribution
+
+def get_latency_report(columns, window=None, percentiles=PERCENTILES):
+    """Returns one row per stage, and per stage and window of `window`
+    seconds if given, with the count, percentiles and maximum of the
+    latencies in milliseconds
+
+    Windows are aligned to the first pair sent and keyed by their start,
+    in seconds since the epoch.  Certificates whose pair has no wall clock
+    timestamp are only in the whole-test rows.
+
+    """
+    sent_times = get_wall_times(columns, "sent")
+    first_sent = np.nanmin(sent_times) if window and (~np.isnan(sent_times)).any() else None
+    rows = []
+    for stage, start_event, end_event, revocation_type in STAGES:
+        latencies = get_stage_latencies(columns, start_event, end_event)
+        measured = ~np.isnan(latencies)
+        if revocation_type is not None:
+            measured &= columns["revocation_type"] == revocation_type
+
+        # Window -1 holds the whole test
+        groupings = [(np.full(int(measured.sum()), -1, dtype="i8"), measured)]
+        if first_sent is not None:
+            windowed = measured & ~np.isnan(sent_times)
+            groupings.append((((sent_times[windowed] - first_sent) // (window * NS_PER_SECOND)).astype("i8"), windowed))
+
+        for groups, selected in groupings:
+            if not len(groups):
+                continue
+            distinct_groups, distribution = get_group_percentiles(groups, latencies[selected], percentiles)
+            for i, group in enumerate(distinct_groups.tolist()):
+                row = {"stage": stage,
+                       "window_start": None if group < 0 else (first_sent + group * window * NS_PER_SECOND) / NS_PER_SECOND,
+                       "count": int(distribution["count"][i])}
+                for key in distribution:
+                    if key != "count":
+                        row[key + "_ms"] = float(distribution[key][i]) / 1e6
+                rows.append(row)
+    return rows
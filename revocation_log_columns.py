@@ -0,0 +1,350 @@
+"""Binary columnar format of the RevocationLogger test log
+
+A log is a directory holding two NumPy `.npy` files, both memory-mapped
+on load:
+
+`certificates.npy`
+    One structured record per certificate, one column per
+    `REVOCATION_LOG_FIELDS` entry.  Strings and bytes are stored hex or
+    ASCII encoded in fixed-width columns, unset ints as -1 and the
+    revocation type as an index into `REVOCATION_TYPES`.  Columns missing
+    from logs of older versions read as unset.
+
+`fingerprint_16_index.npy`
+    The hex fingerprint-16 of every certificate, sorted, with the row of
+    the certificate, so lookups are a binary search.
+
+`dns_name_index.npy`
+    The same for the DNS names.  It is built on load for logs of older
+    versions.
+
+A RevocationLogger reading a binary log does not build every record on
+load: its `certificates` are a `ColumnsCertificates`, which builds the
+record of a certificate from the columns the first time it is read.
+
+"""
+
+import gc
+import os
+from collections.abc import MutableMapping
+
+from revocation_logger import REVOCATION_LOG_FIELDS, CertificateRecord, RevocationLogger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CERTIFICATES_FILE = "certificates.npy"
+FINGERPRINT_16_INDEX_FILE = "fingerprint_16_index.npy"
+DNS_NAME_INDEX_FILE = "dns_name_index.npy"
+
+INT_UNSET = -1
+REVOCATION_TYPES = ["", "mempool", "blockchain"]
+
+INT_SLOTS = {"gen_timestamp",
+             "tx_pair_sent_timestamp",
+             "revocation_timestamp",
+             "revocation_blockheight",
+             "revocation_blocktime",
+             "gen_timestamp_ns",
+             "gen_monotonic_ns",
+             "co_funded_timestamp_ns",
+             "co_funded_monotonic_ns",
+             "tx_pair_sent_timestamp_ns",
+             "tx_pair_sent_monotonic_ns",
+             "revocation_timestamp_ns",
+             "revocation_monotonic_ns",
+             "revocation_block_timestamp_ns",
+             "revocation_block_monotonic_ns"}
+BYTES_SLOTS = {"fingerprint", "co_bitcoin_pubkey"}
+
+def __to_column__(slot, values):
+    if slot in INT_SLOTS:
+        return np.array([INT_UNSET if value is None else value for value in values], dtype="i8")
+    if slot == "co_funded":
+        return np.array(values, dtype="?")
+    if slot == "revocation_type":
+        return np.array([REVOCATION_TYPES.index(value or "") for value in values], dtype="u1")
+    if slot in BYTES_SLOTS:
+        values = [b"" if value is None else value.hex().encode() for value in values]
+    else:
+        values = [b"" if value is None else str(value).encode() for value in values]
+    return np.array(values, dtype="S{}".format(max(1, max(map(len, values), default=1))))
+
+def __from_column__(slot, from_csv, column):
+    values = column.tolist()
+    if slot in INT_SLOTS:
+        return [None if value == INT_UNSET else value for value in values]
+    if slot == "co_funded":
+        return values
+    if slot == "revocation_type":
+        return [REVOCATION_TYPES[value] or None for value in values]
+    if slot in BYTES_SLOTS:
+        return [bytes.fromhex(value.decode()) if value else None for value in values]
+    return [from_csv(value.decode()) if value else None for value in values]
+
+def __from_value__(slot, from_csv, value):
+    if slot in INT_SLOTS:
+        return None if value == INT_UNSET else value
+    if slot == "co_funded":
+        return value
+    if slot == "revocation_type":
+        return REVOCATION_TYPES[value] or None
+    if slot in BYTES_SLOTS:
+        return bytes.fromhex(value.decode()) if value else None
+    return from_csv(value.decode()) if value else None
+
+def __get_index__(keys, name):
+    order = np.argsort(keys, kind="stable")
+    index = np.empty(len(keys), dtype=[(name, keys.dtype), ("row", "i8")])
+    index[name] = keys[order]
+    index["row"] = order
+    return index
+
+def __get_table__(certificates):
+    columns = [(slot, __to_column__(slot, [getattr(certificate, slot) for certificate in certificates]))
+               for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS]
+
+    table = np.empty(len(certificates), dtype=[(slot, column.dtype) for slot, column in columns])
+    for slot, column in columns:
+        table[slot] = column
+    return table
+
+def write_columns(rev_logger, log_path):
+    """Writes the certificates of a RevocationLogger to the directory `log_path`
+
+    """
+    if np is None:
+        raise ImportError("numpy is required for the binary revocation log format")
+
+    if isinstance(rev_logger.certificates, ColumnsCertificates):
+        table = rev_logger.certificates.get_table()
+    else:
+        table = __get_table__(list(rev_logger.certificates.values()))
+
+    os.makedirs(log_path, exist_ok=True)
+    for filename, array in [(CERTIFICATES_FILE, table),
+                            (FINGERPRINT_16_INDEX_FILE, __get_index__(table["fingerprint"].astype("S32"), "fingerprint_16")),
+                            (DNS_NAME_INDEX_FILE, __get_index__(table["dns_name"], "dns_name"))]:
+        with open(os.path.join(log_path, filename + ".tmp"), "wb") as column_file:
+            np.save(column_file, array)
+        os.replace(os.path.join(log_path, filename + ".tmp"), os.path.join(log_path, filename))
+
+class RevocationLogColumns(object):
+    """Memory-mapped binary revocation log
+
+    `certificates` is the structured array of all certificates; columns
+    are read with e.g. `certificates["revocation_timestamp"]`.
+
+    """
+    def __init__(self, log_path):
+        if np is None:
+            raise ImportError("numpy is required for the binary revocation log format")
+
+        self.certificates = np.load(os.path.join(log_path, CERTIFICATES_FILE), mmap_mode="r")
+        self.fingerprint_16_index = np.load(os.path.join(log_path, FINGERPRINT_16_INDEX_FILE), mmap_mode="r")
+        if os.path.exists(os.path.join(log_path, DNS_NAME_INDEX_FILE)):
+            self.dns_name_index = np.load(os.path.join(log_path, DNS_NAME_INDEX_FILE), mmap_mode="r")
+        else:
+            self.dns_name_index = __get_index__(self.certificates["dns_name"], "dns_name")
+
+    def __len__(self):
+        return len(self.certificates)
+
+    def __find_row__(self, index, name, key):
+        keys = index[name]
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return int(index["row"][i])
+        return None
+
+    def find_row(self, cert_fingerprint_16):
+        """Returns the row of the certificate with the hex `cert_fingerprint_16`,
+        or None
+
+        """
+        return self.__find_row__(self.fingerprint_16_index, "fingerprint_16", cert_fingerprint_16[:32].encode())
+
+    def find_dns_name_row(self, cert_dns_name):
+        """Returns the row of the certificate for `cert_dns_name`, or None
+
+        """
+        return self.__find_row__(self.dns_name_index, "dns_name", cert_dns_name.encode())
+
+    def get_column(self, slot):
+        """Returns the column of `slot`, or None if the log predates it
+
+        """
+        return self.certificates[slot] if slot in self.certificates.dtype.names else None
+
+    def __get_values__(self, slot, from_csv, rows=slice(None)):
+        column = self.get_column(slot)
+        if column is None:
+            return [None] * len(range(*rows.indices(len(self.certificates))))
+        return __from_column__(slot, from_csv, column[rows])
+
+    def get_certificate(self, row):
+        values = dict(zip(self.certificates.dtype.names, self.certificates[row].item()))
+        certificate = CertificateRecord.__new__(CertificateRecord)
+        for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS:
+            setattr(certificate, slot, __from_value__(slot, from_csv, values[slot]) if slot in values else None)
+        return certificate
+
+    def to_logger(self, rev_logger=None):
+        """Loads every certificate into `rev_logger` (a new RevocationLogger
+        by default)
+
+        A new logger's progress is counted once all are loaded; a given
+        one is counted by its `read`.
+
+        """
+        columns = [(slot, self.__get_values__(slot, from_csv))
+                   for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS]
+
+        slots = [slot for slot, values in columns]
+
+        new_logger = rev_logger is None
+        rev_logger = RevocationLogger() if new_logger else rev_logger
+        # None of the new records can be part of a reference cycle, so the
+        # collector would only rescan them over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for values in zip(*[values for slot, values in columns]):
+                certificate = CertificateRecord.__new__(CertificateRecord)
+                for slot, value in zip(slots, values):
+                    setattr(certificate, slot, value)
+                rev_logger.__add_record__(certificate)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if new_logger:
+            rev_logger.__recount__()
+        return rev_logger
+
+class ColumnsCertificates(MutableMapping):
+    """DNS name -> CertificateRecord of a `RevocationLogColumns`
+
+    The record of a certificate is built from the columns the first time
+    it is read and then kept, so it is updated like any other record.
+    Certificates added afterwards are only kept as records.  Iterating
+    over the records builds all of them, `select` and `count` go through
+    the columns instead.
+
+    """
+    def __init__(self, log_columns):
+        self.log_columns = log_columns
+        # Row -> record of the rows whose record was built
+        self.__built__ = {}
+        # DNS name -> record of the certificates not in the columns
+        self.__added__ = {}
+
+    def __len__(self):
+        return len(self.log_columns) + len(self.__added__)
+
+    def __iter__(self):
+        for dns_name in self.log_columns.certificates["dns_name"]:
+            yield dns_name.decode()
+        yield from list(self.__added__)
+
+    def __contains__(self, cert_dns_name):
+        return cert_dns_name in self.__added__ or self.log_columns.find_dns_name_row(cert_dns_name) is not None
+
+    def __getitem__(self, cert_dns_name):
+        certificate = self.__added__.get(cert_dns_name)
+        if certificate is not None:
+            return certificate
+        row = self.log_columns.find_dns_name_row(cert_dns_name)
+        if row is None:
+            raise KeyError(cert_dns_name)
+        return self.get_row(row)
+
+    def __setitem__(self, cert_dns_name, certificate):
+        row = self.log_columns.find_dns_name_row(cert_dns_name)
+        if row is None:
+            self.__added__[cert_dns_name] = certificate
+        else:
+            self.__built__[row] = certificate
+
+    def __delitem__(self, cert_dns_name):
+        raise TypeError("Certificates cannot be removed from a binary revocation log")
+
+    def get_row(self, row):
+        certificate = self.__built__.get(row)
+        if certificate is None:
+            certificate = self.__built__[row] = self.log_columns.get_certificate(row)
+        return certificate
+
+    def find_certificate(self, cert_fingerprint_16):
+        """Returns the certificate with the hex `cert_fingerprint_16`, or None
+
+        """
+        row = self.log_columns.find_row(cert_fingerprint_16)
+        return None if row is None else self.get_row(row)
+
+    def __match__(self, column_condition, record_condition):
+        """Returns the rows whose record is not built and whose columns
+        match `column_condition(log_columns)`, and the records matching
+        `record_condition(record)`
+
+        """
+        matching = np.asarray(column_condition(self.log_columns), dtype=bool).copy()
+        matching[list(self.__built__)] = False
+        records = [certificate for certificate in list(self.__built__.values()) + list(self.__added__.values())
+                   if record_condition(certificate)]
+        return np.flatnonzero(matching), records
+
+    def select(self, column_condition, record_condition):
+        """Returns the DNS names of the certificates matching the
+        conditions, see `__match__`
+
+        """
+        rows, records = self.__match__(column_condition, record_condition)
+        return ([dns_name.decode() for dns_name in self.log_columns.certificates["dns_name"][rows].tolist()]
+                + [certificate.dns_name for certificate in records])
+
+    def count(self, column_condition, record_condition) -> int:
+        rows, records = self.__match__(column_condition, record_condition)
+        return len(rows) + len(records)
+
+    def get_table(self):
+        """Returns the certificates as the structured array of a log
+
+        """
+        table = self.log_columns.certificates
+        rows = np.array(sorted(self.__built__), dtype="i8")
+        built = __get_table__([self.__built__[row] for row in rows.tolist()])
+        added = __get_table__(list(self.__added__.values()))
+
+        columns = []
+        for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS:
+            column = table[slot] if slot in table.dtype.names else __to_column__(slot, [None] * len(table))
+            # Strings of the updated records may be wider than the column
+            dtype = np.result_type(column.dtype, built[slot].dtype, added[slot].dtype)
+            column = np.concatenate([column.astype(dtype), added[slot].astype(dtype)])
+            column[rows] = built[slot]
+            columns.append((slot, column))
+
+        merged = np.empty(len(self), dtype=[(slot, column.dtype) for slot, column in columns])
+        for slot, column in columns:
+            merged[slot] = column
+        return merged
+
+def read_columns(log_path, rev_logger=None):
+    """Loads the binary log at `log_path` into `rev_logger` (a new
+    RevocationLogger by default)
+
+    The records of an empty logger are built lazily, see
+    `ColumnsCertificates`.  As with `to_logger`, only a new logger's
+    progress is counted.
+
+    """
+    if rev_logger is not None and rev_logger.certificates:
+        return RevocationLogColumns(log_path).to_logger(rev_logger)
+    new_logger = rev_logger is None
+    rev_logger = RevocationLogger() if new_logger else rev_logger
+    rev_logger.certificates = ColumnsCertificates(RevocationLogColumns(log_path))
+    if new_logger:
+        rev_logger.__recount__()
+    return rev_logger
@@ -1,9 +1,11 @@
 """Revocation logging and datastructure for test-scenarios"""
 import logging
 import csv
-import datetime
 import time
-from collections import defaultdict
+import sys
+import os
+import json
+import threading
 
 REVOCATION_LOG_FIELDNAMES = ["Cert DNS name",
                              "Cert gen timestamp",
@@ -20,41 +22,410 @@ REVOCATION_LOG_FIELDNAMES = ["Cert DNS name",
                              "Cert revocation fees",
                              "Cert revocation funds",
                              "TX:Fund txid",
-                             "TX:Revoke txid"]
+                             "TX:Revoke txid",
+                             "Cert gen timestamp ns",
+                             "Cert gen monotonic ns",
+                             "CO funded timestamp ns",
+                             "CO funded monotonic ns",
+                             "TX_Pair sent timestamp ns",
+                             "TX_Pair sent monotonic ns",
+                             "Cert revocation timestamp ns",
+                             "Cert revocation monotonic ns",
+                             "Cert revocation block timestamp ns",
+                             "Cert revocation block monotonic ns"]
+
+JOURNAL_COMPACT_MIN_RECORDS = 10000
+
+# Snapshot paths with this suffix are written in the binary columnar
+# format of `revocation_log_columns` instead of CSV
+COLUMNS_LOG_SUFFIX = ".columns"
+
+# (condition on the columns of a binary log, condition on a CertificateRecord)
+# of the certificates counted by `RevocationLogger.get_progress`
+SENT_CONDITIONS = (lambda columns: columns.get_column("tx_pair_sent_timestamp") >= 0,
+                   lambda certificate: certificate.tx_pair_sent_timestamp is not None)
+REVOKED_CONDITIONS = (lambda columns: columns.get_column("revocation_type") != 0,
+                      lambda certificate: certificate.is_revoked())
+MINED_CONDITIONS = (lambda columns: columns.get_column("revocation_blocktime") >= 0,
+                    lambda certificate: certificate.is_mined())
+
+def get_latest_snapshot_path(log_path):
+    """Returns the newer of the CSV and the binary columnar snapshot of
+    the test log at `log_path`
+
+    Both snapshots share the journal, which is emptied when either is
+    written, so only the newer one is complete with the journal.
+
+    """
+    if log_path.endswith(COLUMNS_LOG_SUFFIX):
+        other_path = log_path[:-len(COLUMNS_LOG_SUFFIX)] + ".csv"
+    else:
+        other_path = os.path.splitext(log_path)[0] + COLUMNS_LOG_SUFFIX
+    if os.path.exists(other_path) and (not os.path.exists(log_path)
+                                       or os.path.getmtime(other_path) > os.path.getmtime(log_path)):
+        return other_path
+    return log_path
 
 def unixtimestampnow():
-    return int(time.mktime(datetime.datetime.now().timetuple())) 
-    
+    return time.time_ns() // 1000000000
+
+def get_timestamps_ns():
+    """Returns the wall clock and monotonic time of a state transition, in
+    nanoseconds
+
+    The monotonic clock is system-wide, so the latencies between
+    transitions logged by different scripts on the same machine are
+    exact, without the wall clock's adjustments.
+
+    """
+    return time.time_ns(), time.monotonic_ns()
+
+def __to_csv_value__(value):
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, bool):
+        return str(value)
+    return value
+
+def __from_csv_int__(value):
+    return int(value)
+
+def __from_csv_bool__(value):
+    return value == "True"
+
+def __from_csv_str__(value):
+    return value
+
+# (CSV field name, CertificateRecord slot, parser of the CSV string)
+REVOCATION_LOG_FIELDS = [("Cert DNS name", "dns_name", __from_csv_str__),
+                         ("Cert gen timestamp", "gen_timestamp", __from_csv_int__),
+                         ("Cert fingerprint", "fingerprint", bytes.fromhex),
+                         ("CO Bitcoin pubkey", "co_bitcoin_pubkey", bytes.fromhex),
+                         ("CA Bitcoin pubkey", "ca_bitcoin_pubkey", sys.intern),
+                         ("Cert multisig address", "multisig_address", __from_csv_str__),
+                         ("CO_funded", "co_funded", __from_csv_bool__),
+                         ("TX_Pair sent timestamp", "tx_pair_sent_timestamp", __from_csv_int__),
+                         ("Cert revocation type", "revocation_type", sys.intern),
+                         ("Cert revocation timestamp", "revocation_timestamp", __from_csv_int__),
+                         ("Cert revocation blockheight", "revocation_blockheight", __from_csv_int__),
+                         ("Cert revocation blocktime", "revocation_blocktime", __from_csv_int__),
+                         ("Cert revocation fees", "revocation_fees", __from_csv_str__),
+                         ("Cert revocation funds", "revocation_funds", __from_csv_str__),
+                         ("TX:Fund txid", "txfund_txid", __from_csv_str__),
+                         ("TX:Revoke txid", "txrevoke_txid", __from_csv_str__),
+                         ("Cert gen timestamp ns", "gen_timestamp_ns", __from_csv_int__),
+                         ("Cert gen monotonic ns", "gen_monotonic_ns", __from_csv_int__),
+                         ("CO funded timestamp ns", "co_funded_timestamp_ns", __from_csv_int__),
+                         ("CO funded monotonic ns", "co_funded_monotonic_ns", __from_csv_int__),
+                         ("TX_Pair sent timestamp ns", "tx_pair_sent_timestamp_ns", __from_csv_int__),
+                         ("TX_Pair sent monotonic ns", "tx_pair_sent_monotonic_ns", __from_csv_int__),
+                         ("Cert revocation timestamp ns", "revocation_timestamp_ns", __from_csv_int__),
+                         ("Cert revocation monotonic ns", "revocation_monotonic_ns", __from_csv_int__),
+                         ("Cert revocation block timestamp ns", "revocation_block_timestamp_ns", __from_csv_int__),
+                         ("Cert revocation block monotonic ns", "revocation_block_monotonic_ns", __from_csv_int__)]
+
+REVOCATION_LOG_SLOTS = {fieldname: (slot, from_csv) for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS}
+
+class CertificateRecord(object):
+    """State of one test certificate
+
+    Timestamps and block heights are ints, the fingerprint and CO pubkey
+    are bytes and `co_funded` is a bool.  Every transition is timestamped
+    in seconds and, in the `_ns` fields, in nanoseconds of the wall clock
+    and of the monotonic clock; the block fields are set when the
+    revocation is first witnessed in a block.  Logs written before the
+    `_ns` fields existed have them unset.  The CA pubkey is shared by all
+    certificates and is interned.  Fields that are not set yet are None.
+
+    Indexing with a `REVOCATION_LOG_FIELDNAMES` name reads or writes the
+    field in its CSV representation, with '' for unset fields.
+
+    """
+    __slots__ = tuple(slot for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS)
+
+    def __init__(self, dns_name):
+        for slot in CertificateRecord.__slots__:
+            setattr(self, slot, None)
+        self.dns_name = dns_name
+        self.co_funded = False
+
+    @classmethod
+    def from_row(cls, row):
+        certificate = cls.__new__(cls)
+        for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS:
+            value = row.get(fieldname)
+            setattr(certificate, slot, from_csv(value) if value else None)
+        certificate.co_funded = bool(certificate.co_funded)
+        return certificate
+
+    def to_row(self):
+        return {fieldname: __to_csv_value__(getattr(self, slot)) for fieldname, slot, from_csv in REVOCATION_LOG_FIELDS}
+
+    def __getitem__(self, fieldname):
+        return __to_csv_value__(getattr(self, REVOCATION_LOG_SLOTS[fieldname][0]))
+
+    def __setitem__(self, fieldname, value):
+        slot, from_csv = REVOCATION_LOG_SLOTS[fieldname]
+        setattr(self, slot, None if value in ('', None) else from_csv(value))
+
+    def is_revoked(self) -> bool:
+        return self.revocation_type is not None
+
+    def is_mined(self) -> bool:
+        return self.revocation_blocktime is not None
+
 class RevocationLogger(object):
+    """Test log of every certificate's state
+
+    The log is a CSV file written by `write`.  With a journal opened by
+    `open_journal`, every state transition is also appended to the
+    journal as one JSON line `[DNS name, {field name: CSV value}]`, and
+    the journal is fsynced once `journal_fsync_batch` records or
+    `journal_fsync_interval` seconds have accumulated.  `compact` writes
+    the CSV snapshot and empties the journal, and `read` replays the
+    journal on top of the snapshot.  If the journal was opened with a
+    snapshot path, it is compacted automatically once it holds as many
+    records as there are certificates, which keeps the total write cost
+    linear in the number of transitions.
+
+    The number of certificates whose pair was sent, that are revoked and
+    whose revocation is mined are counted once after `read`, then kept up
+    to date by every transition, and `all_revoked` and `all_mined` are set
+    while every certificate is, so progress and completion are checked
+    without scanning the log.
+
+    """
     def __init__(self):
         self.certificates = {}
         self.__fingerprint_16_index__ = {}
+        self.__progress_lock__ = threading.Lock()
+        self.num_sent = 0
+        self.num_revoked = 0
+        self.num_mined = 0
+        self.all_revoked = threading.Event()
+        self.all_mined = threading.Event()
+        self.__journal__ = None
+        self.__journal_lock__ = threading.Lock()
+        self.journal_fsync_batch = 100
+        self.journal_fsync_interval = 1.0
         logging.basicConfig(format="%(asctime)s: %(message)s",
                             level=logging.NOTSET,
                             datefmt="%x %X %Z")
-    def read(self, csvfile_path):
-        with open(csvfile_path, "r", newline='') as  csvfile:
-            certificates = csv.DictReader(csvfile)
-            for certificate in certificates:
-                self.certificates[certificate["Cert DNS name"]] = certificate
-                self.__fingerprint_16_index__[certificate["Cert fingerprint"][:32]] = certificate["Cert DNS name"]
-            logging.info("Reading `{0}` certificate entries from `{1}` ".format(len(self.certificates), csvfile_path))
-        
+
+    def __find_certificate__(self, cert_fingerprint_16):
+        try:
+            certificate = self.__fingerprint_16_index__.get(bytes.fromhex(cert_fingerprint_16))
+        except ValueError:
+            return None
+        if certificate is None and hasattr(self.certificates, "find_certificate"):
+            certificate = self.certificates.find_certificate(cert_fingerprint_16)
+        return certificate
+
+    def __select__(self, column_condition, record_condition):
+        """Returns the DNS names of the certificates matching
+        `record_condition`, or `column_condition` for the records of a
+        binary log that were not built yet
+
+        """
+        if hasattr(self.certificates, "select"):
+            return self.certificates.select(column_condition, record_condition)
+        return [cert_dns_name for cert_dns_name, certificate in self.certificates.items() if record_condition(certificate)]
+
+    def __count__(self, column_condition, record_condition) -> int:
+        if hasattr(self.certificates, "count"):
+            return self.certificates.count(column_condition, record_condition)
+        return sum(1 for certificate in self.certificates.values() if record_condition(certificate))
+
+    def __recount__(self):
+        with self.__progress_lock__:
+            self.num_sent = self.__count__(*SENT_CONDITIONS)
+            self.num_revoked = self.__count__(*REVOKED_CONDITIONS)
+            self.num_mined = self.__count__(*MINED_CONDITIONS)
+        self.__update_progress__()
+
+    def get_unsent_dns_names(self):
+        """Returns the DNS names of the funded certificates whose revocation
+        pair was not sent yet
+
+        """
+        return self.__select__(lambda columns: (columns.get_column("tx_pair_sent_timestamp") < 0) & columns.get_column("co_funded"),
+                               lambda certificate: certificate.tx_pair_sent_timestamp is None and certificate.co_funded)
+
+    def __update_progress__(self, sent=0, revoked=0, mined=0):
+        with self.__progress_lock__:
+            self.num_sent = self.num_sent + sent
+            self.num_revoked = self.num_revoked + revoked
+            self.num_mined = self.num_mined + mined
+            for event, count in ((self.all_revoked, self.num_revoked), (self.all_mined, self.num_mined)):
+                if count == len(self.certificates):
+                    event.set()
+                else:
+                    event.clear()
+
+    def __count_record__(self, certificate, sign):
+        self.__update_progress__(sign * (certificate.tx_pair_sent_timestamp is not None),
+                                 sign * certificate.is_revoked(),
+                                 sign * certificate.is_mined())
+
+    def get_progress(self):
+        """Returns the number of certificates whose pair was sent, that are
+        revoked and whose revocation is mined
+
+        """
+        with self.__progress_lock__:
+            return self.num_sent, self.num_revoked, self.num_mined
+
+    def __add_record__(self, certificate):
+        # Not counted: the bulk loads count every record once at the end, see `__recount__`
+        self.certificates[certificate.dns_name] = certificate
+        if certificate.fingerprint is not None:
+            self.__fingerprint_16_index__[certificate.fingerprint[:16]] = certificate
+
+    def read(self, csvfile_path, journal_path=None):
+        """Reads the CSV log, then replays the journal at `journal_path`
+
+        The CSV log may be missing if a journal is given.  Paths ending
+        in `COLUMNS_LOG_SUFFIX` are read as a binary columnar log.  With a
+        journal, the other format's snapshot is read instead if it is
+        newer, see `get_latest_snapshot_path`.
+
+        """
+        if journal_path is not None:
+            latest_path = get_latest_snapshot_path(csvfile_path)
+            if latest_path != csvfile_path:
+                logging.info("`{0}` is newer than `{1}`, reading it instead".format(latest_path, csvfile_path))
+                csvfile_path = latest_path
+
+        if csvfile_path.endswith(COLUMNS_LOG_SUFFIX):
+            if journal_path is None or os.path.exists(csvfile_path):
+                import revocation_log_columns
+                revocation_log_columns.read_columns(csvfile_path, self)
+                logging.info("Reading `{0}` certificate entries from `{1}` ".format(len(self.certificates), csvfile_path))
+        elif journal_path is None or os.path.exists(csvfile_path):
+            with open(csvfile_path, "r", newline='') as  csvfile:
+                certificates = csv.DictReader(csvfile)
+                for certificate in certificates:
+                    self.__add_record__(CertificateRecord.from_row(certificate))
+                logging.info("Reading `{0}` certificate entries from `{1}` ".format(len(self.certificates), csvfile_path))
+
+        if journal_path is not None and os.path.exists(journal_path):
+            self.__replay_journal__(journal_path)
+
+        # Once for the whole load; a lazily loaded binary log is counted on its columns
+        self.__recount__()
+
+    def __replay_journal__(self, journal_path):
+        num_records = 0
+        with open(journal_path, "r") as journal:
+            for line in journal:
+                if not line.strip():
+                    continue
+                try:
+                    cert_dns_name, fields = json.loads(line)
+                except ValueError:
+                    # Torn last record of a crashed run
+                    logging.error("Skipping incomplete journal record in `{}`".format(journal_path))
+                    continue
+
+                certificate = self.certificates.get(cert_dns_name)
+                if certificate is None:
+                    certificate = CertificateRecord(cert_dns_name)
+                for fieldname, value in fields.items():
+                    certificate[fieldname] = value
+                self.__add_record__(certificate)
+                num_records = num_records + 1
+        logging.info("Replayed `{0}` journal records from `{1}` ".format(num_records, journal_path))
+
     def write(self, csvfile_path):
-        with open(csvfile_path, "w", newline='') as csvfile:
+        if csvfile_path.endswith(COLUMNS_LOG_SUFFIX):
+            import revocation_log_columns
+            revocation_log_columns.write_columns(self, csvfile_path)
+            logging.info("Wrote `{0}` certificate entries to `{1}` ".format(len(self.certificates), csvfile_path))
+            return
+
+        # Written next to the log and renamed, so a crash never leaves a partial log behind
+        with open(csvfile_path + ".tmp", "w", newline='') as csvfile:
             csvfilewriter = csv.DictWriter(csvfile,
                                             fieldnames=REVOCATION_LOG_FIELDNAMES,
                                             quoting=csv.QUOTE_NONNUMERIC)
             csvfilewriter.writeheader()
 
-            def remove_if_tuple(tup):
-                return tup[0] if type(tup) == tuple else tup
+            for certificate in self.certificates.values():
+                csvfilewriter.writerow(certificate.to_row())
 
-            for k,v in self.certificates.items():
-                csvfilewriter.writerow(
-                    {log_key:remove_if_tuple(log_value) for log_key,log_value in v.items()})
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(csvfile_path + ".tmp", csvfile_path)
 
-            logging.info("Wrote `{0}` certificate entries to `{1}` ".format(len(self.certificates), csvfile_path))
+        logging.info("Wrote `{0}` certificate entries to `{1}` ".format(len(self.certificates), csvfile_path))
+
+    def open_journal(self, journal_path, snapshot_path=None):
+        """Appends every following state transition to `journal_path`
+
+        """
+        with self.__journal_lock__:
+            self.__journal__ = open(journal_path, "a")
+            if self.__journal__.tell() > 0:
+                with open(journal_path, "rb") as journal:
+                    journal.seek(-1, os.SEEK_END)
+                    if journal.read(1) != b"\n":
+                        # Terminate a torn last record of a crashed run
+                        self.__journal__.write("\n")
+            self.__journal_pending__ = 0
+            self.__journal_records__ = 0
+            self.__journal_synced__ = time.monotonic()
+            self.__snapshot_path__ = snapshot_path
+
+    def sync_journal(self):
+        with self.__journal_lock__:
+            self.__sync_journal__()
+
+    def close_journal(self):
+        with self.__journal_lock__:
+            if self.__journal__ is not None:
+                self.__sync_journal__()
+                self.__journal__.close()
+                self.__journal__ = None
+
+    def compact(self, csvfile_path):
+        """Writes the CSV snapshot and empties the journal
+
+        """
+        with self.__journal_lock__:
+            self.__compact__(csvfile_path)
+
+    def __compact__(self, csvfile_path):
+        self.write(csvfile_path)
+        if self.__journal__ is not None:
+            self.__journal__.truncate(0)
+            self.__sync_journal__()
+            self.__journal_records__ = 0
+
+    def __sync_journal__(self):
+        self.__journal__.flush()
+        os.fsync(self.__journal__.fileno())
+        self.__journal_pending__ = 0
+        self.__journal_synced__ = time.monotonic()
+
+    def __journal_record__(self, certificate, *fieldnames):
+        if self.__journal__ is None:
+            return
+        with self.__journal_lock__:
+            if self.__journal__ is None:
+                return
+            self.__journal__.write(json.dumps([certificate.dns_name,
+                                               {fieldname: certificate[fieldname] for fieldname in fieldnames}]) + "\n")
+            self.__journal__.flush()
+            self.__journal_pending__ = self.__journal_pending__ + 1
+            self.__journal_records__ = self.__journal_records__ + 1
+            if (self.__snapshot_path__ is not None
+                and self.__journal_records__ >= max(JOURNAL_COMPACT_MIN_RECORDS, len(self.certificates))):
+                self.__compact__(self.__snapshot_path__)
+            elif (self.__journal_pending__ >= self.journal_fsync_batch
+                  or time.monotonic() - self.__journal_synced__ >= self.journal_fsync_interval):
+                self.__sync_journal__()
 
     def add_certificate(self, cert_dns_name,
                         cert_fingerprint,
@@ -66,21 +437,26 @@ class RevocationLogger(object):
             logging.error("Certificate for `{}` is already in the RevocationLogger, skipping".format(cert_dns_name))
             return
 
-        self.certificates[cert_dns_name] = defaultdict(lambda:'')
-        self.certificates[cert_dns_name]["Cert DNS name"] = cert_dns_name
-        self.certificates[cert_dns_name]["Cert gen timestamp"] = unixtimestampnow()
-        self.certificates[cert_dns_name]["Cert fingerprint"] = cert_fingerprint,
-        self.__fingerprint_16_index__[cert_fingerprint[:32]] = cert_dns_name
-        self.certificates[cert_dns_name]["CO Bitcoin pubkey"] = co_bitcoin_pubkey,
-        self.certificates[cert_dns_name]["CA Bitcoin pubkey"] = ca_bitcoin_pubkey,
-        self.certificates[cert_dns_name]["Cert multisig address"] = cert_multisig_address
-        self.certificates[cert_dns_name]["CO_funded"] = "False"
+        certificate = CertificateRecord(cert_dns_name)
+        certificate.gen_timestamp_ns, certificate.gen_monotonic_ns = get_timestamps_ns()
+        certificate.gen_timestamp = certificate.gen_timestamp_ns // 1000000000
+        certificate.fingerprint = bytes.fromhex(cert_fingerprint)
+        certificate.co_bitcoin_pubkey = bytes.fromhex(co_bitcoin_pubkey)
+        certificate.ca_bitcoin_pubkey = sys.intern(ca_bitcoin_pubkey)
+        certificate.multisig_address = cert_multisig_address
+        self.__add_record__(certificate)
+        # Neither sent, revoked nor mined, but `all_revoked` and `all_mined` no longer hold
+        self.__update_progress__()
+        self.__journal_record__(certificate, *REVOCATION_LOG_FIELDNAMES)
         logging.info("Certificate for `{}` added to RevocationLogger".format(cert_dns_name))
 
     def set_co_funded(self, cert_dns_name):
         try:
-            if(self.certificates[cert_dns_name]["CO_funded"]== "False"):
-                self.certificates[cert_dns_name]["CO_funded"] = "True"
+            certificate = self.certificates[cert_dns_name]
+            if not certificate.co_funded:
+                certificate.co_funded = True
+                certificate.co_funded_timestamp_ns, certificate.co_funded_monotonic_ns = get_timestamps_ns()
+                self.__journal_record__(certificate, "CO_funded", "CO funded timestamp ns", "CO funded monotonic ns")
                 # logging.info("CO `{}` is funded".format(cert_dns_name))
             else:
                 logging.error("CO `{}` funding is already complete".format(cert_dns_name))
@@ -90,16 +466,25 @@ class RevocationLogger(object):
 
     def tx_pair_sent(self, cert_dns_name, tx_fund_txid, tx_revoke_txid):
         try:
-            if(self.certificates[cert_dns_name]["TX_Pair sent timestamp"]== ''):
-                self.certificates[cert_dns_name]["TX_Pair sent timestamp"] = unixtimestampnow()
-                self.certificates[cert_dns_name]["TX:Fund txid"] = tx_fund_txid
-                self.certificates[cert_dns_name]["TX:Revoke txid"] = tx_revoke_txid
+            certificate = self.certificates[cert_dns_name]
+            if certificate.tx_pair_sent_timestamp is None:
+                certificate.tx_pair_sent_timestamp_ns, certificate.tx_pair_sent_monotonic_ns = get_timestamps_ns()
+                certificate.tx_pair_sent_timestamp = certificate.tx_pair_sent_timestamp_ns // 1000000000
+                certificate.txfund_txid = tx_fund_txid
+                certificate.txrevoke_txid = tx_revoke_txid
+                self.__update_progress__(sent=1)
+                self.__journal_record__(certificate,
+                                        "TX_Pair sent timestamp",
+                                        "TX_Pair sent timestamp ns",
+                                        "TX_Pair sent monotonic ns",
+                                        "TX:Fund txid",
+                                        "TX:Revoke txid")
             else:
                 logging.error(
                     "CO `{0}` revocation transactions were possibly already sent, skipping. Current values (timestamp, txfund txid, txrevoke txid): ({1},{2},{3})".format(cert_dns_name,
-                                                                                                                                                                self.certificates[cert_dns_name]["TX_Pair sent timestamp"],
-                                                                                                                                                                self.certificates[cert_dns_name]["TX:Fund txid"],
-                                                                                                                                                                self.certificates[cert_dns_name]["TX:Revoke txid"]))
+                                                                                                                                                                certificate.tx_pair_sent_timestamp,
+                                                                                                                                                                certificate.txfund_txid,
+                                                                                                                                                                certificate.txrevoke_txid))
                 
 
         except Exception as E:
@@ -110,21 +495,30 @@ class RevocationLogger(object):
                                   cert_revocation_fees,
                                   cert_revocation_funds):
         try:
-            if cert_fingerprint_16 not in self.__fingerprint_16_index__:
+            certificate = self.__find_certificate__(cert_fingerprint_16)
+            if certificate is None:
                 logging.error(
                     "Certificate with fingerprint starting with `{}`, witnessed in mempool, not found in logger, skipping".format(cert_fingerprint_16))
                 return
-            cert_dns_name = self.__fingerprint_16_index__[cert_fingerprint_16]
-            if(self.certificates[cert_dns_name]["Cert revocation timestamp"]==''):
-                self.certificates[cert_dns_name]["Cert revocation timestamp"] = unixtimestampnow()
-                self.certificates[cert_dns_name]["Cert revocation type"] = "mempool"
-                self.certificates[cert_dns_name]["Cert revocation fees"] = cert_revocation_fees
-                self.certificates[cert_dns_name]["Cert revocation funds"] = cert_revocation_funds
-                logging.info("`{}` revoked from mempool".format(cert_dns_name))
+            if certificate.revocation_timestamp is None:
+                certificate.revocation_timestamp_ns, certificate.revocation_monotonic_ns = get_timestamps_ns()
+                certificate.revocation_timestamp = certificate.revocation_timestamp_ns // 1000000000
+                certificate.revocation_type = "mempool"
+                certificate.revocation_fees = cert_revocation_fees or None
+                certificate.revocation_funds = cert_revocation_funds or None
+                self.__update_progress__(revoked=1)
+                self.__journal_record__(certificate,
+                                        "Cert revocation timestamp",
+                                        "Cert revocation timestamp ns",
+                                        "Cert revocation monotonic ns",
+                                        "Cert revocation type",
+                                        "Cert revocation fees",
+                                        "Cert revocation funds")
+                logging.info("`{}` revoked from mempool".format(certificate.dns_name))
             else:
                 logging.error(
-                    "MEMPOOL:`{0}` was already revoked via `{1}`, skipping".format(cert_dns_name,
-                                                                           self.certificates[cert_dns_name]["Cert revocation type"]))
+                    "MEMPOOL:`{0}` was already revoked via `{1}`, skipping".format(certificate.dns_name,
+                                                                           certificate.revocation_type))
                     
                 
         except Exception as E:
@@ -137,26 +531,88 @@ class RevocationLogger(object):
                                      cert_revocation_blockheight,
                                      cert_revocation_blocktime):
         try:
-            if cert_fingerprint_16 not in self.__fingerprint_16_index__:
+            certificate = self.__find_certificate__(cert_fingerprint_16)
+            if certificate is None:
                 logging.error(
                     "Certificate with fingerprint starting with `{}`, witnessed on blockchain, not found in logger, skipping".format(cert_fingerprint_16))
                 return
-            cert_dns_name = self.__fingerprint_16_index__[cert_fingerprint_16]
-            if(self.certificates[cert_dns_name]["Cert revocation timestamp"]==''):
-                self.certificates[cert_dns_name]["Cert revocation timestamp"] = unixtimestampnow()
-                self.certificates[cert_dns_name]["Cert revocation type"] = "blockchain"
-                self.certificates[cert_dns_name]["Cert revocation fees"] = cert_revocation_fees
-                self.certificates[cert_dns_name]["Cert revocation funds"] = cert_revocation_funds
-                self.certificates[cert_dns_name]["Cert revocation blockheight"] = cert_revocation_blockheight
-                self.certificates[cert_dns_name]["Cert revocation blocktime"] = cert_revocation_blocktime
-                logging.info("`{}` revoked and transactions confirmed in blockchain".format(cert_dns_name))
+            timestamp_ns, monotonic_ns = get_timestamps_ns()
+            was_mined = certificate.is_mined()
+            if certificate.revocation_block_timestamp_ns is None:
+                certificate.revocation_block_timestamp_ns, certificate.revocation_block_monotonic_ns = timestamp_ns, monotonic_ns
+            if certificate.revocation_timestamp is None:
+                certificate.revocation_timestamp_ns, certificate.revocation_monotonic_ns = timestamp_ns, monotonic_ns
+                certificate.revocation_timestamp = timestamp_ns // 1000000000
+                certificate.revocation_type = "blockchain"
+                certificate.revocation_fees = cert_revocation_fees or None
+                certificate.revocation_funds = cert_revocation_funds or None
+                certificate.revocation_blockheight = int(cert_revocation_blockheight)
+                certificate.revocation_blocktime = int(cert_revocation_blocktime)
+                self.__update_progress__(revoked=1, mined=not was_mined)
+                self.__journal_record__(certificate,
+                                        "Cert revocation timestamp",
+                                        "Cert revocation timestamp ns",
+                                        "Cert revocation monotonic ns",
+                                        "Cert revocation type",
+                                        "Cert revocation fees",
+                                        "Cert revocation funds",
+                                        "Cert revocation blockheight",
+                                        "Cert revocation blocktime",
+                                        "Cert revocation block timestamp ns",
+                                        "Cert revocation block monotonic ns")
+                logging.info("`{}` revoked and transactions confirmed in blockchain".format(certificate.dns_name))
             else:
-                self.certificates[cert_dns_name]["Cert revocation blockheight"] = cert_revocation_blockheight
-                self.certificates[cert_dns_name]["Cert revocation blocktime"] = cert_revocation_blocktime
-                logging.info("Revocation transactions for `{}` confirmed in blockchain".format(cert_dns_name))
+                certificate.revocation_blockheight = int(cert_revocation_blockheight)
+                certificate.revocation_blocktime = int(cert_revocation_blocktime)
+                self.__update_progress__(mined=not was_mined)
+                self.__journal_record__(certificate,
+                                        "Cert revocation blockheight",
+                                        "Cert revocation blocktime",
+                                        "Cert revocation block timestamp ns",
+                                        "Cert revocation block monotonic ns")
+                logging.info("Revocation transactions for `{}` confirmed in blockchain".format(certificate.dns_name))
                 logging.error(
-                    "BLOCK_TX:`{0}` was already revoked via `{1}`, skipping".format(cert_dns_name,
-                                                                           self.certificates[cert_dns_name]["Cert revocation type"]))
+                    "BLOCK_TX:`{0}` was already revoked via `{1}`, skipping".format(certificate.dns_name,
+                                                                           certificate.revocation_type))
                 
         except Exception as E:
             logging.exception(E)
+
+    def rollback_blockchain_revocations(self, fork_height):
+        """Forgets everything witnessed in blocks above `fork_height`
+
+        Called after a chain reorganisation orphaned those blocks.  A
+        certificate whose revocation was first witnessed in an orphaned
+        block is marked as not revoked again.
+
+        """
+        for cert_dns_name in self.__select__(lambda columns: columns.get_column("revocation_blockheight") > fork_height,
+                                             lambda certificate: (certificate.revocation_blockheight is not None
+                                                                  and certificate.revocation_blockheight > fork_height)):
+            certificate = self.certificates[cert_dns_name]
+            blockheight = certificate.revocation_blockheight
+            self.__count_record__(certificate, -1)
+            certificate.revocation_blockheight = None
+            certificate.revocation_blocktime = None
+            certificate.revocation_block_timestamp_ns = None
+            certificate.revocation_block_monotonic_ns = None
+            if certificate.revocation_type == "blockchain":
+                certificate.revocation_type = None
+                certificate.revocation_timestamp = None
+                certificate.revocation_timestamp_ns = None
+                certificate.revocation_monotonic_ns = None
+                certificate.revocation_fees = None
+                certificate.revocation_funds = None
+            self.__count_record__(certificate, 1)
+            self.__journal_record__(certificate,
+                                    "Cert revocation timestamp",
+                                    "Cert revocation timestamp ns",
+                                    "Cert revocation monotonic ns",
+                                    "Cert revocation type",
+                                    "Cert revocation fees",
+                                    "Cert revocation funds",
+                                    "Cert revocation blockheight",
+                                    "Cert revocation blocktime",
+                                    "Cert revocation block timestamp ns",
+                                    "Cert revocation block monotonic ns")
+            logging.info("Revocation of `{0}` at block `{1}` rolled back after a reorg".format(certificate.dns_name, blockheight))
@@ -5,81 +5,298 @@ import generate_certificate as GC
 import revocation_logger as RL
 import revoke_certificate as RC
 import blockvoke_parser as BP
-import sys, argparse
+import blockvoke_zmq as BZ
+import block_scanner as BS
+import blockvoke_async as BA
+import presigned_revocations as PR
+import co_keystore as CK
+import certificate_metadata as CM
+import rpc_metrics as RM
+import sys, os, argparse
+import http.client
 import tqdm
 import threading
 import time
+import asyncio
+import concurrent.futures
 from decimal import Decimal
 
 TEST_LOGGER_CSV_FILE = "./working_dir/test_logs/TEST_{}.csv"
+TEST_LOGGER_JOURNAL_FILE = "./working_dir/test_logs/TEST_{}.journal"
+TEST_LOGGER_COLUMNS_FILE = "./working_dir/test_logs/TEST_{}" + RL.COLUMNS_LOG_SUFFIX
 
 rev_logger_mutex = threading.Lock()
 rev_logger = RL.RevocationLogger()
 testid = None
+test_log_path = None
+presigned_store = None
+co_keystore = None
+certificate_index = None
+# Thread of the logger updates of the asyncio mode, see `run_logger_update`
+rev_logger_executor = None
 
 revoked=False
 confirmed=False
 
-def is_revoked(rlog) -> bool:
-    return (rlog["Cert revocation type"] != "")
+def log_mempool_revocations(new_revocations):
+    global rev_logger_mutex, rev_logger, revoked, test_log_path
 
-def is_mined(rlog) -> bool:
-    return (rlog["Cert revocation blocktime"] != "")
+    rev_logger_mutex.acquire()
+    print("Parsing {} revocation transactions in mempool".format(len(new_revocations)))
+
+    for new_revocation in new_revocations:
+        rev_logger.cert_revoked_from_mempool(new_revocation,"", "")
+
+    if(rev_logger.all_revoked.is_set()):
+        revoked = True
+        rev_logger.compact(test_log_path)
+    rev_logger_mutex.release()
+
+def log_mined_revocations(new_revocations, blockh, blocktime):
+    global rev_logger_mutex, rev_logger, revoked, confirmed, test_log_path
+
+    rev_logger_mutex.acquire()
+    for new_revocation in new_revocations:
+        rev_logger.cert_revoked_from_blockchain(new_revocation,
+                                                "",
+                                                "",
+                                                blockh,
+                                                blocktime)
+    if(rev_logger.all_mined.is_set()):
+        confirmed = True
+        revoked = True
+        rev_logger.compact(test_log_path)
+    rev_logger_mutex.release()
+
+def log_scanned_block(blockh, raw_block, header):
+    print("Parsing transactions in block {}".format(blockh))
+    log_mined_revocations(BP.get_revocations_from_raw_block(raw_block), blockh, header.time)
+
+def rollback_mined_revocations(fork_height):
+    global rev_logger_mutex, rev_logger
+
+    rev_logger_mutex.acquire()
+    rev_logger.rollback_blockchain_revocations(fork_height)
+    rev_logger_mutex.release()
 
 def communicate_revocation_transactions_from_mempool(rpcconnect):
-    global rev_logger_mutex, rev_logger, revoked, testid
+    global revoked
 
+    mempool_tracker = BP.MempoolTracker(rpcconnect)
     while(not revoked):
-        new_revocations = BP.get_revocations(BP.get_tx_list_in_mempool(rpcconnect))
+        new_revocations = BP.get_revocations(mempool_tracker.poll())
         if new_revocations:
-            rev_logger_mutex.acquire()
-            print("Parsing {} revocation transactions in mempool".format(len(new_revocations)))
-        else:
-            continue
-
-        for new_revocation in new_revocations:
-            rev_logger.cert_revoked_from_mempool(new_revocation,"", "")
-
-        if(all([is_revoked(rlog) for dns, rlog in rev_logger.certificates.items()])):
-            revoked = True
-            rev_logger.write(TEST_LOGGER_CSV_FILE.format(testid))
-        rev_logger_mutex.release()
-        time.sleep(1)
+            log_mempool_revocations(new_revocations)
+        mempool_tracker.wait()
         
 def communicate_mined_revocation_transactions(block_height, rpcconnect):
-    global rev_logger_mutex, rev_logger, confirmed, testid
+    global confirmed
 
-    bh = block_height
+    block_scanner = BS.BlockScanner(block_height,
+                                    log_scanned_block,
+                                    rollback_mined_revocations,
+                                    rpcconnect)
     while(not confirmed):
-        btd = BBR.get_bitcoind_connection(rpcconnect=rpcconnect)
-        current_bh = btd.getblockchaininfo()["blocks"]
-        if current_bh > bh:
-            print("Parsing transactions in blocks {}".format(list(range(bh, current_bh))))
-            rev_logger_mutex.acquire()
-            for blockh in range(bh, current_bh+1):
-                blocktime = btd.getblock(btd.getblockhash(blockh))["time"]
-                new_revocations = BP.get_revocations(BP.get_tx_list_in_blockrange([blockh]))
-                if new_revocations:
-                    for new_revocation in new_revocations:
-                        rev_logger.cert_revoked_from_blockchain(new_revocation,
-                                                                "",
-                                                                "",
-                                                                blockh,
-                                                                blocktime)
-            if(all([is_mined(rlog) for dns, rlog in rev_logger.certificates.items()])):
-                confirmed = True
-                revoked = True
-                rev_logger.write(TEST_LOGGER_CSV_FILE.format(testid))
-            rev_logger_mutex.release()
-            bh = current_bh
+        block_scanner.scan()
         time.sleep(5)
-       
+
+def communicate_revocation_transactions_from_zmq(zmq_endpoints, block_height, rpcconnect):
+    """Logs revocations as bitcoind publishes them over ZMQ
+
+    Blocks mined before the subscription started, and any notifications
+    dropped by ZMQ, are picked up by polling.
+
+    """
+    global revoked, confirmed
+
+    mempool_tracker = BP.MempoolTracker(rpcconnect)
+    block_scanner = BS.BlockScanner(block_height,
+                                    log_scanned_block,
+                                    rollback_mined_revocations,
+                                    rpcconnect)
+
+    def on_missed_notifications(topic):
+        print("Missed ZMQ `{}` notifications, polling bitcoind".format(topic))
+        # A missed mempool "A" leaves its revocation to the mempool poll too
+        if topic in ("rawtx", "sequence"):
+            new_revocations = BP.get_revocations(mempool_tracker.poll())
+            if new_revocations:
+                log_mempool_revocations(new_revocations)
+        elif topic == "rawblock":
+            block_scanner.scan()
+
+    subscriber = BZ.BlockVokeZMQSubscriber(zmq_endpoints,
+                                           log_mempool_revocations,
+                                           block_scanner.add_next_block,
+                                           on_missed_notifications,
+                                           lambda blockhash: block_scanner.scan())
+    try:
+        # Revocations sent before the subscription are only visible by polling
+        on_missed_notifications("rawtx")
+        on_missed_notifications("rawblock")
+        subscriber.run(lambda: revoked and confirmed)
+    finally:
+        subscriber.close()
+
+def send_revocation(DNS):
+    """Broadcasts the presigned revocation of `DNS` if there is a valid
+    one, or builds and sends it
+
+    """
+    if presigned_store is not None:
+        try:
+            txids = PR.send_presigned_revocation(presigned_store, DNS, 0)
+            if txids is not None:
+                return txids
+        except PR.TxFundRejected as E:
+            print("Presigned TX:Fund of `{0}` rejected ({1}), signing a new pair".format(DNS, E))
+            presigned_store.remove(DNS, 0)
+        except PR.TxRevokeRejected as E:
+            # The TX:Fund is out, a new pair would conflict with it
+            print("Presigned TX:Revoke of `{0}` rejected ({1})".format(DNS, E))
+            return presigned_store.get(DNS, 0).txfund_txid, None
+        except (BBR.JSONRPCException, OSError, http.client.HTTPException) as E:
+            print("Presigned revocation of `{0}` could not be sent ({1})".format(DNS, E))
+            return None, None
+
+    return RC.revoke_certificate(DNS, 0, send=True, co_keystore=co_keystore, certificate_index=certificate_index)
+
+async def send_revocation_async(DNS):
+    if presigned_store is not None:
+        try:
+            txids = await PR.async_send_presigned_revocation(presigned_store, DNS, 0)
+            if txids is not None:
+                return txids
+        except PR.TxFundRejected as E:
+            print("Presigned TX:Fund of `{0}` rejected ({1}), signing a new pair".format(DNS, E))
+            presigned_store.remove(DNS, 0)
+        except PR.TxRevokeRejected as E:
+            # The TX:Fund is out, a new pair would conflict with it
+            print("Presigned TX:Revoke of `{0}` rejected ({1})".format(DNS, E))
+            return presigned_store.get(DNS, 0).txfund_txid, None
+        except (BBR.JSONRPCException, OSError, http.client.HTTPException) as E:
+            print("Presigned revocation of `{0}` could not be sent ({1})".format(DNS, E))
+            return None, None
+
+    return await RC.async_revoke_certificate(DNS, 0, send=True, co_keystore=co_keystore, certificate_index=certificate_index)
+
+async def run_logger_update(function, *args):
+    """Runs a logger update on the logger thread
+
+    The updates wait for `rev_logger_mutex` and may compact the whole
+    log, which would stall every request in flight if it ran on the
+    event loop.  The single thread keeps the updates in order.
+
+    """
+    return await asyncio.get_running_loop().run_in_executor(rev_logger_executor, function, *args)
+
+async def watch_mempool_async(rpcconnect):
+    global revoked
+
+    mempool_tracker = BA.AsyncMempoolTracker(rpcconnect)
+    while(not revoked):
+        new_revocations = BP.get_revocations(await mempool_tracker.poll())
+        if new_revocations:
+            await run_logger_update(log_mempool_revocations, new_revocations)
+        await mempool_tracker.wait()
+
+async def watch_blocks_async(block_height, rpcconnect):
+    global confirmed
+
+    # Queued on the logger thread in order, the scanner does not wait for them
+    block_scanner = BA.AsyncBlockScanner(block_height,
+                                         lambda height, raw_block, header: rev_logger_executor.submit(log_scanned_block, height, raw_block, header),
+                                         lambda fork_height: rev_logger_executor.submit(rollback_mined_revocations, fork_height),
+                                         rpcconnect)
+    while(not confirmed):
+        await block_scanner.scan()
+        await asyncio.sleep(5)
+
+async def send_revocations_async(DNS_names, concurrency):
+    """Sends the revocations of `DNS_names`, `concurrency` certificates at a time
+
+    """
+    global rev_logger
+
+    semaphore = asyncio.Semaphore(concurrency)
+    bar_sent = tqdm.tqdm(total=len(DNS_names), desc="Revocations Sent")
+
+    async def send_revocation(DNS):
+        async with semaphore:
+            txids = await send_revocation_async(DNS)
+        await run_logger_update(rev_logger.tx_pair_sent, DNS, txids[0], txids[1])
+        bar_sent.update(1)
+
+    await asyncio.gather(*[send_revocation(DNS) for DNS in DNS_names])
+    bar_sent.close()
+
+async def report_progress_async():
+    global rev_logger, revoked, confirmed
+
+    num_revoked = 0
+    num_confirmed = 0
+    bar_revoked = tqdm.tqdm(total=len(rev_logger.certificates),
+                           desc="Certificates Revoked")
+    bar_confirmed = tqdm.tqdm(total=len(rev_logger.certificates),
+                              desc="Revocation Transactions Confirmed")
+
+    while(not (revoked and confirmed)):
+        await asyncio.sleep(2)
+        num_sent, total_revoked, total_confirmed = rev_logger.get_progress()
+        bar_revoked.update(total_revoked - num_revoked)
+        num_revoked = total_revoked
+        bar_confirmed.update(total_confirmed - num_confirmed)
+        num_confirmed = total_confirmed
+
+async def revoke_and_watch_async(DNS_names, block_height, rpcconnect, zmq_endpoints, concurrency):
+    """Sends the revocations and watches for them from one event loop
+
+    The ZMQ subscriber blocks on its socket, so it keeps its own thread.
+
+    """
+    global rev_logger_executor
+
+    rev_logger_executor = concurrent.futures.ThreadPoolExecutor(1)
+    if zmq_endpoints:
+        watchers = [asyncio.get_running_loop().run_in_executor(None,
+                                                               communicate_revocation_transactions_from_zmq,
+                                                               zmq_endpoints,
+                                                               block_height,
+                                                               rpcconnect)]
+    else:
+        watchers = [watch_mempool_async(rpcconnect),
+                    watch_blocks_async(block_height, rpcconnect)]
+
+    try:
+        await asyncio.gather(send_revocations_async(DNS_names, concurrency),
+                             report_progress_async(),
+                             *watchers)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, rev_logger_executor.shutdown)
+        BA.close_async_bitcoind_connections()
+
 def main(tid,
          block_height,
-         rpcconnect):
-    global rev_logger_mutex, rev_logger, revoked, confirmed, testid
+         rpcconnect,
+         zmq_endpoints=None,
+         columns=False,
+         concurrency=None,
+         presigned_store_path=None,
+         keystore_file_path=None):
+    global rev_logger_mutex, rev_logger, revoked, confirmed, testid, test_log_path, presigned_store, co_keystore, certificate_index
     testid = tid
-    rev_logger.read(TEST_LOGGER_CSV_FILE.format(testid))
+    # Filled by generate-test-certificates.py, certificates missing from it are read from their PEM files
+    certificate_index = CM.CertificateMetadataIndex()
+    if presigned_store_path is not None:
+        presigned_store = PR.PresignedRevocationStore(presigned_store_path)
+    if keystore_file_path is not None:
+        co_keystore = CK.COKeystore(keystore_file_path)
+    test_log_path = TEST_LOGGER_COLUMNS_FILE.format(testid) if columns else TEST_LOGGER_CSV_FILE.format(testid)
+    # Reads the CSV log instead if it is newer, e.g. on the first run on the binary log, converted below
+    rev_logger.read(test_log_path, TEST_LOGGER_JOURNAL_FILE.format(testid))
+    rev_logger.open_journal(TEST_LOGGER_JOURNAL_FILE.format(testid), test_log_path)
+    if not os.path.exists(test_log_path):
+        rev_logger.compact(test_log_path)
 
     num_revoked = 0
     num_confirmed = 0
@@ -89,22 +306,36 @@ def main(tid,
 
     block_height = current_bh if block_height is None else block_height
     
-    t1 = threading.Thread(target=communicate_revocation_transactions_from_mempool, args=(rpcconnect,)).start()
-    t2 = threading.Thread(target=communicate_mined_revocation_transactions, args=(block_height, rpcconnect)).start()
+    if zmq_endpoints and BZ.zmq is None:
+        print("pyzmq is not installed, polling bitcoind for revocations instead")
+        zmq_endpoints = None
 
-    print("Sending revocation transactions for {} certificates".format(len(rev_logger.certificates)))
+    # Selected from the columns of a binary log, without building a record per certificate
+    DNS_names = rev_logger.get_unsent_dns_names()
+    num_sent = rev_logger.get_progress()[0]
+    if num_sent:
+        print("{} certificates were already revoked".format(num_sent))
+    if len(rev_logger.certificates) - num_sent - len(DNS_names):
+        print("{} certificates have not been funded yet".format(len(rev_logger.certificates) - num_sent - len(DNS_names)))
 
-    for DNS, cert_log in tqdm.tqdm(rev_logger.certificates.items()):
-        if(cert_log["TX_Pair sent timestamp"] != ""):
-            print("{0} was already revoked at {1}".format(DNS,
-                                                          cert_log["TX_Pair sent timestamp"]))
-            continue
+    if concurrency:
+        print("Sending revocation transactions for {} certificates".format(len(DNS_names)))
+        asyncio.run(revoke_and_watch_async(DNS_names, block_height, rpcconnect, zmq_endpoints, concurrency))
 
-        if(cert_log["CO_funded"] == "False"):
-            print("{} has not been funded yet".format(DNS))
-            continue
+        print("All Certificates revoked and Transactions confirmed successfully")
+        rev_logger.close_journal()
+        return
 
-        txids = RC.revoke_certificate(DNS, 0, send=True) 
+    if zmq_endpoints:
+        t1 = threading.Thread(target=communicate_revocation_transactions_from_zmq, args=(zmq_endpoints, block_height, rpcconnect)).start()
+    else:
+        t1 = threading.Thread(target=communicate_revocation_transactions_from_mempool, args=(rpcconnect,)).start()
+        t2 = threading.Thread(target=communicate_mined_revocation_transactions, args=(block_height, rpcconnect)).start()
+
+    print("Sending revocation transactions for {} certificates".format(len(DNS_names)))
+
+    for DNS in tqdm.tqdm(DNS_names):
+        txids = send_revocation(DNS)
         rev_logger.tx_pair_sent(DNS, txids[0], txids[1])
 
     bar_revoked = tqdm.tqdm(total=len(rev_logger.certificates),
@@ -114,9 +345,7 @@ def main(tid,
     
     while(not (revoked and confirmed)):
         time.sleep(2)
-        rev_logger_mutex.acquire()
-        total_revoked =[is_revoked(rlog) for dns, rlog in rev_logger.certificates.items()].count(True)
-        total_confirmed =[is_mined(rlog) for dns, rlog in rev_logger.certificates.items()].count(True)
+        num_sent, total_revoked, total_confirmed = rev_logger.get_progress()
         if ((total_revoked > num_revoked) # and (not revoked)
             ):
             bar_revoked.update(total_revoked - num_revoked)
@@ -128,10 +357,9 @@ def main(tid,
             num_confirmed = total_confirmed
         # else:
         #     print(bar_confirmed)
-
-        rev_logger_mutex.release()
             
     print("All Certificates revoked and Transactions confirmed successfully")
+    rev_logger.close_journal()
 
     # rev_logger_mutex.release()
     # while(not confirmed):
@@ -145,5 +373,14 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--testid", type=str, help="Test identifier", required=True)
     parser.add_argument("-b", "--block-height", type=int, help="Block Height after which the blocks are parsed for Revocation Trasactions. (Only blocks above BLOCK_HEIGHT will be parsed)", required=False)
     parser.add_argument("-r", "--rpcconnect", type=str, help="Alternate rpcconnect ip address for fetching mempool transactions and newly mined blocks")
+    parser.add_argument("-z", "--zmq", type=str, action="append", help="bitcoind ZMQ endpoint publishing rawtx, rawblock and sequence notifications (can be repeated). Revocations are polled for if not given")
+    parser.add_argument("-c", "--columns", action="store_true", help="Keep the test log in the binary columnar format (TEST_<id>{}) instead of CSV".format(RL.COLUMNS_LOG_SUFFIX))
+    parser.add_argument("-a", "--asyncio", type=int, metavar="CONCURRENCY", help="Send up to CONCURRENCY revocations at a time from an asyncio event loop, which also runs the mempool and block watchers")
+    parser.add_argument("-p", "--presigned", type=str, nargs="?", const=PR.PRESIGNED_REVOCATIONS_FILE, help="Broadcast the revocations signed ahead of time by presign-test-revocations.py, from this store (default: %(const)s)")
+    parser.add_argument("-k", "--keystore", type=str, nargs="?", const=CK.CO_KEYSTORE_FILE, help="Sign with the CO keys of this keystore (default: %(const)s), for certificates generated with `generate-test-certificates.py -k`")
+    parser.add_argument("-m", "--rpc-metrics", type=str, help="Also write the per-method RPC metrics to this file, as JSON if it ends in .json and as Prometheus text otherwise")
     args = parser.parse_args()
-    main(args.testid, args.block_height, args.rpcconnect)
+    try:
+        main(args.testid, args.block_height, args.rpcconnect, args.zmq, args.columns, args.asyncio, args.presigned, args.keystore)
+    finally:
+        RM.report(args.rpc_metrics)
@@ -1,12 +1,20 @@
 # Python lib to revoke a `BlockVoke` certificate (as CO)
 
 import os
+import asyncio
 from pprint import pprint
-from datetime import datetime
 import traceback
 from decimal import Decimal
 from cryptography.x509 import load_pem_x509_certificate, ObjectIdentifier, SubjectAlternativeName, DNSName
-from blockvoke_bitcoin_rpc import get_bitcoind_connection, get_bitcoin_from_faucet
+from blockvoke_bitcoin_rpc import get_bitcoin_from_faucet, get_wallet_session_cache
+from blockvoke_async import acquire_wallet, release_wallet
+from bitcoin_serialization import Transaction, TransactionInput, TransactionOutput, serialize_transaction
+import bitcoin_transactions as BT
+import blockvoke_codec as BC
+
+# Value of the multisig output of TX:Fund, and the fee TX:Revoke pays out of it
+TXFUND_AMOUNT = Decimal("0.00000477")
+TXREVOKE_FEE = Decimal("0.00000170")
 
 def create_txfund_transaction(bitcoind_rpcproxy_connection, coaddress, cert_multisig):
     # co_unspent = bitcoind_rpcproxy_connection.listunspent()[0]
@@ -18,7 +26,7 @@ def create_txfund_transaction(bitcoind_rpcproxy_connection, coaddress, cert_mult
         # }
         # Since fundrawtransaction will add the coaddress automatically
          ],
-        {cert_multisig["address"]:Decimal("0.00000477")})
+        {cert_multisig["address"]:TXFUND_AMOUNT})
 
     funded_txfund_transaction = bitcoind_rpcproxy_connection.fundrawtransaction(
         txfund_transaction,
@@ -38,15 +46,16 @@ def create_OP_RETURN_script(BlockVokeCertificate, revocationCode) -> str:
     
     Assumes that the CO is revoking
     """
-    blockvoke_identifier = "BlockVoke".encode().hex() + "00"
-
-    certificate_fingerprint = BlockVokeCertificate.fingerprint(BlockVokeCertificate.signature_hash_algorithm).hex()[:32]
+    return get_OP_RETURN_script(BlockVokeCertificate.fingerprint(BlockVokeCertificate.signature_hash_algorithm).hex(),
+                                BC.get_days_since_epoch(BlockVokeCertificate.not_valid_before),
+                                revocationCode)
 
-    certificate_days_since = format((BlockVokeCertificate.not_valid_before - datetime(2020, 2, 2)).days, '08x')
+def get_OP_RETURN_script(certificate_fingerprint, not_valid_before_days, revocationCode) -> str:
+    """`create_OP_RETURN_script` from the certificate's fingerprint (hex)
+    and its `not_valid_before` in days since 2020-02-02
 
-    revocationCode_hex = format(revocationCode, "02x")
-
-    return blockvoke_identifier + certificate_fingerprint + certificate_days_since + revocationCode_hex
+    """
+    return BC.encode_payload(certificate_fingerprint, not_valid_before_days, revocationCode).hex()
 
 def create_txrevoke_transaction(bitcoind_rpcproxy_connection,
                                 coaddress,
@@ -83,7 +92,7 @@ def create_txrevoke_transaction(bitcoind_rpcproxy_connection,
             "scriptPubKey":decoded_txfund_transaction["vout"][0]["scriptPubKey"]["hex"],
             "redeemScript":cert_multisig["redeemScript"]
         }],
-        {coaddress:decoded_txfund_transaction["vout"][0]["value"]-Decimal("0.00000170"),
+        {coaddress:decoded_txfund_transaction["vout"][0]["value"]-TXREVOKE_FEE,
          "data":OP_RETURN})
 
     signed_txrevoke_transaction = bitcoind_rpcproxy_connection.signrawtransactionwithkey(
@@ -115,17 +124,13 @@ def create_revocation_transactions(bitcoind_rpcproxy_connection,
 
     return txfund_transaction, txrevoke_transaction
 
-def revoke_certificate(DNS,
-                       revocationCode,
-                       working_dir="./working_dir",
-                       bitcoin_wallet=None,
-                       send=False):
+def load_blockvoke_certificate(DNS, working_dir="./working_dir"):
+    """Reads the certificate of `DNS`
 
-    """Revoke a certificate using the BlockVoke protocol
+    Returns the certificate, its multisig address and the CA's pubkey
+    (hex, as bytes) stored in the BlockVoke extensions.
 
     """
-
-    BlockVokeCertificate = None
     with open(os.path.join(working_dir,
                            "certificates",
                            "{}-cert.pem".format(DNS)), "rb") as certificate_file:
@@ -135,52 +140,330 @@ def revoke_certificate(DNS,
     cert_multisig_address = BlockVokeCertificate.extensions.get_extension_for_oid(ObjectIdentifier("1.2.3.4")).value.value # Temporary BlockVoke ObjectIdentifier
     ca_address_pubkey_hex = BlockVokeCertificate.extensions.get_extension_for_oid(ObjectIdentifier("1.2.3.5")).value.value # Temporary CA Bitcoin Address Pubkey ObjectIdentifier
 
+    return BlockVokeCertificate, cert_multisig_address, ca_address_pubkey_hex
+
+def get_blockvoke_certificate_metadata(DNS, working_dir="./working_dir", certificate_index=None):
+    """Returns what revoking `DNS` needs from its certificate: the
+    multisig address and the CA's pubkey as `load_blockvoke_certificate`
+    does, the fingerprint (hex), `not_valid_before` in days since
+    2020-02-02 and the multisig redeemScript
+
+    They come from `certificate_index` (a
+    `certificate_metadata.CertificateMetadataIndex`) when the certificate
+    is indexed, and the redeemScript is None otherwise.
+
+    """
+    cert_metadata = certificate_index.get(DNS, working_dir) if certificate_index is not None else None
+    if cert_metadata is not None:
+        return (cert_metadata.multisig_address.encode(),
+                cert_metadata.ca_pubkey.encode(),
+                cert_metadata.fingerprint,
+                cert_metadata.not_valid_before_days,
+                cert_metadata.redeemScript)
+
+    BlockVokeCertificate, cert_multisig_address, ca_address_pubkey_hex = load_blockvoke_certificate(DNS, working_dir)
+
+    return (cert_multisig_address,
+            ca_address_pubkey_hex,
+            BlockVokeCertificate.fingerprint(BlockVokeCertificate.signature_hash_algorithm).hex(),
+            BC.get_days_since_epoch(BlockVokeCertificate.not_valid_before),
+            None)
+
+def get_multisig_pubkeys(co_address_pubkey_hex, ca_address_pubkey_hex):
+    """Orders the CO and CA pubkeys the way the certificate's multisig
+    address was created
+
+    """
+    pubkey1, pubkey2 = co_address_pubkey_hex, ca_address_pubkey_hex.decode()
+
+    if co_address_pubkey_hex.encode() < ca_address_pubkey_hex:
+        pubkey2, pubkey1 = co_address_pubkey_hex, ca_address_pubkey_hex.decode()
+
+    return [pubkey1, pubkey2]
+
+def create_local_revocation_transactions(cert_multisig_address,
+                                         ca_address_pubkey_hex,
+                                         coaddress_info,
+                                         coaddress_privkey,
+                                         utxos,
+                                         OP_RETURN,
+                                         cert_multisig_redeemScript=None):
+    """Builds and signs TX:Fund and TX:Revoke without bitcoind
+
+    `coaddress_info` and `coaddress_privkey` are the `getaddressinfo` and
+    `dumpprivkey` results of the CO address, and `utxos` the wallet's
+    `listunspent`.  TX:Fund is funded at 1 sat/vB with the change going
+    back to the CO address, as `fundrawtransaction` would.  Returns both
+    transactions in the form `signrawtransactionwithkey` does, with their
+    txids.  The multisig redeemScript (hex) is rebuilt unless given.
+
+    """
+    private_key, co_pubkey = BT.get_private_key(coaddress_privkey)
+    co_scriptPubKey = bytes.fromhex(coaddress_info["scriptPubKey"])
+
+    if cert_multisig_redeemScript is None:
+        cert_multisig_redeemScript = BT.get_multisig_redeemScript(
+            1,
+            [bytes.fromhex(pubkey) for pubkey in get_multisig_pubkeys(co_pubkey.hex(), ca_address_pubkey_hex)])
+    else:
+        cert_multisig_redeemScript = bytes.fromhex(cert_multisig_redeemScript)
+
+    if BT.b58decode_check(cert_multisig_address)[1:] != BT.hash160(cert_multisig_redeemScript):
+        raise Exception("Error: Generated Multisig address '{0}' != '{1}'".format(
+            cert_multisig_address,
+            BT.get_p2sh_address(cert_multisig_redeemScript, BT.b58decode_check(cert_multisig_address)[0])))
+    cert_multisig_scriptPubKey = BT.get_p2sh_scriptPubKey(cert_multisig_redeemScript)
+
+    txfund_transaction, prevouts = BT.fund_transaction(
+        [TransactionOutput(BT.to_satoshis(TXFUND_AMOUNT), cert_multisig_scriptPubKey)],
+        utxos,
+        co_scriptPubKey,
+        private_key,
+        co_pubkey)
+    txfund_transaction = BT.sign_transaction(txfund_transaction, private_key, co_pubkey, prevouts)
+
+    txrevoke_transaction = Transaction(
+        None,
+        BT.TX_VERSION,
+        [TransactionInput(txfund_transaction.txid, 0, b"", BT.SEQUENCE_RBF, [])],
+        [TransactionOutput(BT.to_satoshis(TXFUND_AMOUNT - TXREVOKE_FEE), co_scriptPubKey),
+         TransactionOutput(0, BT.get_nulldata_scriptPubKey(bytes.fromhex(OP_RETURN)))],
+        0)
+    txrevoke_transaction = BT.sign_transaction(txrevoke_transaction,
+                                               private_key,
+                                               co_pubkey,
+                                               [(cert_multisig_scriptPubKey,
+                                                 BT.to_satoshis(TXFUND_AMOUNT),
+                                                 cert_multisig_redeemScript)])
+
+    return tuple({"hex":serialize_transaction(tx).hex(),
+                  "txid":tx.txid,
+                  "complete":True} for tx in (txfund_transaction, txrevoke_transaction))
+
+def revoke_certificate(DNS,
+                       revocationCode,
+                       working_dir="./working_dir",
+                       bitcoin_wallet=None,
+                       send=False,
+                       sign_locally=True,
+                       co_keystore=None,
+                       certificate_index=None):
+
+    """Revoke a certificate using the BlockVoke protocol
+
+    With `sign_locally` the transactions are built and signed in process
+    and bitcoind is only asked for the CO key, the UTXOs and the
+    broadcast.  Otherwise bitcoind builds and signs them.  Certificates
+    indexed in `certificate_index` are not read from their PEM file.
+
+    """
+
+    (cert_multisig_address,
+     ca_address_pubkey_hex,
+     certificate_fingerprint,
+     not_valid_before_days,
+     cert_multisig_redeemScript) = get_blockvoke_certificate_metadata(DNS, working_dir, certificate_index)
+
     # print("Certificate Multisignature address: ", cert_multisig_address)
     # print("CA Address Pubkey: ", ca_address_pubkey_hex)
 
-    if bitcoin_wallet==None:
+    if co_keystore is not None:
+        bitcoin_wallet = co_keystore.bitcoin_wallet
+    elif bitcoin_wallet==None:
         bitcoin_wallet=DNS
 
-    btd = get_bitcoind_connection(bitcoin_wallet)
-    btd.loadwallet(bitcoin_wallet)
+    wallet_session_cache = get_wallet_session_cache()
+    btd = wallet_session_cache.acquire(bitcoin_wallet)
 
     txids = (None, None)
     txfund_transaction, txrevoke_transaction = None, None
 
     try:
-        coaddress = list(btd.getaddressesbylabel("{}-coaddress".format(DNS)).keys())[0]
+        coaddress = (co_keystore.get_address(DNS) if co_keystore is not None
+                     else list(btd.getaddressesbylabel("{}-coaddress".format(DNS)).keys())[0])
+
+        OP_RETURN = get_OP_RETURN_script(certificate_fingerprint, not_valid_before_days, revocationCode)
+
+        if sign_locally:
+            coaddress_info, coaddress_privkey, utxos = btd.batch_([["getaddressinfo", coaddress],
+                                                                   ["dumpprivkey", coaddress],
+                                                                   ["listunspent", 0, 9999999, [coaddress]]])
+
+            txfund_transaction, txrevoke_transaction = create_local_revocation_transactions(
+                cert_multisig_address.decode(),
+                ca_address_pubkey_hex,
+                coaddress_info,
+                coaddress_privkey,
+                utxos,
+                OP_RETURN,
+                cert_multisig_redeemScript)
+
+            if send:
+                # bitcoind runs the calls of a batch in order, so TX:Fund is in the mempool before TX:Revoke
+                txids = tuple(btd.batch_([["sendrawtransaction", txfund_transaction["hex"]],
+                                          ["sendrawtransaction", txrevoke_transaction["hex"]]]))
+        else:
+            if cert_multisig_redeemScript is not None:
+                # Checked against the certificate when it was indexed
+                cert_multisig = {"address":cert_multisig_address.decode(),
+                                 "redeemScript":cert_multisig_redeemScript}
+            else:
+                coaddress_info = btd.getaddressinfo(coaddress)
+
+                co_address_pubkey_hex = coaddress_info["pubkey"]
+                # print("CO Address Pubkey: ", co_address_pubkey_hex)
+
+                cert_multisig = btd.addmultisigaddress(1, get_multisig_pubkeys(co_address_pubkey_hex, ca_address_pubkey_hex), "legacy")
+
+                if cert_multisig_address.decode() != cert_multisig["address"]:
+                    raise Exception("Error: Generated Multisig address '{0}' != '{1}'".format(cert_multisig_address.decode(), cert_multisig["address"]))
+
+            txfund_transaction, txrevoke_transaction = create_revocation_transactions(
+                btd,
+                coaddress,
+                cert_multisig,
+                OP_RETURN)
+
+            if send:
+                txids = (btd.sendrawtransaction(txfund_transaction["hex"]),
+                         btd.sendrawtransaction(txrevoke_transaction["hex"]))
 
-        coaddress_info = btd.getaddressinfo(coaddress)
+    except Exception as E:
+        print("Unable to Revoke BlockVoke Certificate:")
+        traceback.print_exception(type(E), E, E.__traceback__)
+    finally:
+        wallet_session_cache.release(bitcoin_wallet)
 
-        co_address_pubkey_hex = coaddress_info["pubkey"]
-        # print("CO Address Pubkey: ", co_address_pubkey_hex)
+    return (txids if send else (txfund_transaction, txrevoke_transaction))
 
-        pubkey1, pubkey2 = co_address_pubkey_hex, ca_address_pubkey_hex.decode()
+async def async_create_revocation_transactions(bitcoind_connection,
+                                               coaddress,
+                                               coaddress_privkey,
+                                               cert_multisig,
+                                               OP_RETURN):
+    """Coroutine version of `create_revocation_transactions`
 
-        if co_address_pubkey_hex.encode() < ca_address_pubkey_hex:
-            pubkey2, pubkey1 = co_address_pubkey_hex, ca_address_pubkey_hex.decode()
+    """
+    txfund_transaction = await bitcoind_connection.createrawtransaction(
+        [],
+        {cert_multisig["address"]:TXFUND_AMOUNT})
 
-        cert_multisig = btd.addmultisigaddress(1, [pubkey1, pubkey2], "legacy")
+    funded_txfund_transaction = await bitcoind_connection.fundrawtransaction(
+        txfund_transaction,
+        {
+            "fee_rate":1,
+            "changeAddress":coaddress,
+        })
 
-        if cert_multisig_address.decode() != cert_multisig["address"]:
-            raise Exception("Error: Generated Multisig address '{0}' != '{1}'".format(cert_multisig_address.decode(), cert_multisig["address"]))
+    txfund_transaction = await bitcoind_connection.signrawtransactionwithkey(
+        funded_txfund_transaction["hex"],
+        [coaddress_privkey])
 
-        OP_RETURN = create_OP_RETURN_script(BlockVokeCertificate, revocationCode)
+    decoded_txfund_transaction = await bitcoind_connection.decoderawtransaction(txfund_transaction["hex"])
+    prevtx = {"txid":decoded_txfund_transaction["txid"],
+              "vout":0,
+              "scriptPubKey":decoded_txfund_transaction["vout"][0]["scriptPubKey"]["hex"],
+              "redeemScript":cert_multisig["redeemScript"]}
 
-        txfund_transaction, txrevoke_transaction = create_revocation_transactions(
+    txrevoke_transaction = await bitcoind_connection.createrawtransaction(
+        [prevtx],
+        {coaddress:decoded_txfund_transaction["vout"][0]["value"]-TXREVOKE_FEE,
+         "data":OP_RETURN})
+
+    txrevoke_transaction = await bitcoind_connection.signrawtransactionwithkey(
+        txrevoke_transaction,
+        [coaddress_privkey],
+        [dict(prevtx, amount=decoded_txfund_transaction["vout"][0]["value"])])
+
+    return txfund_transaction, txrevoke_transaction
+
+async def async_revoke_certificate(DNS,
+                                   revocationCode,
+                                   working_dir="./working_dir",
+                                   bitcoin_wallet=None,
+                                   send=False,
+                                   sign_locally=True,
+                                   co_keystore=None,
+                                   certificate_index=None):
+    """Coroutine version of `revoke_certificate`
+
+    The multisig address and the CO's private key are requested
+    concurrently, and many certificates can be revoked at once from one
+    event loop.
+
+    """
+    (cert_multisig_address,
+     ca_address_pubkey_hex,
+     certificate_fingerprint,
+     not_valid_before_days,
+     cert_multisig_redeemScript) = get_blockvoke_certificate_metadata(DNS, working_dir, certificate_index)
+    OP_RETURN = get_OP_RETURN_script(certificate_fingerprint, not_valid_before_days, revocationCode)
+
+    if co_keystore is not None:
+        bitcoin_wallet = co_keystore.bitcoin_wallet
+    elif bitcoin_wallet==None:
+        bitcoin_wallet=DNS
+
+    btd = await acquire_wallet(bitcoin_wallet)
+
+    txids = (None, None)
+    txfund_transaction, txrevoke_transaction = None, None
+
+    try:
+        coaddress = (co_keystore.get_address(DNS) if co_keystore is not None
+                     else list((await btd.getaddressesbylabel("{}-coaddress".format(DNS))).keys())[0])
+
+        if sign_locally:
+            coaddress_info, coaddress_privkey, utxos = await btd.batch_([["getaddressinfo", coaddress],
+                                                                         ["dumpprivkey", coaddress],
+                                                                         ["listunspent", 0, 9999999, [coaddress]]])
+
+            txfund_transaction, txrevoke_transaction = create_local_revocation_transactions(
+                cert_multisig_address.decode(),
+                ca_address_pubkey_hex,
+                coaddress_info,
+                coaddress_privkey,
+                utxos,
+                OP_RETURN,
+                cert_multisig_redeemScript)
+
+            if send:
+                txids = tuple(await btd.batch_([["sendrawtransaction", txfund_transaction["hex"]],
+                                                ["sendrawtransaction", txrevoke_transaction["hex"]]]))
+
+            return (txids if send else (txfund_transaction, txrevoke_transaction))
+
+        if cert_multisig_redeemScript is not None:
+            # Checked against the certificate when it was indexed
+            cert_multisig = {"address":cert_multisig_address.decode(),
+                             "redeemScript":cert_multisig_redeemScript}
+            coaddress_privkey = await btd.dumpprivkey(coaddress)
+        else:
+            coaddress_info = await btd.getaddressinfo(coaddress)
+
+            cert_multisig, coaddress_privkey = await asyncio.gather(
+                btd.addmultisigaddress(1, get_multisig_pubkeys(coaddress_info["pubkey"], ca_address_pubkey_hex), "legacy"),
+                btd.dumpprivkey(coaddress))
+
+            if cert_multisig_address.decode() != cert_multisig["address"]:
+                raise Exception("Error: Generated Multisig address '{0}' != '{1}'".format(cert_multisig_address.decode(), cert_multisig["address"]))
+
+        txfund_transaction, txrevoke_transaction = await async_create_revocation_transactions(
             btd,
             coaddress,
+            coaddress_privkey,
             cert_multisig,
             OP_RETURN)
 
         if send:
-            txids = (btd.sendrawtransaction(txfund_transaction["hex"]),
-                     btd.sendrawtransaction(txrevoke_transaction["hex"]))
+            # The revocation spends the funding transaction, which must reach the mempool first
+            txids = (await btd.sendrawtransaction(txfund_transaction["hex"]),
+                     await btd.sendrawtransaction(txrevoke_transaction["hex"]))
 
     except Exception as E:
         print("Unable to Revoke BlockVoke Certificate:")
         traceback.print_exception(type(E), E, E.__traceback__)
     finally:
-        btd.unloadwallet(bitcoin_wallet)
+        await release_wallet(bitcoin_wallet)
 
     return (txids if send else (txfund_transaction, txrevoke_transaction))
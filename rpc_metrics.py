@@ -0,0 +1,233 @@
+"""Per-method metrics of the JSON-RPC requests to bitcoind
+
+`BitcoindConnection` and `AsyncBitcoindConnection` record every HTTP
+request they make in `RPC_METRICS`: the number of requests and RPC
+calls, the errors, a latency histogram and the request and response
+sizes, per RPC method and wallet.  A JSON-RPC batch is one request of
+its method if all its calls are to the same method, of `batch` if not.
+The metrics can be exported as Prometheus text or as a JSON snapshot,
+and `report` prints a per-method summary at the end of a script.
+
+"""
+
+import time
+import json
+import bisect
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets, requests above the last one go to +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_METHOD = "batch"
+METRICS_PREFIX = "blockvoke_rpc"
+
+class MethodMetrics(object):
+    """Metrics of the requests of one RPC method to one wallet
+
+    """
+    def __init__(self):
+        self.requests = 0
+        self.calls = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def add(self, other):
+        self.requests = self.requests + other.requests
+        self.calls = self.calls + other.calls
+        self.errors = self.errors + other.errors
+        self.latency_sum = self.latency_sum + other.latency_sum
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.latency_buckets = [a + b for a, b in zip(self.latency_buckets, other.latency_buckets)]
+        self.request_bytes = self.request_bytes + other.request_bytes
+        self.response_bytes = self.response_bytes + other.response_bytes
+
+    def get_latency_quantile(self, q) -> float:
+        """Returns the upper bound of the histogram bucket holding the `q`
+        quantile of the latencies, or the maximum latency if it is above
+        the last bucket
+
+        """
+        rank, cumulative = q * self.requests, 0
+        for upper_bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            cumulative = cumulative + count
+            if cumulative >= rank:
+                return min(upper_bound, self.latency_max)
+        return self.latency_max
+
+def get_request_method(payload):
+    """Returns the method and number of calls of a JSON-RPC request
+
+    """
+    if isinstance(payload, dict):
+        return payload["method"], 1
+    methods = set(rpc_call["method"] for rpc_call in payload)
+    return (methods.pop() if len(methods) == 1 else BATCH_METHOD), len(payload)
+
+def get_num_errors(response, num_calls) -> int:
+    """Returns the number of failed calls of a JSON-RPC response, all of
+    them if there is no response
+
+    """
+    if isinstance(response, dict):
+        return num_calls if response.get("error") is not None or "result" not in response else 0
+    if isinstance(response, list):
+        return sum(1 for call_response in response if call_response.get("error") is not None)
+    return num_calls
+
+def __escape_label__(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class RPCMetrics(object):
+    def __init__(self):
+        self.__lock__ = threading.Lock()
+        # (method, wallet name) -> MethodMetrics, the wallet name is "" for node requests
+        self.__metrics__ = {}
+        self.start_time = time.time()
+
+    def record_request(self, payload, wallet_name, latency, request_bytes, response_bytes, response):
+        """Records one HTTP request, `response` being None if it failed
+        without a response
+
+        """
+        method, num_calls = get_request_method(payload)
+        num_errors = get_num_errors(response, num_calls)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+
+        with self.__lock__:
+            key = (method, wallet_name or "")
+            if key not in self.__metrics__:
+                self.__metrics__[key] = MethodMetrics()
+            metrics = self.__metrics__[key]
+            metrics.requests = metrics.requests + 1
+            metrics.calls = metrics.calls + num_calls
+            metrics.errors = metrics.errors + num_errors
+            metrics.latency_sum = metrics.latency_sum + latency
+            metrics.latency_max = max(metrics.latency_max, latency)
+            metrics.latency_buckets[bucket] = metrics.latency_buckets[bucket] + 1
+            metrics.request_bytes = metrics.request_bytes + request_bytes
+            metrics.response_bytes = metrics.response_bytes + response_bytes
+
+    def reset(self):
+        with self.__lock__:
+            self.__metrics__ = {}
+            self.start_time = time.time()
+
+    def get_metrics(self, by_wallet=True):
+        """Returns a copy of the metrics by (method, wallet name), or by
+        method alone unless `by_wallet`
+
+        """
+        with self.__lock__:
+            items = list(self.__metrics__.items())
+
+        metrics = {}
+        for (method, wallet_name), method_metrics in items:
+            key = (method, wallet_name) if by_wallet else method
+            if key not in metrics:
+                metrics[key] = MethodMetrics()
+            metrics[key].add(method_metrics)
+        return metrics
+
+    def snapshot(self) -> dict:
+        return {"start_time": self.start_time,
+                "time": time.time(),
+                "latency_buckets": list(LATENCY_BUCKETS),
+                "methods": [{"method": method,
+                             "wallet": wallet_name,
+                             "requests": metrics.requests,
+                             "calls": metrics.calls,
+                             "errors": metrics.errors,
+                             "latency_sum": metrics.latency_sum,
+                             "latency_max": metrics.latency_max,
+                             "latency_buckets": metrics.latency_buckets,
+                             "request_bytes": metrics.request_bytes,
+                             "response_bytes": metrics.response_bytes}
+                            for (method, wallet_name), metrics in sorted(self.get_metrics().items())]}
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format
+
+        """
+        metrics = sorted(self.get_metrics().items())
+        lines = []
+
+        def add_metric(name, metric_type, help_text, get_value):
+            lines.append("# HELP {0}_{1} {2}".format(METRICS_PREFIX, name, help_text))
+            lines.append("# TYPE {0}_{1} {2}".format(METRICS_PREFIX, name, metric_type))
+            for (method, wallet_name), method_metrics in metrics:
+                lines.append("{0}_{1}{{method=\"{2}\",wallet=\"{3}\"}} {4}".format(METRICS_PREFIX,
+                                                                                   name,
+                                                                                   __escape_label__(method),
+                                                                                   __escape_label__(wallet_name),
+                                                                                   get_value(method_metrics)))
+
+        add_metric("requests_total", "counter", "HTTP requests to bitcoind", lambda m: m.requests)
+        add_metric("calls_total", "counter", "RPC calls to bitcoind, counting every call of a batch", lambda m: m.calls)
+        add_metric("errors_total", "counter", "RPC calls that failed", lambda m: m.errors)
+        add_metric("request_bytes_total", "counter", "Bytes of the JSON-RPC requests", lambda m: m.request_bytes)
+        add_metric("response_bytes_total", "counter", "Bytes of the JSON-RPC responses", lambda m: m.response_bytes)
+
+        lines.append("# HELP {}_latency_seconds Latency of the HTTP requests to bitcoind".format(METRICS_PREFIX))
+        lines.append("# TYPE {}_latency_seconds histogram".format(METRICS_PREFIX))
+        for (method, wallet_name), method_metrics in metrics:
+            labels = "method=\"{0}\",wallet=\"{1}\"".format(__escape_label__(method), __escape_label__(wallet_name))
+            cumulative = 0
+            for upper_bound, count in zip(LATENCY_BUCKETS + ("+Inf",), method_metrics.latency_buckets):
+                cumulative = cumulative + count
+                lines.append("{0}_latency_seconds_bucket{{{1},le=\"{2}\"}} {3}".format(METRICS_PREFIX, labels, upper_bound, cumulative))
+            lines.append("{0}_latency_seconds_sum{{{1}}} {2}".format(METRICS_PREFIX, labels, method_metrics.latency_sum))
+            lines.append("{0}_latency_seconds_count{{{1}}} {2}".format(METRICS_PREFIX, labels, method_metrics.requests))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        """Writes the metrics to `file_path`, as a JSON snapshot if it ends
+        in `.json` and as Prometheus text otherwise
+
+        """
+        with open(file_path, "w") as metrics_file:
+            if file_path.endswith(".json"):
+                json.dump(self.snapshot(), metrics_file, indent=1)
+            else:
+                metrics_file.write(self.to_prometheus())
+
+    def summary(self) -> str:
+        """Returns a table of the metrics by method, the method taking the
+        most time first
+
+        """
+        metrics = sorted(self.get_metrics(by_wallet=False).items(), key=lambda item: item[1].latency_sum, reverse=True)
+        if not metrics:
+            return "No RPC requests to bitcoind"
+
+        lines = ["RPC requests to bitcoind in {:.1f} s:".format(time.time() - self.start_time),
+                 "{:<28}{:>10}{:>10}{:>8}{:>11}{:>10}{:>10}{:>10}{:>12}{:>12}".format(
+                     "method", "calls", "requests", "errors", "total s", "mean ms", "p95 ms", "max ms", "sent kB", "recv kB")]
+        for method, method_metrics in metrics:
+            lines.append("{:<28}{:>10}{:>10}{:>8}{:>11.2f}{:>10.2f}{:>10.1f}{:>10.1f}{:>12.1f}{:>12.1f}".format(
+                method,
+                method_metrics.calls,
+                method_metrics.requests,
+                method_metrics.errors,
+                method_metrics.latency_sum,
+                1000 * method_metrics.latency_sum / method_metrics.requests,
+                1000 * method_metrics.get_latency_quantile(0.95),
+                1000 * method_metrics.latency_max,
+                method_metrics.request_bytes / 1000,
+                method_metrics.response_bytes / 1000))
+        return "\n".join(lines)
+
+RPC_METRICS = RPCMetrics()
+
+def report(metrics_file_path=None):
+    """Prints the summary of `RPC_METRICS`, and writes them to
+    `metrics_file_path` if given, at the end of a script
+
+    """
+    print(RPC_METRICS.summary())
+    if metrics_file_path:
+        RPC_METRICS.write(metrics_file_path)
+        print("RPC metrics written to `{}`".format(metrics_file_path))
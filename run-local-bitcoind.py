@@ -0,0 +1,60 @@
+# This file runs the local bitcoind JSON-RPC stand-in, for load tests of the other scripts without a testnet node
+
+import local_bitcoind as LB
+import local_zmq_publisher as LZ
+import bitcoin_transactions as BT
+import os, sys, argparse, configparser
+
+LOCAL_BITCOIND_CONFIG_FILE = "./working_dir/local-bitcoind.conf"
+
+def write_config(config_file_path, rpcuser, rpcpassword, port):
+    cp = configparser.ConfigParser()
+    cp["rpc"] = {"rpcuser": rpcuser, "rpcpassword": rpcpassword, "rpcport": str(port)}
+
+    os.makedirs(os.path.dirname(os.path.realpath(config_file_path)), exist_ok=True)
+    with open(config_file_path, "w") as config_file:
+        cp.write(config_file)
+
+def main(host, port, rpcuser, rpcpassword, block_interval, seed, config_file_path, initialize, mining_address, require_standard=False,
+         min_relay_fee_rate=LB.MIN_RELAY_FEE_RATE, zmq_endpoint=None):
+    zmq_publisher = LZ.ZMQPublisher(zmq_endpoint) if zmq_endpoint else None
+    node = LB.LocalBitcoind(seed.encode(), require_standard=require_standard, min_relay_fee_rate=min_relay_fee_rate,
+                            zmq_publisher=zmq_publisher)
+
+    if initialize:
+        node.initialize_test_wallets()
+    if mining_address:
+        node.mining_scriptPubKey = BT.get_address_scriptPubKey(mining_address)
+
+    write_config(config_file_path, rpcuser, rpcpassword, port)
+    print("Serving the local bitcoind on {0}:{1} at block `{2}`, point the scripts at it with:".format(host, port, node.get_height()))
+    print("export BLOCKVOKE_BITCOIND_CONF={}".format(os.path.realpath(config_file_path)))
+    if zmq_publisher is not None:
+        print("Publishing the ZMQ notifications on `{}`".format(zmq_publisher.endpoint))
+    sys.stdout.flush()
+
+    try:
+        LB.serve(node, host, port, rpcuser, rpcpassword, block_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if zmq_publisher is not None:
+            zmq_publisher.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an in-memory stand-in for bitcoind's JSON-RPC server")
+    parser.add_argument("-H", "--host", type=str, help="Address to listen on", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, help="RPC port", default=LB.LOCAL_BITCOIND_RPC_PORT)
+    parser.add_argument("-u", "--rpcuser", type=str, help="RPC user", default="blockvoke")
+    parser.add_argument("-P", "--rpcpassword", type=str, help="RPC password", default="blockvoke")
+    parser.add_argument("-b", "--block-interval", type=float, help="Seconds between mined blocks, 0 to only mine on generatetoaddress", default=LB.BLOCK_INTERVAL)
+    parser.add_argument("-s", "--seed", type=str, help="Seed of the wallet keys", default="blockvoke")
+    parser.add_argument("-c", "--config", type=str, help="bitcoin.conf written for the scripts", default=LOCAL_BITCOIND_CONFIG_FILE)
+    parser.add_argument("-i", "--initialize", action="store_true", help="Create the testnetfaucet, miner and ca0 wallets and fund the faucet")
+    parser.add_argument("-m", "--mining-address", type=str, help="Address the blocks pay to (by default the miner wallet with -i, else OP_TRUE)")
+    parser.add_argument("-S", "--require-standard", action="store_true", help="Reject dust outputs and several OP_RETURN outputs, as mainnet's bitcoind does")
+    parser.add_argument("-f", "--min-relay-fee-rate", type=float, help="Minimum relay fee rate in sat/vB", default=LB.MIN_RELAY_FEE_RATE)
+    parser.add_argument("-z", "--zmq", type=str, help="Publish the rawtx, rawblock and sequence ZMQ notifications on this endpoint, e.g. tcp://127.0.0.1:28332 (requires pyzmq)")
+    args = parser.parse_args()
+    main(args.host, args.port, args.rpcuser, args.rpcpassword, args.block_interval, args.seed, args.config, args.initialize, args.mining_address, args.require_standard,
+         args.min_relay_fee_rate, args.zmq)
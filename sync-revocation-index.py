@@ -0,0 +1,41 @@
+# This file syncs the persistent BlockVoke revocation index and looks up the revocation status of certificates
+
+import revocation_index as RI
+import rpc_metrics as RM
+import sys, argparse
+
+def main(index_file_path, start_height, rpcconnect, fingerprints, workers=1):
+    revocation_index = RI.RevocationIndex(index_file_path)
+
+    try:
+        if not fingerprints:
+            num_revocations = revocation_index.sync(start_height, rpcconnect=rpcconnect, workers=workers)
+            print("Indexed `{0}` new revocations up to block `{1}`".format(num_revocations,
+                                                                          revocation_index.get_indexed_height()))
+
+        for fingerprint in fingerprints:
+            revocation = revocation_index.get_revocation(fingerprint)
+            if revocation is None:
+                print("{}: not revoked".format(fingerprint))
+            else:
+                print("{0}: revoked with code `{1}` in transaction `{2}` at block `{3}` ({4})".format(fingerprint,
+                                                                                                   revocation.revocation_code,
+                                                                                                   revocation.txid,
+                                                                                                   revocation.block_height,
+                                                                                                   revocation.block_hash))
+    finally:
+        revocation_index.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the BlockVoke revocation index, or look up certificates in it")
+    parser.add_argument("-d", "--index", type=str, help="Revocation index file", default=RI.REVOCATION_INDEX_FILE)
+    parser.add_argument("-b", "--block-height", type=int, help="Block height to start indexing from if the index is empty", default=0)
+    parser.add_argument("-r", "--rpcconnect", type=str, help="Alternate rpcconnect ip address for fetching blocks")
+    parser.add_argument("-f", "--fingerprint", type=str, action="append", default=[], help="Look up the revocation status of a certificate fingerprint (can be repeated) instead of syncing")
+    parser.add_argument("-w", "--workers", type=int, help="Number of blocks fetched concurrently when catching up", default=1)
+    parser.add_argument("-m", "--rpc-metrics", type=str, help="Also write the per-method RPC metrics to this file, as JSON if it ends in .json and as Prometheus text otherwise")
+    args = parser.parse_args()
+    try:
+        main(args.index, args.block_height, args.rpcconnect, args.fingerprint, args.workers)
+    finally:
+        RM.report(args.rpc_metrics)
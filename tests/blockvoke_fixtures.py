@@ -0,0 +1,102 @@
+"""Synthetic transactions, blocks and chains for the tests
+
+"""
+
+import os
+import struct
+
+import blockvoke_codec as BC
+from bitcoin_serialization import (Transaction, TransactionInput, TransactionOutput,
+                                   dsha256, get_txid, serialize_transaction, serialize_varint)
+from bitcoin_transactions import get_nulldata_scriptPubKey
+from blockvoke_bitcoin_rpc import JSONRPCException
+
+def make_revocation_transaction(fingerprint_16, payload=None):
+    """Returns a serialized transaction revoking `fingerprint_16`, or
+    carrying `payload` in its OP_RETURN instead, and its txid
+
+    """
+    if payload is None:
+        payload = BC.encode_payload(fingerprint_16, 1000, 1)
+    tx = Transaction(None,
+                     2,
+                     [TransactionInput(os.urandom(32).hex(), 0, b"", 0xffffffff, [])],
+                     [TransactionOutput(0, get_nulldata_scriptPubKey(payload))],
+                     0)
+    return serialize_transaction(tx), get_txid(tx)
+
+def make_transaction(outpoints, outputs):
+    """Returns an unsigned serialized transaction spending `outpoints` to
+    the `(value, scriptPubKey)` pairs of `outputs`, and its txid
+
+    """
+    tx = Transaction(None,
+                     2,
+                     [TransactionInput(txid, vout, b"", 0xffffffff, []) for txid, vout in outpoints],
+                     [TransactionOutput(value, scriptPubKey) for value, scriptPubKey in outputs],
+                     0)
+    return serialize_transaction(tx), get_txid(tx)
+
+def make_block(raw_txs, previousblockhash="00" * 32):
+    """Returns a serialized block of `raw_txs` and its hash
+
+    """
+    header = struct.pack("<i32s32sIII", 0x20000000, bytes.fromhex(previousblockhash)[::-1], os.urandom(32), 1700000000, 0x207fffff, 0)
+    return header + serialize_varint(len(raw_txs)) + b"".join(raw_txs), dsha256(header)[::-1].hex()
+
+class FakeChain(object):
+    """Chain of synthetic blocks answering the block RPCs of a
+    `BitcoindConnection`
+
+    """
+    def __init__(self):
+        self.blocks = []
+
+    def mine(self, raw_txs=()):
+        previousblockhash = self.blocks[-1][1] if self.blocks else "00" * 32
+        self.blocks.append(make_block(list(raw_txs), previousblockhash))
+        return len(self.blocks) - 1
+
+    def reorg(self, fork_height):
+        """Orphans every block above `fork_height`
+
+        """
+        del self.blocks[fork_height + 1:]
+
+    def getblockcount(self):
+        return len(self.blocks) - 1
+
+    def getblockhash(self, height):
+        return self.blocks[height][1]
+
+    def getblock(self, blockhash, verbosity=1):
+        for raw_block, hash_ in self.blocks:
+            if hash_ == blockhash:
+                return raw_block.hex()
+        raise KeyError(blockhash)
+
+    def batch_(self, rpc_calls):
+        return [getattr(self, method)(*params) for method, *params in rpc_calls]
+
+class LocalConnection(object):
+    """`BitcoindConnection` to a `local_bitcoind.LocalBitcoind`, without HTTP
+
+    """
+    def __init__(self, node, wallet_name=None):
+        self.node = node
+        self.wallet_name = wallet_name
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return lambda *params: self.node.call(self.wallet_name, name, list(params))
+
+    def batch_(self, rpc_calls, return_exceptions=False):
+        results = []
+        for method, *params in rpc_calls:
+            response = self.node.handle_request(self.wallet_name, {"method": method, "params": params, "id": None})
+            result = response["result"] if response["error"] is None else JSONRPCException(response["error"])
+            if isinstance(result, JSONRPCException) and not return_exceptions:
+                raise result
+            results.append(result)
+        return results
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import unittest
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed, decode_dss_signature
+
+import bitcoin_transactions as BT
+import blockvoke_codec as BC
+import revoke_certificate as RC
+from bitcoin_serialization import get_script_pushes, parse_transaction
+
+class RIPEMD160Test(unittest.TestCase):
+    VECTORS = [(b"", "9c1185a5c5e9fc54612808977ee8f548b2258d31"),
+               (b"abc", "8eb208f7e05d987a9b044a8e98c6b087f15a0bfc"),
+               (b"message digest", "5d0689ef49d2fae572b881b123a85ffa21595f36"),
+               (b"a" * 1000000, "52783243c1697bdbe16d37f97f68f08325dc1528")]
+
+    def test_pure_python_vectors(self):
+        for data, digest in self.VECTORS:
+            self.assertEqual(BT.__ripemd160__(data).hex(), digest)
+
+    def test_pure_python_matches_hashlib(self):
+        try:
+            hashlib.new("ripemd160")
+        except ValueError:
+            self.skipTest("hashlib has no RIPEMD-160")
+        # covers the padding spilling into a second block
+        for length in range(130):
+            data = os.urandom(length)
+            self.assertEqual(BT.__ripemd160__(data), hashlib.new("ripemd160", data).digest())
+
+    def test_ripemd160(self):
+        for data, digest in self.VECTORS[:3]:
+            self.assertEqual(BT.ripemd160(data).hex(), digest)
+
+class SighashTest(unittest.TestCase):
+    def test_bip143_native_p2wpkh(self):
+        tx, _ = parse_transaction(bytes.fromhex(
+            "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffff"
+            "ef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff"
+            "02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac"
+            "9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000"))
+        scriptCode = bytes.fromhex("76a9141d0f172a0ecb48aee1be1f2687d2963ae33f71a188ac")
+        self.assertEqual(BT.get_segwit_sighash(tx, 1, scriptCode, 600000000).hex(),
+                         "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670")
+
+class RevocationTransactionsTest(unittest.TestCase):
+    def assert_signature(self, signature, pubkey, sighash):
+        self.assertEqual(signature[-1], BT.SIGHASH_ALL)
+        r, s = decode_dss_signature(signature[:-1])
+        self.assertLessEqual(s, BT.SECP256K1_ORDER // 2)
+        # Raises InvalidSignature
+        ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256K1(), pubkey).verify(
+            signature[:-1], sighash, ec.ECDSA(Prehashed(hashes.SHA256())))
+
+    def create_pair(self, co_scriptPubKey):
+        co_private_key = ec.generate_private_key(ec.SECP256K1())
+        co_wif = BT.get_wif(co_private_key)
+        co_pubkey = BT.get_private_key(co_wif)[1]
+        ca_pubkey = BT.get_private_key(BT.get_wif(ec.generate_private_key(ec.SECP256K1())))[1]
+        redeemScript = BT.get_multisig_redeemScript(
+            1, [bytes.fromhex(pubkey) for pubkey in RC.get_multisig_pubkeys(co_pubkey.hex(), ca_pubkey.hex().encode())])
+
+        co_scriptPubKey = co_scriptPubKey(BT.hash160(co_pubkey))
+        utxos = [{"txid": os.urandom(32).hex(), "vout": i, "amount": amount, "scriptPubKey": co_scriptPubKey.hex()}
+                 for i, amount in enumerate(("0.00001000", "0.00000800"))]
+        txfund, txrevoke = RC.create_local_revocation_transactions(
+            BT.get_p2sh_address(redeemScript, BT.TESTNET_P2SH_VERSION),
+            ca_pubkey.hex().encode(),
+            {"scriptPubKey": co_scriptPubKey.hex()},
+            co_wif,
+            utxos,
+            BC.encode_payload(os.urandom(16), 1000, 0).hex())
+        return (co_pubkey, co_scriptPubKey, utxos, redeemScript,
+                parse_transaction(bytes.fromhex(txfund["hex"]))[0], parse_transaction(bytes.fromhex(txrevoke["hex"]))[0])
+
+    def test_signatures(self):
+        for script_type, co_scriptPubKey in (("p2wpkh", lambda pubkey_hash: bytes([BT.OP_0, 20]) + pubkey_hash),
+                                             ("p2pkh", BT.get_p2pkh_scriptPubKey)):
+            with self.subTest(script_type=script_type):
+                co_pubkey, co_scriptPubKey, utxos, redeemScript, txfund, txrevoke = self.create_pair(co_scriptPubKey)
+                amounts = {(utxo["txid"], utxo["vout"]): BT.to_satoshis(utxo["amount"]) for utxo in utxos}
+
+                for index, tx_input in enumerate(txfund.vin):
+                    if script_type == "p2wpkh":
+                        self.assertEqual(tx_input.scriptSig, b"")
+                        signature, pubkey = tx_input.witness
+                        sighash = BT.get_segwit_sighash(txfund, index, BT.get_p2pkh_scriptPubKey(BT.hash160(pubkey)),
+                                                        amounts[(tx_input.txid, tx_input.vout)])
+                    else:
+                        self.assertEqual(tx_input.witness, [])
+                        signature, pubkey = get_script_pushes(tx_input.scriptSig)
+                        sighash = BT.get_legacy_sighash(txfund, index, co_scriptPubKey)
+                    self.assertEqual(pubkey, co_pubkey)
+                    self.assert_signature(signature, pubkey, sighash)
+
+                self.assertEqual(txrevoke.vin[0].txid, txfund.txid)
+                self.assertEqual(txfund.vout[0].scriptPubKey, BT.get_p2sh_scriptPubKey(redeemScript))
+                dummy, signature, spent_redeemScript = get_script_pushes(txrevoke.vin[0].scriptSig)
+                self.assertEqual((dummy, spent_redeemScript), (b"", redeemScript))
+                self.assert_signature(signature, co_pubkey, BT.get_legacy_sighash(txrevoke, 0, redeemScript))
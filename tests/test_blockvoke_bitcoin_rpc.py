@@ -0,0 +1,78 @@
+import threading
+import unittest
+from unittest import mock
+
+import blockvoke_bitcoin_rpc as BBR
+import local_bitcoind as LB
+from blockvoke_fixtures import LocalConnection
+
+class WalletSessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.node = LB.LocalBitcoind()
+        for wallet_name in ("w0", "w1"):
+            self.node.rpc_createwallet(wallet_name)
+            self.node.rpc_unloadwallet(wallet_name)
+
+        self.unloading = threading.Event()
+        self.unload = threading.Event()
+        self.unload.set()
+        self.addCleanup(self.unload.set)
+        self.unload_error = None
+        test = self
+
+        class SlowUnloadConnection(LocalConnection):
+            def unloadwallet(self, wallet_name):
+                test.unloading.set()
+                test.unload.wait()
+                if test.unload_error is not None:
+                    raise test.unload_error
+                return self.node.call(None, "unloadwallet", [wallet_name])
+
+        patch = mock.patch("blockvoke_bitcoin_rpc.get_bitcoind_connection",
+                           lambda wallet_name=None, rpcconnect=None: SlowUnloadConnection(self.node, wallet_name))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.cache = BBR.WalletSessionCache(max_loaded_wallets=1)
+
+    def test_lazy_unloading(self):
+        self.cache.acquire("w0")
+        self.cache.release("w0")
+        self.assertEqual(self.node.rpc_listwallets(), ["w0"])
+
+        self.cache.acquire("w1")
+        self.assertEqual(self.node.rpc_listwallets(), ["w1"])
+        self.cache.release("w1")
+        self.cache.close()
+        self.assertEqual(self.node.rpc_listwallets(), [])
+
+    def test_acquire_while_unloading(self):
+        self.cache.acquire("w0")
+        self.cache.release("w0")
+
+        self.unload.clear()
+        evicting = threading.Thread(target=self.cache.acquire, args=("w1",), daemon=True)
+        evicting.start()
+        self.assertTrue(self.unloading.wait(5))
+
+        acquiring = threading.Thread(target=self.cache.acquire, args=("w0",), daemon=True)
+        acquiring.start()
+        acquiring.join(0.2)
+        self.assertTrue(acquiring.is_alive(), "w0 was acquired while bitcoind was unloading it")
+
+        self.unload.set()
+        evicting.join(5)
+        acquiring.join(5)
+        self.assertEqual(sorted(self.node.rpc_listwallets()), ["w0", "w1"])
+
+    def test_failed_unloading(self):
+        self.cache.acquire("w0")
+        self.cache.release("w0")
+
+        self.unload_error = ConnectionRefusedError()
+        with self.assertRaises(ConnectionRefusedError):
+            self.cache.acquire("w1")
+
+        # w1 is not left in use, so it can be unloaded once bitcoind is reachable
+        self.unload_error = None
+        self.cache.close()
+        self.assertEqual(self.node.rpc_listwallets(), [])
@@ -0,0 +1,65 @@
+import os
+import unittest
+
+import blockvoke_codec as BC
+import blockvoke_parser as BP
+from blockvoke_fixtures import make_block, make_revocation_transaction
+
+class PayloadTest(unittest.TestCase):
+    def test_round_trip(self):
+        fingerprint_16 = os.urandom(16)
+        payload = BC.encode_payload(fingerprint_16, 1234, 3)
+        self.assertEqual(len(payload), BC.PAYLOAD_SIZE)
+        self.assertEqual(BC.decode_payload(payload), (fingerprint_16, 1234, 3))
+        self.assertEqual(BC.decode_payload(payload.hex()), (fingerprint_16, 1234, 3))
+
+    def test_full_fingerprint(self):
+        fingerprint = os.urandom(32)
+        self.assertEqual(BC.encode_payload(fingerprint.hex(), 1, 0), BC.encode_payload(fingerprint[:16], 1, 0))
+        self.assertEqual(BC.decode_payload(BC.encode_payload(fingerprint, 1, 0)).fingerprint_16, fingerprint[:16])
+
+    def test_encode_short_fingerprint(self):
+        with self.assertRaises(ValueError):
+            BC.encode_payload(os.urandom(15), 1, 0)
+
+    def test_decode_invalid(self):
+        payload = BC.encode_payload(os.urandom(16), 1, 0)
+        for invalid in (payload[:-1], payload + b"\x00", b"", "zz" * BC.PAYLOAD_SIZE, b"NotVoke!\x00\x00" + payload[10:]):
+            with self.subTest(invalid=invalid):
+                with self.assertRaises(ValueError):
+                    BC.decode_payload(invalid)
+
+@unittest.skipIf(BC.np is None, "numpy is not installed")
+class DecodePayloadsTest(unittest.TestCase):
+    def test_mixed_validity(self):
+        fingerprints_16 = [os.urandom(16) for _ in range(3)]
+        payloads = [BC.encode_payload(fingerprints_16[0], 10, 1),
+                    BC.encode_payload(fingerprints_16[1], 20, 2)[:-1],
+                    "zz" * BC.PAYLOAD_SIZE,
+                    BC.encode_payload(fingerprints_16[2], 30, 3).hex(),
+                    b"NotVoke!\x00\x00" + BC.encode_payload(fingerprints_16[1], 20, 2)[10:]]
+
+        records, valid = BC.decode_payloads(payloads)
+        self.assertEqual(valid.tolist(), [True, False, False, True, False])
+        self.assertEqual(records["days"].tolist(), [10, 0, 0, 30, 0])
+        self.assertEqual(records["revocation_code"].tolist(), [1, 0, 0, 3, 0])
+        self.assertEqual(BC.get_fingerprint_16_hex(records["fingerprint_16"][valid]).tolist(),
+                         [fingerprints_16[0].hex().encode(), fingerprints_16[2].hex().encode()])
+
+    def test_empty(self):
+        records, valid = BC.decode_payloads([])
+        self.assertEqual(len(records), 0)
+        self.assertEqual(len(valid), 0)
+        self.assertEqual(len(BC.get_fingerprint_16_hex(records["fingerprint_16"])), 0)
+
+class ParserValidationTest(unittest.TestCase):
+    def test_raw_revocations_skip_invalid_payloads(self):
+        fingerprint_16 = os.urandom(16).hex()
+        raw_txs = [make_revocation_transaction(fingerprint_16)[0],
+                   # A BlockVoke identifier without the rest of the payload
+                   make_revocation_transaction(None, BC.BLOCKVOKE_IDENTIFIER + os.urandom(16))[0],
+                   make_revocation_transaction(None, BC.encode_payload(os.urandom(16), 1, 0) + b"\x00")[0]]
+
+        self.assertEqual(len(BP.get_raw_transaction_OP_RETURNs(raw_txs)), 3)
+        self.assertEqual(BP.get_revocations_from_raw_transactions(raw_txs), [fingerprint_16])
+        self.assertEqual(BP.get_revocations_from_raw_block(make_block(raw_txs)[0]), [fingerprint_16])
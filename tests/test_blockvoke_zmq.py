@@ -0,0 +1,130 @@
+import os
+import struct
+import unittest
+
+from blockvoke_fixtures import make_block, make_revocation_transaction
+
+try:
+    import zmq
+    import blockvoke_zmq as BZ
+    import local_zmq_publisher as LZ
+except ImportError:
+    zmq = None
+
+@unittest.skipIf(zmq is None, "pyzmq is not installed")
+class BlockVokeZMQSubscriberTest(unittest.TestCase):
+    def setUp(self):
+        self.mempool_revocations = []
+        self.raw_blocks = []
+        self.missed_topics = []
+        self.disconnected_blocks = []
+
+        self.publisher = LZ.ZMQPublisher("tcp://127.0.0.1:*")
+        self.subscriber = BZ.BlockVokeZMQSubscriber([self.publisher.endpoint],
+                                                    self.mempool_revocations.extend,
+                                                    self.raw_blocks.append,
+                                                    self.missed_topics.append,
+                                                    self.disconnected_blocks.append,
+                                                    receive_timeout=50)
+
+        # A SUB socket only gets messages once its subscription reached the
+        # publisher, so publish ignored removals until one arrives
+        for _ in range(100):
+            self.publisher.transaction_removed("00" * 32)
+            if self.subscriber.receive():
+                break
+        else:
+            self.fail("The subscriber never connected")
+        self.receive_all()
+
+    def tearDown(self):
+        self.subscriber.close()
+        self.publisher.close()
+
+    def receive_all(self):
+        while self.subscriber.receive():
+            pass
+
+    def test_mempool_transaction(self):
+        fingerprint_16 = os.urandom(16).hex()
+        raw_tx, txid = make_revocation_transaction(fingerprint_16)
+
+        self.publisher.transaction_added(raw_tx, txid)
+        self.receive_all()
+
+        self.assertEqual(self.mempool_revocations, [fingerprint_16])
+        self.assertEqual(self.missed_topics, [])
+
+    def test_invalid_payload(self):
+        raw_tx, txid = make_revocation_transaction(None, b"BlockVoke\x00" + os.urandom(16))
+
+        self.publisher.transaction_added(raw_tx, txid)
+        self.receive_all()
+
+        self.assertEqual(self.mempool_revocations, [])
+
+    def test_block_transaction_is_not_a_mempool_revocation(self):
+        raw_tx, txid = make_revocation_transaction(os.urandom(16).hex())
+        raw_block, blockhash = make_block([raw_tx])
+
+        self.publisher.block_connected(raw_block, [raw_tx], blockhash)
+        self.receive_all()
+
+        self.assertEqual(self.mempool_revocations, [])
+        self.assertEqual(self.raw_blocks, [raw_block])
+        # A later "A" of the same txid, e.g. after a reorg, is a mempool entry again
+        self.publisher.transaction_added(raw_tx, txid)
+        self.receive_all()
+        self.assertEqual(len(self.mempool_revocations), 1)
+
+    def test_mempool_transaction_mined_later(self):
+        fingerprint_16 = os.urandom(16).hex()
+        raw_tx, txid = make_revocation_transaction(fingerprint_16)
+        raw_block, blockhash = make_block([raw_tx])
+
+        self.publisher.transaction_added(raw_tx, txid)
+        self.publisher.block_connected(raw_block, [raw_tx], blockhash)
+        self.receive_all()
+
+        self.assertEqual(self.mempool_revocations, [fingerprint_16])
+        self.assertEqual(self.raw_blocks, [raw_block])
+
+    def test_acceptance_before_rawtx(self):
+        fingerprint_16 = os.urandom(16).hex()
+        raw_tx, txid = make_revocation_transaction(fingerprint_16)
+
+        # Possible when the topics are published on different endpoints
+        self.publisher.publish("sequence", bytes.fromhex(txid) + b"A" + struct.pack("<Q", 1))
+        self.publisher.publish("rawtx", raw_tx)
+        self.receive_all()
+
+        self.assertEqual(self.mempool_revocations, [fingerprint_16])
+
+    def test_sequence_gap(self):
+        # The first message of a topic only sets the expected sequence number
+        self.publisher.transaction_added(*make_revocation_transaction(os.urandom(16).hex()))
+        self.receive_all()
+        self.assertEqual(self.missed_topics, [])
+
+        self.publisher.skip("rawtx", 3)
+        self.publisher.transaction_added(*make_revocation_transaction(os.urandom(16).hex()))
+        self.receive_all()
+        self.assertEqual(self.missed_topics, ["rawtx"])
+
+        self.publisher.skip("sequence")
+        self.publisher.transaction_removed("00" * 32)
+        self.receive_all()
+        self.assertEqual(self.missed_topics, ["rawtx", "sequence"])
+
+    def test_block_disconnected(self):
+        raw_block, blockhash = make_block([])
+
+        self.publisher.block_connected(raw_block, [], blockhash)
+        self.publisher.block_disconnected(blockhash)
+        self.receive_all()
+
+        self.assertEqual(self.disconnected_blocks, [blockhash])
+        self.assertEqual(self.missed_topics, [])
+
+if __name__ == "__main__":
+    unittest.main()
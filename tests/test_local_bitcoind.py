@@ -0,0 +1,201 @@
+import asyncio
+import os
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import blockvoke_async as BA
+import blockvoke_codec as BC
+import blockvoke_parser as BP
+import local_bitcoind as LB
+from bitcoin_transactions import get_nulldata_scriptPubKey
+from blockvoke_bitcoin_rpc import JSONRPCException
+from blockvoke_fixtures import LocalConnection, make_transaction
+
+try:
+    import zmq
+    import blockvoke_zmq as BZ
+    import local_zmq_publisher as LZ
+except ImportError:
+    zmq = None
+
+FEE = 1000
+
+class LocalBitcoindTestCase(unittest.TestCase):
+    def setUp(self):
+        self.node = self.new_node()
+        self.call(None, "createwallet", "w")
+        self.address = self.call("w", "getnewaddress")
+        # Makes the coinbases of blocks 1 and 2 spendable
+        self.call(None, "generatetoaddress", LB.COINBASE_MATURITY + 2, self.address)
+
+    def new_node(self):
+        return LB.LocalBitcoind()
+
+    def call(self, wallet_name, method, *params):
+        return self.node.call(wallet_name, method, list(params))
+
+    def get_coinbase_outpoint(self, height):
+        return self.call(None, "getblock", self.call(None, "getblockhash", height), 1)["tx"][0], 0
+
+    def spend(self, outpoint, fee=FEE, scriptPubKey=LB.OP_TRUE_SCRIPT, payload=None):
+        """Returns an unsigned transaction spending `outpoint` to
+        `scriptPubKey`, with an OP_RETURN of `payload` if given, and its txid
+
+        The node does not run scripts, so no signature is needed.
+
+        """
+        value = LB.BT.to_satoshis(self.call(None, "gettxout", outpoint[0], outpoint[1], False)["value"]) - fee
+        outputs = [(value, scriptPubKey)]
+        if payload is not None:
+            outputs.insert(0, (0, get_nulldata_scriptPubKey(payload)))
+        raw_tx, txid = make_transaction([outpoint], outputs)
+        return raw_tx.hex(), txid
+
+    def assert_rejected(self, hexstring, code, reason):
+        with self.assertRaises(JSONRPCException) as context:
+            self.call(None, "sendrawtransaction", hexstring)
+        self.assertEqual(context.exception.code, code)
+        self.assertIn(reason, context.exception.message)
+
+class LocalBitcoindTest(LocalBitcoindTestCase):
+    def test_create_fund_sign_send_mine(self):
+        address = self.call("w", "getnewaddress", "destination")
+        funded_tx = self.call("w", "fundrawtransaction", self.call(None, "createrawtransaction", [], {address: Decimal("1.5")}))
+        signed_tx = self.call("w", "signrawtransactionwithwallet", funded_tx["hex"])
+        self.assertTrue(signed_tx["complete"])
+
+        txid = self.call(None, "sendrawtransaction", signed_tx["hex"])
+        self.assertEqual(self.call(None, "getrawmempool"), [txid])
+        self.assertEqual(self.call(None, "getmempoolentry", txid)["fees"]["base"], funded_tx["fee"])
+        for tx_input in self.call(None, "decoderawtransaction", signed_tx["hex"])["vin"]:
+            self.assertIsNone(self.call(None, "gettxout", tx_input["txid"], tx_input["vout"]))
+
+        height = self.call(None, "getblockcount")
+        blockhash, = self.call(None, "generatetoaddress", 1, self.address)
+        self.assertEqual(self.call(None, "getblockcount"), height + 1)
+        self.assertIn(txid, self.call(None, "getblock", blockhash, 1)["tx"])
+        self.assertEqual(self.call(None, "getrawmempool"), [])
+        self.assertEqual(self.call(None, "getrawtransaction", txid, True)["confirmations"], 1)
+        vout = 1 - funded_tx["changepos"] if funded_tx["changepos"] >= 0 else 0
+        self.assertEqual(self.call(None, "gettxout", txid, vout)["value"], Decimal("1.5"))
+        self.assertEqual(self.call("w", "getaddressesbylabel", "destination"), {address: {"purpose": "receive"}})
+
+    def test_missing_inputs(self):
+        raw_tx, txid = make_transaction([(os.urandom(32).hex(), 0)], [(FEE, LB.OP_TRUE_SCRIPT)])
+        self.assert_rejected(raw_tx.hex(), LB.RPC_VERIFY_ERROR, "bad-txns-inputs-missingorspent")
+
+    def test_double_spend(self):
+        outpoint = self.get_coinbase_outpoint(1)
+        raw_tx, txid = self.spend(outpoint)
+        self.assertEqual(self.call(None, "sendrawtransaction", raw_tx), txid)
+        # Sending it again is not an error
+        self.assertEqual(self.call(None, "sendrawtransaction", raw_tx), txid)
+
+        double_spend, _ = self.spend(outpoint, 2 * FEE)
+        self.assert_rejected(double_spend, LB.RPC_VERIFY_REJECTED, "txn-mempool-conflict")
+
+        self.call(None, "generatetoaddress", 1, self.address)
+        self.assert_rejected(raw_tx, LB.RPC_VERIFY_ALREADY_IN_CHAIN, "already in block chain")
+        self.assert_rejected(double_spend, LB.RPC_VERIFY_ERROR, "bad-txns-inputs-missingorspent")
+
+    def test_premature_spend_of_coinbase(self):
+        height = self.call(None, "getblockcount")
+        raw_tx, _ = self.spend(self.get_coinbase_outpoint(height - LB.COINBASE_MATURITY + 2))
+        self.assert_rejected(raw_tx, LB.RPC_VERIFY_REJECTED, "bad-txns-premature-spend-of-coinbase")
+
+        self.call(None, "generatetoaddress", 1, self.address)
+        self.call(None, "sendrawtransaction", raw_tx)
+
+    def test_min_relay_fee(self):
+        raw_tx, _ = self.spend(self.get_coinbase_outpoint(1), fee=0)
+        self.assert_rejected(raw_tx, LB.RPC_VERIFY_REJECTED, "min relay fee not met")
+
+        self.node.min_relay_fee_rate = Decimal(0)
+        self.call(None, "sendrawtransaction", raw_tx)
+
+    def test_dust(self):
+        scriptPubKey = LB.BT.get_address_scriptPubKey(self.address)
+        outpoint = self.get_coinbase_outpoint(1)
+        value = LB.BT.to_satoshis(self.call(None, "gettxout", outpoint[0], outpoint[1])["value"])
+        raw_tx, _ = make_transaction([outpoint], [(value - FEE - 100, scriptPubKey), (100, scriptPubKey)])
+
+        self.node.require_standard = True
+        self.assert_rejected(raw_tx.hex(), LB.RPC_VERIFY_REJECTED, "dust")
+        self.node.require_standard = False
+        self.call(None, "sendrawtransaction", raw_tx.hex())
+
+@unittest.skipIf(zmq is None, "pyzmq is not installed")
+class MempoolTrackerTest(LocalBitcoindTestCase):
+    def setUp(self):
+        super().setUp()
+        self.unreachable = False
+        test = self
+
+        class UnreachableConnection(LocalConnection):
+            def getrawtransaction(self, txid, verbose=False):
+                if test.unreachable:
+                    raise ConnectionRefusedError()
+                return self.node.call(None, "getrawtransaction", [txid, verbose])
+
+        class AsyncUnreachableConnection(UnreachableConnection):
+            def __getattr__(self, name):
+                call = LocalConnection.__getattr__(self, name)
+                async def async_call(*params):
+                    return call(*params)
+                return async_call
+
+            async def getrawtransaction(self, txid, verbose=False):
+                return UnreachableConnection.getrawtransaction(self, txid, verbose)
+
+        for target, connection in (("blockvoke_parser.get_bitcoind_connection", UnreachableConnection),
+                                   ("blockvoke_async.get_async_bitcoind_connection", AsyncUnreachableConnection)):
+            patch = mock.patch(target, lambda rpcconnect=None, connection=connection: connection(self.node))
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_poll_retries_after_connection_error(self):
+        for name, tracker, poll in (("sync", BP.MempoolTracker(), lambda tracker: tracker.poll()),
+                                    ("async", BA.AsyncMempoolTracker(), lambda tracker: asyncio.run(tracker.poll()))):
+            with self.subTest(name):
+                self.call(None, "generatetoaddress", 1, self.address)
+                poll(tracker)
+                hexstring, txid = self.spend(self.get_coinbase_outpoint(self.call(None, "getblockcount") - LB.COINBASE_MATURITY))
+                self.call(None, "sendrawtransaction", hexstring)
+
+                self.unreachable = True
+                self.assertEqual(poll(tracker), [])
+                self.unreachable = False
+                self.assertEqual([tx["txid"] for tx in poll(tracker)], [txid])
+                self.assertEqual(poll(tracker), [])
+
+class LocalBitcoindZMQTest(LocalBitcoindTestCase):
+    def new_node(self):
+        self.publisher = LZ.ZMQPublisher("tcp://127.0.0.1:*")
+        self.addCleanup(self.publisher.close)
+        return LB.LocalBitcoind(zmq_publisher=self.publisher)
+
+    def test_notifications(self):
+        mempool_revocations, raw_blocks = [], []
+        subscriber = BZ.BlockVokeZMQSubscriber([self.publisher.endpoint], mempool_revocations.extend, raw_blocks.append,
+                                               receive_timeout=50)
+        self.addCleanup(subscriber.close)
+        # Publishes ignored removals until the subscription reaches the publisher
+        for _ in range(100):
+            self.publisher.transaction_removed("00" * 32)
+            if subscriber.receive():
+                break
+        else:
+            self.fail("The subscriber never connected")
+
+        fingerprint_16 = os.urandom(16).hex()
+        raw_tx, txid = self.spend(self.get_coinbase_outpoint(1), payload=BC.encode_payload(fingerprint_16, 1000, 1))
+        self.call(None, "sendrawtransaction", raw_tx)
+        self.call(None, "generatetoaddress", 1, self.address)
+        while subscriber.receive():
+            pass
+
+        self.assertEqual(mempool_revocations, [fingerprint_16])
+        self.assertEqual(len(raw_blocks), 1)
+        self.assertEqual(raw_blocks[0].hex(), self.call(None, "getblock", self.call(None, "getbestblockhash"), 0))
+        self.assertEqual(BP.get_revocations_from_raw_block(raw_blocks[0]), [fingerprint_16])
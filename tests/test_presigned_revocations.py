@@ -0,0 +1,143 @@
+import os
+import asyncio
+import tempfile
+import importlib.util
+import unittest
+from unittest import mock
+
+import blockvoke_codec as BC
+import local_bitcoind as LB
+import presigned_revocations as PR
+from blockvoke_bitcoin_rpc import JSONRPCException
+from bitcoin_transactions import get_nulldata_scriptPubKey
+from blockvoke_fixtures import LocalConnection, make_transaction
+
+FEE = 1000
+
+def load_script(file_name):
+    spec = importlib.util.spec_from_file_location(file_name[:-3].replace("-", "_"),
+                                                  os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), file_name))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+class AsyncLocalConnection(LocalConnection):
+    async def batch_(self, rpc_calls, return_exceptions=False):
+        return LocalConnection.batch_(self, rpc_calls, return_exceptions)
+
+class SendPresignedRevocationTest(unittest.TestCase):
+    def setUp(self):
+        self.node = LB.LocalBitcoind()
+        for _ in range(LB.COINBASE_MATURITY + 3):
+            self.node.mine_block(LB.OP_TRUE_SCRIPT)
+        patch = mock.patch("presigned_revocations.get_bitcoind_connection", lambda rpcconnect=None: LocalConnection(self.node))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = PR.PresignedRevocationStore(os.path.join(self.tmpdir.name, "presigned.sqlite"))
+        self.addCleanup(self.store.close)
+
+        self.txfund_txid, self.txrevoke_txid = self.presign(1)
+
+    def presign(self, coinbase_height, txrevoke_fee=FEE):
+        """Stores the pair of `c0.example` spending the mature coinbase at
+        `coinbase_height` as the coins of its CO address, unsigned as the
+        local node does not run scripts
+
+        """
+        self.coinbase_outpoint = (self.node.blocks[coinbase_height].txids[0], 0)
+        value = self.node.utxos[self.coinbase_outpoint].value - FEE
+        txfund_raw, txfund_txid = make_transaction([self.coinbase_outpoint], [(value, LB.OP_TRUE_SCRIPT)])
+        payload = BC.encode_payload(os.urandom(16).hex(), 1000, 1)
+        txrevoke_raw, txrevoke_txid = make_transaction([(txfund_txid, 0)],
+                                                       [(0, get_nulldata_scriptPubKey(payload)),
+                                                        (value - txrevoke_fee, LB.OP_TRUE_SCRIPT)])
+        self.store.add("c0.example", 0, {"txid": txfund_txid, "hex": txfund_raw.hex()}, {"txid": txrevoke_txid, "hex": txrevoke_raw.hex()})
+        return txfund_txid, txrevoke_txid
+
+    def send(self, submit_package):
+        return PR.send_presigned_revocation(self.store, "c0.example", 0, submit_package=submit_package)
+
+    def test_send(self):
+        for submit_package in (False, True):
+            with self.subTest(submit_package=submit_package):
+                self.assertEqual(self.send(submit_package), (self.txfund_txid, self.txrevoke_txid))
+                self.assertIn(self.txfund_txid, self.node.mempool)
+                self.assertIn(self.txrevoke_txid, self.node.mempool)
+
+    def test_unknown_revocation_code(self):
+        self.assertIsNone(PR.send_presigned_revocation(self.store, "c0.example", 1))
+        self.assertIsNone(PR.send_presigned_revocation(self.store, "c1.example", 0))
+
+    def test_already_mined(self):
+        self.send(False)
+        self.node.mine_block(LB.OP_TRUE_SCRIPT)
+        self.assertNotIn(self.txrevoke_txid, self.node.mempool)
+
+        with self.assertRaises(JSONRPCException) as context:
+            self.node.call(None, "sendrawtransaction", [self.node.transactions[self.txfund_txid].hex()])
+        self.assertEqual(context.exception.code, PR.RPC_VERIFY_ALREADY_IN_CHAIN)
+        self.assertEqual(self.send(False), (self.txfund_txid, self.txrevoke_txid))
+
+    def test_already_in_mempool(self):
+        already_in_mempool = {"code": PR.RPC_VERIFY_REJECTED, "message": "txn-already-in-mempool"}
+        with mock.patch.object(LocalConnection, "batch_", lambda self, rpc_calls, return_exceptions=False:
+                               [JSONRPCException(already_in_mempool)] * len(rpc_calls)):
+            self.assertEqual(self.send(False), (self.txfund_txid, self.txrevoke_txid))
+
+    def test_txfund_rejected(self):
+        for submit_package in (False, True):
+            with self.subTest(submit_package=submit_package):
+                # The coins of the CO address are spent by another transaction
+                self.txfund_txid, self.txrevoke_txid = self.presign(1 + submit_package)
+                value = self.node.utxos[self.coinbase_outpoint].value - 2 * FEE
+                self.node.call(None, "sendrawtransaction",
+                               [make_transaction([self.coinbase_outpoint], [(value, LB.OP_TRUE_SCRIPT)])[0].hex()])
+                with self.assertRaises(PR.TxFundRejected):
+                    self.send(submit_package)
+                self.node.mine_block(LB.OP_TRUE_SCRIPT)
+                with self.assertRaises(PR.TxFundRejected):
+                    self.send(submit_package)
+
+    def test_txrevoke_rejected(self):
+        for submit_package in (False, True):
+            with self.subTest(submit_package=submit_package):
+                self.txfund_txid, self.txrevoke_txid = self.presign(2 + submit_package, txrevoke_fee=0)
+                with self.assertRaises(JSONRPCException) as context:
+                    self.send(submit_package)
+                self.assertIsInstance(context.exception, PR.TxRevokeRejected)
+                self.assertIn(self.txfund_txid, self.node.mempool)
+
+    def test_send_revocation_of_rejected_txrevoke(self):
+        script = load_script("revoke-test-certificates.py")
+        script.presigned_store = self.store
+        patch = mock.patch("presigned_revocations.get_async_bitcoind_connection",
+                           lambda rpcconnect=None: AsyncLocalConnection(self.node))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        for send_revocation in (script.send_revocation, lambda DNS: asyncio.run(script.send_revocation_async(DNS))):
+            with self.subTest(send_revocation=send_revocation):
+                self.txfund_txid, self.txrevoke_txid = self.presign(2 + (send_revocation is not script.send_revocation),
+                                                                    txrevoke_fee=0)
+                # Not signed again: the new pair would conflict with the TX:Fund
+                with mock.patch("revoke_certificate.revoke_certificate") as revoke_certificate, \
+                     mock.patch("revoke_certificate.async_revoke_certificate") as async_revoke_certificate:
+                    self.assertEqual(send_revocation("c0.example"), (self.txfund_txid, None))
+                revoke_certificate.assert_not_called()
+                async_revoke_certificate.assert_not_called()
+                self.assertIn(self.txfund_txid, self.node.mempool)
+                self.assertIsNotNone(self.store.get("c0.example", 0))
+
+    def test_send_revocation_of_unreachable_node(self):
+        script = load_script("revoke-test-certificates.py")
+        script.presigned_store = self.store
+
+        def post(rpc_calls, return_exceptions=False):
+            raise ConnectionRefusedError(111, "Connection refused")
+
+        with mock.patch.object(LocalConnection, "batch_", side_effect=post):
+            self.assertEqual(script.send_revocation("c0.example"), (None, None))
+        self.assertIsNotNone(self.store.get("c0.example", 0))
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import revocation_index as RI
+from blockvoke_fixtures import FakeChain, make_revocation_transaction
+
+class RevocationIndexSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.chain = FakeChain()
+        patches = [mock.patch("blockvoke_parser.get_bitcoind_connection", lambda rpcconnect=None: self.chain),
+                   mock.patch("block_scanner.get_bitcoind_connection", lambda rpcconnect=None: self.chain)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.index = RI.RevocationIndex(os.path.join(self.tmpdir.name, "index.sqlite"))
+        self.addCleanup(self.index.close)
+
+    def mine_revocation(self):
+        fingerprint_16 = os.urandom(16).hex()
+        return fingerprint_16, self.chain.mine([make_revocation_transaction(fingerprint_16)[0]])
+
+    def assert_index_follows_chain(self):
+        self.assertEqual(self.index.get_indexed_height(), self.chain.getblockcount())
+        for height in range(self.chain.getblockcount() + 1):
+            self.assertEqual(self.index.get_block_hash(height), self.chain.getblockhash(height))
+
+    def test_sync(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                self.chain.mine()
+                fingerprint_16, height = self.mine_revocation()
+                for _ in range(10):
+                    self.chain.mine()
+
+                self.index.sync(workers=workers, max_reorg_depth=3)
+
+                self.assertEqual(self.index.get_revocation(fingerprint_16).block_height, height)
+                self.assert_index_follows_chain()
+
+    def test_reorg_of_stale_index_before_backfill(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                self.chain.reorg(-1)
+                self.index.rollback(-1)
+                for _ in range(10):
+                    self.chain.mine()
+                orphaned_fingerprint_16, height = self.mine_revocation()
+                self.index.sync(workers=workers, max_reorg_depth=5)
+                self.assertTrue(self.index.is_revoked(orphaned_fingerprint_16))
+
+                # The indexed tip is orphaned while the index is not synced,
+                # and the new chain grows past the backfill depth
+                self.chain.reorg(height - 2)
+                for _ in range(5):
+                    self.chain.mine()
+                fingerprint_16, height = self.mine_revocation()
+                for _ in range(20):
+                    self.chain.mine()
+
+                self.index.sync(workers=workers, max_reorg_depth=5)
+
+                self.assertFalse(self.index.is_revoked(orphaned_fingerprint_16))
+                self.assertEqual(self.index.get_revocation(fingerprint_16).block_height, height)
+                self.assert_index_follows_chain()
+
+if __name__ == "__main__":
+    unittest.main()
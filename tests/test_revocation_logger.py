@@ -0,0 +1,172 @@
+import os
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+import revocation_logger as RL
+
+try:
+    import revocation_log_columns as RLC
+except ImportError:
+    RLC = None
+
+class RevocationLoggerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.journal_path = os.path.join(self.tmpdir.name, "TEST.journal")
+        self.fingerprints = [os.urandom(32).hex() for _ in range(4)]
+
+    def new_logger(self):
+        """Returns a logger journaling to `journal_path` with a certificate per fingerprint
+
+        """
+        rev_logger = RL.RevocationLogger()
+        rev_logger.open_journal(self.journal_path)
+        for i, fingerprint in enumerate(self.fingerprints):
+            rev_logger.add_certificate("c{}.example".format(i), fingerprint, os.urandom(33).hex(), "02" * 33, "2N")
+        return rev_logger
+
+    def reopen(self):
+        rev_logger = RL.RevocationLogger()
+        rev_logger.read(os.path.join(self.tmpdir.name, "TEST.csv"), self.journal_path)
+        return rev_logger
+
+class JournalTest(RevocationLoggerTestCase):
+    def test_resumed_runs_replay_without_errors(self):
+        rev_logger = RL.RevocationLogger()
+        rev_logger.open_journal(self.journal_path)
+        rev_logger.add_certificate("c0.example", self.fingerprints[0], os.urandom(33).hex(), "02" * 33, "2N")
+        rev_logger.close_journal()
+
+        for i in range(1, 3):
+            with self.assertNoLogs(level=logging.ERROR):
+                rev_logger = self.reopen()
+            rev_logger.open_journal(self.journal_path)
+            rev_logger.set_co_funded("c0.example")
+            rev_logger.tx_pair_sent("c0.example", "{:064x}".format(i), "{:064x}".format(i))
+            rev_logger.close_journal()
+            rev_logger.certificates["c0.example"].co_funded = False
+
+        with open(self.journal_path, "rb") as journal:
+            self.assertNotIn(b"\n\n", journal.read())
+
+    def test_torn_record(self):
+        rev_logger = self.new_logger()
+        rev_logger.set_co_funded("c1.example")
+        rev_logger.close_journal()
+        with open(self.journal_path, "a") as journal:
+            journal.write('["c2.example", {"CO_fu')
+
+        with self.assertLogs(level=logging.ERROR):
+            rev_logger = self.reopen()
+        rev_logger.open_journal(self.journal_path)
+        rev_logger.set_co_funded("c3.example")
+        rev_logger.close_journal()
+
+        rev_logger = self.reopen()
+        self.assertTrue(rev_logger.certificates["c1.example"].co_funded)
+        self.assertTrue(rev_logger.certificates["c3.example"].co_funded)
+        self.assertFalse(rev_logger.certificates["c2.example"].co_funded)
+
+class ProgressTest(RevocationLoggerTestCase):
+    def test_read_counts_once(self):
+        rev_logger = self.new_logger()
+        for i, fingerprint in enumerate(self.fingerprints):
+            rev_logger.set_co_funded("c{}.example".format(i))
+            rev_logger.tx_pair_sent("c{}.example".format(i), "{:064x}".format(i), "{:064x}".format(i))
+            rev_logger.cert_revoked_from_mempool(fingerprint[:32], "", "")
+        self.assertTrue(rev_logger.all_revoked.is_set())
+        self.assertFalse(rev_logger.all_mined.is_set())
+        rev_logger.compact(os.path.join(self.tmpdir.name, "TEST.csv"))
+        rev_logger.cert_revoked_from_blockchain(self.fingerprints[0][:32], "", "", 100, 1700000000)
+        rev_logger.close_journal()
+
+        with mock.patch.object(RL.RevocationLogger, "__update_progress__", autospec=True,
+                               side_effect=RL.RevocationLogger.__update_progress__) as update_progress:
+            reread = self.reopen()
+        self.assertEqual(update_progress.call_count, 1)
+        self.assertEqual(reread.get_progress(), (4, 4, 1))
+        self.assertTrue(reread.all_revoked.is_set())
+        self.assertFalse(reread.all_mined.is_set())
+
+        reread.add_certificate("c4.example", os.urandom(32).hex(), os.urandom(33).hex(), "02" * 33, "2N")
+        self.assertEqual(reread.get_progress(), (4, 4, 1))
+        self.assertFalse(reread.all_revoked.is_set())
+
+def get_rows(rev_logger):
+    return {cert_dns_name: certificate.to_row() for cert_dns_name, certificate in rev_logger.certificates.items()}
+
+@unittest.skipIf(RLC is None or RLC.np is None, "numpy is not installed")
+class ColumnsLogTest(RevocationLoggerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.csv_path = os.path.join(self.tmpdir.name, "TEST.csv")
+        self.columns_path = os.path.join(self.tmpdir.name, "TEST" + RL.COLUMNS_LOG_SUFFIX)
+
+        rev_logger = self.new_logger()
+        for i in range(3):
+            rev_logger.set_co_funded("c{}.example".format(i))
+        rev_logger.tx_pair_sent("c0.example", "aa" * 32, "bb" * 32)
+        rev_logger.cert_revoked_from_mempool(self.fingerprints[0][:32], "", "")
+        rev_logger.cert_revoked_from_blockchain(self.fingerprints[0][:32], "", "", 100, 1700000000)
+        rev_logger.write(self.columns_path)
+        rev_logger.close_journal()
+        os.remove(self.journal_path)
+        self.rev_logger = rev_logger
+
+    def test_lazy_read(self):
+        rev_logger = RL.RevocationLogger()
+        rev_logger.read(self.columns_path)
+
+        self.assertIsInstance(rev_logger.certificates, RLC.ColumnsCertificates)
+        self.assertEqual(rev_logger.get_progress(), (1, 1, 1))
+        self.assertEqual(rev_logger.get_unsent_dns_names(), ["c1.example", "c2.example"])
+        self.assertEqual(get_rows(rev_logger), get_rows(self.rev_logger))
+        self.assertIs(rev_logger.__find_certificate__(self.fingerprints[2][:32]), rev_logger.certificates["c2.example"])
+
+    def test_transitions_and_compaction(self):
+        rev_logger = RL.RevocationLogger()
+        rev_logger.read(self.columns_path, self.journal_path)
+        rev_logger.open_journal(self.journal_path, self.columns_path)
+
+        # The txid columns of the snapshot are all empty, so they have to widen
+        rev_logger.tx_pair_sent("c1.example", "cc" * 32, "dd" * 32)
+        rev_logger.cert_revoked_from_mempool(self.fingerprints[1][:32], "", "")
+        rev_logger.add_certificate("c4.example", os.urandom(32).hex(), os.urandom(33).hex(), "02" * 33, "2N")
+        rev_logger.rollback_blockchain_revocations(99)
+        self.assertEqual(rev_logger.get_progress(), (2, 2, 0))
+
+        rev_logger.compact(self.columns_path)
+        rev_logger.close_journal()
+
+        reread = RL.RevocationLogger()
+        with mock.patch.object(RL.RevocationLogger, "__recount__", autospec=True, side_effect=RL.RevocationLogger.__recount__) as recount:
+            reread.read(self.columns_path, self.journal_path)
+        self.assertEqual(recount.call_count, 1)
+        self.assertEqual(len(reread.certificates), 5)
+        self.assertEqual(get_rows(reread), get_rows(rev_logger))
+        self.assertEqual(reread.get_progress(), (2, 2, 0))
+        self.assertEqual(reread.certificates["c1.example"].txrevoke_txid, "dd" * 32)
+
+    def test_csv_readers_after_columns_compaction(self):
+        self.rev_logger.write(self.csv_path)
+        os.utime(self.columns_path, (0, 0))
+
+        rev_logger = RL.RevocationLogger()
+        rev_logger.read(self.columns_path, self.journal_path)
+        rev_logger.open_journal(self.journal_path, self.columns_path)
+        rev_logger.tx_pair_sent("c1.example", "cc" * 32, "dd" * 32)
+        rev_logger.compact(self.columns_path)
+        rev_logger.tx_pair_sent("c2.example", "ee" * 32, "ff" * 32)
+        rev_logger.close_journal()
+
+        # The CSV snapshot is older than the journal, so the binary log is read
+        csv_reader = RL.RevocationLogger()
+        csv_reader.read(self.csv_path, self.journal_path)
+        self.assertEqual(get_rows(csv_reader), get_rows(rev_logger))
+        self.assertEqual(csv_reader.get_unsent_dns_names(), [])
+
+if __name__ == "__main__":
+    unittest.main()